@@ -2,35 +2,103 @@
 Analytics Service API
 """
 
+import asyncio
 import os
-import json
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, Request, Response, HTTPException, Depends, Form
-from pydantic import BaseModel
+from typing import Annotated, Dict, Any, List, Literal, Optional, Union
+from fastapi import Body, FastAPI, Request, Response, HTTPException, Depends, Form
+from pydantic import AfterValidator, BaseModel, Field, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
-from sqlalchemy.orm import Session as DBSession
+from fastapi.responses import HTMLResponse, FileResponse
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 import time
 
 from config import settings
-from database import init_db, get_db, User, AdminLog, GeneratedModel, Session
+from database import (
+    init_db,
+    get_db,
+    AsyncSessionLocal,
+    get_pool_status,
+    User,
+    AdminLog,
+    GeneratedModel,
+    Session,
+)
 from auth import (
     SessionManager,
     RateLimiter,
+    last_seen_tracker,
     get_current_session,
     require_session,
     check_admin_password,
     generate_csrf_token,
 )
 from tracking import AnalyticsTracker
-from migration import migrate_existing_data
+from cache import stats_cache
+from ingest import (
+    event_buffer,
+    page_view_buffer,
+    replay_spill_logs,
+    sync_spill_logs,
+)
+from ratelimit import RateLimitMiddleware
+from tasks import PeriodicTask
+from migration import (
+    migrate_existing_data,
+    migrate_page_view_dimensions,
+    migrate_page_view_sample_weight,
+    migrate_pseudo_path_events,
+    migrate_to_partitioned_tables,
+)
+from partitions import maintain_partitions
+from compaction import compact_raw_tables
+from rollups import BUCKET_WIDTHS, backfill as backfill_rollups, top_items_tracker
+from sampling import sample_weight, sampling_rates
+
+
+def _reject_nul(value: Any) -> Any:
+    """Reject NUL characters anywhere in value
+
+    Postgres cannot store them in text or JSONB, so a tracked row holding
+    one would fail every write of its batch.
+    """
+    if isinstance(value, str):
+        if "\x00" in value:
+            raise ValueError("NUL characters are not allowed")
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _reject_nul(key)
+            _reject_nul(item)
+    elif isinstance(value, list):
+        for item in value:
+            _reject_nul(item)
+    return value
+
+
+NulFree = AfterValidator(_reject_nul)
 
 
 # Pydantic models for request validation
 class PageViewRequest(BaseModel):
-    site: str
-    path: str
+    site: Annotated[str, NulFree]
+    path: Annotated[str, NulFree]
+
+
+class TrackEvent(BaseModel):
+    type: Literal["pageview", "link_click", "scroll"]
+    site: Annotated[str, NulFree] = "portfolio"
+    path: Annotated[str, NulFree] = "/"
+    link_type: Annotated[Optional[str], NulFree] = None
+    metadata: Annotated[Dict[str, Any], NulFree] = {}
+    scroll_percentage: Optional[Union[int, float]] = None
+
+
+class TrackBatchRequest(BaseModel):
+    events: List[TrackEvent] = Field(
+        ..., min_length=1, max_length=settings.track_batch_max_events
+    )
 
 
 class ModelStoreRequest(BaseModel):
@@ -48,6 +116,52 @@ class ModelStoreRequest(BaseModel):
     error_message: Optional[str] = None
 
 
+# Background tasks
+rate_limit_snapshots = PeriodicTask(
+    "rate_limit_snapshots",
+    RateLimiter.backend.snapshot,
+    settings.rate_limit_snapshot_seconds,
+)
+last_seen_flushes = PeriodicTask(
+    "session_last_seen",
+    last_seen_tracker.flush,
+    settings.session_last_seen_flush_seconds,
+)
+top_items_flushes = PeriodicTask(
+    "top_items",
+    top_items_tracker.flush,
+    settings.top_items_flush_seconds,
+)
+partition_maintenance = PeriodicTask(
+    "partitions",
+    maintain_partitions,
+    settings.partition_maintenance_seconds,
+    run_on_stop=False,
+)
+compaction = PeriodicTask(
+    "compaction",
+    compact_raw_tables,
+    settings.compaction_interval_seconds,
+    run_on_stop=False,
+)
+sampling_refreshes = PeriodicTask(
+    "sampling",
+    sampling_rates.refresh,
+    settings.sampling_refresh_seconds,
+    run_on_stop=False,
+)
+spill_syncs = PeriodicTask(
+    "spill_sync",
+    sync_spill_logs,
+    settings.spill_fsync_interval_ms / 1000,
+)
+spill_replays = PeriodicTask(
+    "spill_replay",
+    replay_spill_logs,
+    settings.spill_replay_interval_seconds,
+)
+
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.service_name,
@@ -56,6 +170,14 @@ app = FastAPI(
     redoc_url="/redoc",
 )
 
+# Rate limiting runs inside CORS so preflights are not counted and 429s
+# still carry CORS headers
+app.add_middleware(
+    RateLimitMiddleware,
+    backend=RateLimiter.backend,
+    route_costs=settings.rate_limit_route_costs,
+)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -72,14 +194,59 @@ async def startup_event():
     print("🚀 Initializing analytics database...")
     init_db()
 
+    # Older databases store page view strings inline, without sample
+    # weights, and raw tables unpartitioned
+    migrate_page_view_dimensions()
+    migrate_page_view_sample_weight()
+    migrate_to_partitioned_tables()
+    maintain_partitions()
+
     # Run migration if needed
     if os.path.exists("/app/collected_user_emails.json"):
         print("📦 Found existing user data, running migration...")
         migrate_existing_data("/app/collected_user_emails.json")
+        # Migrated events are historic; include them in the rollups
+        backfill_rollups(until=datetime.utcnow() + timedelta(hours=1))
+
+    # Link clicks and scrolls used to be stored as page views
+    earliest_moved = migrate_pseudo_path_events()
+    if earliest_moved:
+        backfill_rollups(earliest_moved, datetime.utcnow() + timedelta(hours=1))
+
+    if settings.ingest_buffer_enabled:
+        await page_view_buffer.start()
+        await event_buffer.start()
+        await spill_syncs.start()
+        # Also loads rows spilled before a restart
+        await spill_replays.start()
+    await rate_limit_snapshots.start()
+    await last_seen_flushes.start()
+    await top_items_flushes.start()
+    await partition_maintenance.start()
+    await compaction.start()
+    await sampling_rates.refresh()
+    await sampling_refreshes.start()
 
     print("✅ Analytics service ready!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Drain buffered tracking events and stop background tasks"""
+    await spill_replays.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    await page_view_buffer.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    await event_buffer.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    # After the buffers, which spill what they cannot drain
+    await spill_syncs.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    await rate_limit_snapshots.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    await last_seen_flushes.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    # After the buffer, so its final batch is counted before the last flush
+    await top_items_flushes.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    await partition_maintenance.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    await compaction.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+    await sampling_refreshes.stop(timeout=settings.ingest_shutdown_timeout_seconds)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -88,19 +255,16 @@ async def health_check():
 
 @app.post("/session")
 async def create_session(
-    request: Request, response: Response, db: DBSession = Depends(get_db)
+    request: Request, response: Response, db: AsyncSession = Depends(get_db)
 ):
-    """Create a new anonymous session"""
-    session_manager = SessionManager()
+    """Create a new anonymous session, or reuse the one in the cookie"""
+    # Reuse a still-valid session instead of inserting a row on every call
+    session = await get_current_session(request, db)
+    if session:
+        return {"success": True, "session_id": request.cookies["session_id"]}
 
     # Create anonymous session
-    session_id = session_manager.create_session(
-        db=db,
-        user_id="anonymous",  # Anonymous session
-        email="anonymous@anonymous.com",
-        name="Anonymous",
-        request=request,
-    )
+    session_id = await SessionManager.create_anonymous_session(db, request)
 
     # Set secure cookie
     response.set_cookie(
@@ -115,24 +279,42 @@ async def create_session(
     return {"success": True, "session_id": session_id}
 
 
+async def _tracking_session(request: Request, db: AsyncSession) -> Optional[Session]:
+    """Session of a tracking request, or None if it cannot be looked up
+
+    Tracking rows do not need the database to be recorded (see spill.py),
+    so a session lookup that fails or takes longer than
+    TRACK_SESSION_TIMEOUT_MS records them without a session instead of
+    failing or stalling the request. db's connection is then invalidated,
+    so the handler goes on with a fresh one rather than one left with an
+    aborted or cancelled query.
+    """
+    try:
+        return await asyncio.wait_for(
+            get_current_session(request, db),
+            settings.track_session_timeout_ms / 1000,
+        )
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+        print(f"⚠️ Session lookup failed, tracking anonymously: {e!r}")
+        await db.invalidate()
+        # Later lookups on this request are not retried
+        request.state.session = None
+        return None
+
+
 # Tracking endpoints
 @app.post("/track/pageview")
 async def track_pageview(
-    request: Request, pageview_data: PageViewRequest, db: DBSession = Depends(get_db)
+    request: Request, pageview_data: PageViewRequest, db: AsyncSession = Depends(get_db)
 ):
     """Track a page view"""
-    # Check rate limit
-    ip_address = request.client.host if request.client else "unknown"
-    if not RateLimiter.check_rate_limit(db, ip_address):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
-
     # Get session info if available
-    session = await get_current_session(request, db)
+    session = await _tracking_session(request, db)
     session_id = session.id if session else None
     user_id = session.user_id if session else None
 
     # Track the view
-    AnalyticsTracker.track_page_view(
+    await AnalyticsTracker.track_page_view(
         db, request, pageview_data.site, pageview_data.path, session_id, user_id
     )
 
@@ -141,32 +323,33 @@ async def track_pageview(
 
 @app.post("/track/link-click")
 async def track_link_click(
-    request: Request, link_data: Dict[str, Any], db: DBSession = Depends(get_db)
+    request: Request,
+    link_data: Annotated[Dict[str, Any], Body(), NulFree],
+    db: AsyncSession = Depends(get_db),
 ):
     """Track link click events from portfolio"""
-    # Check rate limit
-    ip_address = request.client.host if request.client else "unknown"
-    if not RateLimiter.check_rate_limit(db, ip_address):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
-
     # Get session info if available
-    session = await get_current_session(request, db)
+    session = await _tracking_session(request, db)
     session_id = session.id if session else None
     user_id = session.user_id if session else None
 
     # Track the link click
-    AnalyticsTracker.track_page_view(
+    await AnalyticsTracker.track_events(
         db,
-        request,
-        site=link_data.get("site", "portfolio"),
-        path=f"/link-click/{link_data.get('link_type', 'unknown')}",
-        session_id=session_id,
-        user_id=user_id,
-        additional_data={
-            "event_type": "link_click",
-            "link_type": link_data.get("link_type"),
-            "metadata": link_data.get("metadata", {}),
-        },
+        [
+            AnalyticsTracker.event_row(
+                request,
+                site=link_data.get("site", "portfolio"),
+                event_type="link_click",
+                properties={
+                    "link_type": link_data.get("link_type") or "unknown",
+                    "metadata": link_data.get("metadata"),
+                },
+                path=link_data.get("path"),
+                session_id=session_id,
+                user_id=user_id,
+            )
+        ],
     )
 
     return {"success": True}
@@ -174,42 +357,128 @@ async def track_link_click(
 
 @app.post("/track/scroll")
 async def track_scroll(
-    request: Request, scroll_data: Dict[str, Any], db: DBSession = Depends(get_db)
+    request: Request,
+    scroll_data: Annotated[Dict[str, Any], Body(), NulFree],
+    db: AsyncSession = Depends(get_db),
 ):
     """Track scroll milestone events from portfolio"""
-    # Check rate limit
-    ip_address = request.client.host if request.client else "unknown"
-    if not RateLimiter.check_rate_limit(db, ip_address):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
-
     # Get session info if available
-    session = await get_current_session(request, db)
+    session = await _tracking_session(request, db)
     session_id = session.id if session else None
     user_id = session.user_id if session else None
 
     # Track the scroll milestone
-    AnalyticsTracker.track_page_view(
+    await AnalyticsTracker.track_events(
         db,
-        request,
-        site=scroll_data.get("site", "portfolio"),
-        path=f"/scroll/{scroll_data.get('scroll_percentage', 0)}%",
-        session_id=session_id,
-        user_id=user_id,
-        additional_data={
-            "event_type": "scroll_milestone",
-            "scroll_percentage": scroll_data.get("scroll_percentage"),
-        },
+        [
+            AnalyticsTracker.event_row(
+                request,
+                site=scroll_data.get("site", "portfolio"),
+                event_type="scroll",
+                properties={
+                    "scroll_percentage": scroll_data.get("scroll_percentage") or 0
+                },
+                path=scroll_data.get("path"),
+                session_id=session_id,
+                user_id=user_id,
+            )
+        ],
     )
 
     return {"success": True}
 
 
+def _event_properties(event: TrackEvent) -> Dict[str, Any]:
+    """Properties of a batched event, matching the single-event endpoints"""
+    if event.type == "link_click":
+        return {"link_type": event.link_type or "unknown", "metadata": event.metadata}
+    return {"scroll_percentage": event.scroll_percentage or 0}
+
+
+async def _charge_batch(
+    request: Request, batch: TrackBatchRequest, db: AsyncSession
+) -> None:
+    """Charge a batch what its events would cost sent one by one
+
+    The rate limit middleware charged the route's cost before the body was
+    read; the rest is charged here. Unlimited routes are not charged.
+    """
+    charged = getattr(request.state, "rate_limit_cost", 0)
+    cost = len(batch.events) * settings.rate_limit_route_costs.get("/track/", 0)
+    if not charged or cost <= charged:
+        return
+
+    identifier = request.client.host if request.client else "unknown"
+    if not await RateLimiter.check_rate_limit(db, identifier, "ip", cost - charged):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+
+async def _track_events(
+    request: Request, batch: TrackBatchRequest, db: AsyncSession
+) -> Dict[str, Any]:
+    """Record a batch of events with one session lookup"""
+    await _charge_batch(request, batch, db)
+    # Resolve the session once for every event
+    session = await _tracking_session(request, db)
+    session_id = session.id if session else None
+    user_id = session.user_id if session else None
+
+    page_views = []
+    events = []
+    for event in batch.events:
+        if event.type == "pageview":
+            page_views.append(
+                AnalyticsTracker.page_view_row(
+                    request, event.site, event.path, session_id, user_id
+                )
+            )
+        else:
+            events.append(
+                AnalyticsTracker.event_row(
+                    request,
+                    event.site,
+                    event.type,
+                    _event_properties(event),
+                    event.path,
+                    session_id,
+                    user_id,
+                )
+            )
+    await AnalyticsTracker.track_page_views(db, page_views)
+    await AnalyticsTracker.track_events(db, events)
+
+    return {"success": True, "tracked": len(batch.events)}
+
+
+@app.post("/track/batch")
+async def track_batch(
+    request: Request, batch: TrackBatchRequest, db: AsyncSession = Depends(get_db)
+):
+    """Track a batch of page view, link click and scroll events"""
+    return await _track_events(request, batch, db)
+
+
+@app.post("/track/beacon")
+async def track_beacon(request: Request, db: AsyncSession = Depends(get_db)):
+    """Track a batch sent by navigator.sendBeacon
+
+    Beacons arrive as text/plain (which avoids a CORS preflight), so the
+    JSON body is validated here rather than by FastAPI.
+    """
+    try:
+        batch = TrackBatchRequest.model_validate_json(await request.body())
+    except ValidationError:
+        raise HTTPException(status_code=422, detail="Invalid beacon payload")
+
+    return await _track_events(request, batch, db)
+
+
 @app.post("/track/cad-event")
 async def track_cad_event(
     request: Request,
     event_data: Dict[str, Any],
     session: Session = Depends(require_session),
-    db: DBSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Track CAD generation event"""
     start_time = time.time()
@@ -218,7 +487,7 @@ async def track_cad_event(
     ip_address = request.client.host if request.client else "unknown"
 
     # Track the event
-    AnalyticsTracker.track_cad_event(
+    await AnalyticsTracker.track_cad_event(
         db,
         user_id=session.user_id,
         session_id=session.id,
@@ -242,10 +511,10 @@ async def store_model(
     request: Request,
     model_data: ModelStoreRequest,
     session: Session = Depends(require_session),
-    db: DBSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Store a generated model with metadata"""
-    AnalyticsTracker.store_generated_model(
+    await AnalyticsTracker.store_generated_model(
         db=db,
         model_id=model_data.model_id,
         user_id=session.user_id,
@@ -265,16 +534,16 @@ async def store_model(
 
 
 @app.post("/models/{model_id}/download")
-async def track_model_download(model_id: str, db: DBSession = Depends(get_db)):
+async def track_model_download(model_id: str, db: AsyncSession = Depends(get_db)):
     """Track when a model is downloaded"""
-    AnalyticsTracker.track_model_download(db, model_id)
+    await AnalyticsTracker.track_model_download(db, model_id)
     return {"success": True}
 
 
 @app.get("/models/{model_id}")
-async def get_model_info(model_id: str, db: DBSession = Depends(get_db)):
+async def get_model_info(model_id: str, db: AsyncSession = Depends(get_db)):
     """Get model information"""
-    model = db.query(GeneratedModel).filter(GeneratedModel.id == model_id).first()
+    model = await db.get(GeneratedModel, model_id)
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
 
@@ -299,14 +568,9 @@ async def create_session(
     response: Response,
     email: str = Form(...),
     name: str = Form(...),
-    db: DBSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Create a new user session"""
-    # Check rate limit
-    ip_address = request.client.host if request.client else "unknown"
-    if not RateLimiter.check_rate_limit(db, ip_address):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
-
     # Generate user ID (same as old system for compatibility)
     import base64
 
@@ -315,7 +579,7 @@ async def create_session(
     )
 
     # Get or create user
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.scalar(select(User).where(User.email == email))
     if not user:
         user = User(id=user_id, email=email, name=name)
         db.add(user)
@@ -330,10 +594,10 @@ async def create_session(
             status_code=403, detail=f"Account blocked: {user.block_reason}"
         )
 
-    db.commit()
+    await db.commit()
 
     # Create session
-    session_id = SessionManager.create_session(db, user_id, email, name, request)
+    session_id = await SessionManager.create_session(db, user_id, email, name, request)
 
     # Set secure cookie
     response.set_cookie(
@@ -366,11 +630,11 @@ async def destroy_session(
     request: Request,
     response: Response,
     session: Session = Depends(get_current_session),
-    db: DBSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Destroy current session"""
     if session:
-        SessionManager.destroy_session(db, session.id)
+        await SessionManager.destroy_session(db, session.id)
 
     # Clear cookie
     response.delete_cookie("session_id")
@@ -380,10 +644,10 @@ async def destroy_session(
 
 @app.get("/auth/current-user")
 async def get_current_user(
-    session: Session = Depends(require_session), db: DBSession = Depends(get_db)
+    session: Session = Depends(require_session), db: AsyncSession = Depends(get_db)
 ):
     """Get current user info"""
-    user = db.query(User).filter(User.id == session.user_id).first()
+    user = await db.get(User, session.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -415,7 +679,7 @@ async def get_tracking_script():
 
 @app.post("/admin/login")
 async def admin_login(
-    request: Request, password: str = Form(...), db: DBSession = Depends(get_db)
+    request: Request, password: str = Form(...), db: AsyncSession = Depends(get_db)
 ):
     """Admin login"""
     ip_address = request.client.host if request.client else "unknown"
@@ -430,7 +694,7 @@ async def admin_login(
             success=False,
         )
         db.add(log)
-        db.commit()
+        await db.commit()
 
         raise HTTPException(status_code=401, detail="Invalid password")
 
@@ -442,45 +706,174 @@ async def admin_login(
         success=True,
     )
     db.add(log)
-    db.commit()
+    await db.commit()
 
     return {"success": True, "token": "admin_authenticated"}
 
 
+async def _page_view_stats(hours: int, site: Optional[str]) -> Dict[str, Any]:
+    async with AsyncSessionLocal() as db:
+        return await AnalyticsTracker.get_page_view_stats(db, hours, site)
+
+
+async def _event_stats(hours: int, site: Optional[str]) -> Dict[str, Any]:
+    async with AsyncSessionLocal() as db:
+        return await AnalyticsTracker.get_event_stats(db, hours, site)
+
+
+async def _cad_stats(hours: int) -> Dict[str, Any]:
+    async with AsyncSessionLocal() as db:
+        return await AnalyticsTracker.get_cad_stats(db, hours)
+
+
+async def _timeseries(
+    metric: str, bucket: str, hours: int, site: Optional[str]
+) -> Dict[str, Any]:
+    async with AsyncSessionLocal() as db:
+        return await AnalyticsTracker.get_timeseries(db, metric, bucket, hours, site)
+
+
+async def _user_stats() -> Dict[str, Any]:
+    async with AsyncSessionLocal() as db:
+        total_users = await db.scalar(select(func.count(User.id)))
+        active_users_24h = await db.scalar(
+            select(func.count(User.id)).where(
+                User.last_activity >= datetime.utcnow() - timedelta(hours=24)
+            )
+        )
+    return {"total": total_users, "active_24h": active_users_24h}
+
+
 @app.get("/admin/stats")
 async def get_admin_stats(
-    hours: int = 24, password: str = None, db: DBSession = Depends(get_db)
+    hours: int = 24,
+    site: Optional[str] = None,
+    password: str = None,
 ):
-    """Get analytics statistics (requires admin password)"""
+    """Get analytics statistics (requires admin password)
+
+    Served from ``stats_cache``, so results may be up to
+    STATS_CACHE_TTL_SECONDS old (longer while a refresh is running).
+    """
     if not password or not check_admin_password(password):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    # Get various stats
-    page_stats = AnalyticsTracker.get_page_view_stats(db, hours)
-    cad_stats = AnalyticsTracker.get_cad_stats(db, hours)
-
-    # Get user stats
-    total_users = db.query(User).count()
-    active_users_24h = (
-        db.query(User)
-        .filter(User.last_activity >= datetime.utcnow() - timedelta(hours=24))
-        .count()
+    page_stats, event_stats, cad_stats, user_stats = await asyncio.gather(
+        stats_cache.get(
+            ("page_views", hours, site), lambda: _page_view_stats(hours, site)
+        ),
+        stats_cache.get(("events", hours, site), lambda: _event_stats(hours, site)),
+        stats_cache.get(("cad_events", hours), lambda: _cad_stats(hours)),
+        stats_cache.get(("users",), _user_stats),
     )
 
     return {
         "page_views": page_stats,
+        "events": event_stats,
         "cad_events": cad_stats,
-        "users": {"total": total_users, "active_24h": active_users_24h},
+        "users": user_stats,
+    }
+
+
+@app.get("/admin/stats/timeseries")
+async def get_admin_timeseries(
+    metric: Literal[
+        "page_views", "unique_visitors", "cad_events", "error_rate"
+    ] = "page_views",
+    bucket: Literal["minute", "hour", "day"] = "hour",
+    hours: int = 24,
+    site: Optional[str] = None,
+    password: str = None,
+):
+    """Get one metric per time bucket for charts (requires admin password)
+
+    Returns ``start``, ``step_seconds`` and one value per bucket, empty
+    buckets included. Cached like ``/admin/stats``.
+    """
+    if not password or not check_admin_password(password):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    if hours <= 0:
+        raise HTTPException(status_code=400, detail="hours must be positive")
+    buckets = timedelta(hours=hours) / BUCKET_WIDTHS[bucket]
+    if buckets > settings.timeseries_max_buckets:
+        raise HTTPException(
+            status_code=400,
+            detail=f"More than {settings.timeseries_max_buckets} buckets, "
+            "use a larger bucket or fewer hours",
+        )
+
+    if metric in ("cad_events", "error_rate"):
+        site = None  # CAD events have no site
+    return await stats_cache.get(
+        ("timeseries", metric, bucket, hours, site),
+        lambda: _timeseries(metric, bucket, hours, site),
+    )
+
+
+@app.get("/admin/db-pool")
+async def get_db_pool(password: str = None):
+    """Get database connection pool metrics (requires admin password)"""
+    if not password or not check_admin_password(password):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    return get_pool_status()
+
+
+@app.get("/admin/sampling")
+async def get_sampling(password: str = None):
+    """Get page view sampling rates per site (requires admin password)"""
+    if not password or not check_admin_password(password):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    return {
+        "rates": {
+            site: {"rate": rate, "sample_weight": sample_weight(rate)}
+            for site, rate in sorted(sampling_rates.rates().items())
+        }
     }
 
 
+@app.post("/admin/sampling")
+async def set_sampling(
+    site: str, rate: float, password: str = None, db: AsyncSession = Depends(get_db)
+):
+    """Set the fraction of a site's page views kept (admin only)
+
+    Applies to every worker within SAMPLING_REFRESH_SECONDS; a rate of 1
+    stops sampling the site.
+    """
+    if not password or not check_admin_password(password):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    site = site[:50]
+    try:
+        await sampling_rates.set_rate(db, site, rate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Log action
+    log = AdminLog(
+        action="set_sampling",
+        details=f"Set page view sampling rate of {site} to {rate}",
+        ip_address="admin",
+        success=True,
+    )
+    db.add(log)
+    await db.commit()
+
+    return {"success": True, "site": site, "sample_weight": sample_weight(rate)}
+
+
 @app.get("/admin/users")
-async def get_admin_users(password: str = None, db: DBSession = Depends(get_db)):
+async def get_admin_users(password: str = None, db: AsyncSession = Depends(get_db)):
     """Get user list (requires admin password)"""
     if not password or not check_admin_password(password):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    users = db.query(User).order_by(User.last_activity.desc()).limit(100).all()
+    users = await db.scalars(
+        select(User).order_by(User.last_activity.desc()).limit(100)
+    )
 
     return [
         {
@@ -498,17 +891,14 @@ async def get_admin_users(password: str = None, db: DBSession = Depends(get_db))
 
 @app.get("/admin/models")
 async def get_admin_models(
-    password: str = None, limit: int = 50, db: DBSession = Depends(get_db)
+    password: str = None, limit: int = 50, db: AsyncSession = Depends(get_db)
 ):
     """Get recent models (requires admin password)"""
     if not password or not check_admin_password(password):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    models = (
-        db.query(GeneratedModel)
-        .order_by(GeneratedModel.timestamp.desc())
-        .limit(limit)
-        .all()
+    models = await db.scalars(
+        select(GeneratedModel).order_by(GeneratedModel.timestamp.desc()).limit(limit)
     )
 
     return [
@@ -530,13 +920,13 @@ async def get_admin_models(
 
 @app.get("/admin/models/{model_id}/details")
 async def get_model_details(
-    model_id: str, password: str = None, db: DBSession = Depends(get_db)
+    model_id: str, password: str = None, db: AsyncSession = Depends(get_db)
 ):
     """Get detailed model information (requires admin password)"""
     if not password or not check_admin_password(password):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    model = db.query(GeneratedModel).filter(GeneratedModel.id == model_id).first()
+    model = await db.get(GeneratedModel, model_id)
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
 
@@ -560,18 +950,18 @@ async def get_model_details(
 
 @app.post("/admin/reset-user-count")
 async def reset_user_count(
-    user_id: str, password: str = None, db: DBSession = Depends(get_db)
+    user_id: str, password: str = None, db: AsyncSession = Depends(get_db)
 ):
     """Reset user's model count (admin only)"""
     if not password or not check_admin_password(password):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     user.model_count = 0
-    db.commit()
+    await db.commit()
 
     # Log action
     log = AdminLog(
@@ -581,23 +971,53 @@ async def reset_user_count(
         success=True,
     )
     db.add(log)
-    db.commit()
+    await db.commit()
 
     return {"success": True, "new_count": 0}
 
 
+@app.post("/admin/block-user")
+async def block_user(
+    user_id: str,
+    reason: str = None,
+    password: str = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Block a user and end their sessions (admin only)"""
+    if not password or not check_admin_password(password):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    await SessionManager.block_user(db, user, reason)
+
+    # Log action
+    log = AdminLog(
+        action="block_user",
+        details=f"Blocked user {user.email}: {reason}",
+        ip_address="admin",
+        success=True,
+    )
+    db.add(log)
+    await db.commit()
+
+    return {"success": True}
+
+
 # User management endpoints (for backend integration)
 @app.post("/users/increment-count")
 async def increment_user_count(
     user_id: str,
     session: Session = Depends(require_session),
-    db: DBSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Increment user's model count"""
     if session.user_id != user_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -606,15 +1026,15 @@ async def increment_user_count(
 
     user.model_count += 1
     user.last_activity = datetime.utcnow()
-    db.commit()
+    await db.commit()
 
     return {"success": True, "model_count": user.model_count}
 
 
 @app.get("/users/{user_id}/info")
-async def get_user_info(user_id: str, db: DBSession = Depends(get_db)):
+async def get_user_info(user_id: str, db: AsyncSession = Depends(get_db)):
     """Get user information"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         return {"model_count": 0}  # Return default for new users
 
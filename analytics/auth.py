@@ -3,27 +3,224 @@ Authentication and session management
 """
 
 import uuid
+import hashlib
+import hmac
+import json
 import secrets
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
-from fastapi import Request, Response, HTTPException, Depends
-from sqlalchemy.orm import Session as DBSession
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Tuple
+from fastapi import Request, HTTPException, Depends
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from passlib.context import CryptContext
 import base64
 
-from database import get_db, Session, User, RateLimit
+from database import get_db, AsyncSessionLocal, Session, User
 from config import settings
+from ratelimit import RateLimitBackend, create_rate_limit_backend
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+class SessionCache:
+    """Bounded TTL/LRU cache of validated sessions keyed by session id
+
+    Entries are detached copies of the Session row, so they can be read
+    after the request's DB session is closed. Each worker has its own
+    cache; a session ended through another worker stays usable here for
+    at most ``ttl_seconds``.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[Session, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Cached session, or None if missing, stale or expired"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+
+            session, cached_at = entry
+            if (
+                time.monotonic() - cached_at > self.ttl_seconds
+                or session.expires_at <= datetime.utcnow()
+            ):
+                del self._entries[session_id]
+                return None
+
+            self._entries.move_to_end(session_id)
+            return session
+
+    def put(self, session: Session) -> Session:
+        """Cache a detached copy of session and return it"""
+        copy = Session(
+            **{
+                column.key: getattr(session, column.key)
+                for column in Session.__table__.columns
+            }
+        )
+        with self._lock:
+            self._entries[copy.id] = (copy, time.monotonic())
+            self._entries.move_to_end(copy.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return copy
+
+    def invalidate(self, session_id: str) -> None:
+        """Drop one session"""
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Drop every cached session belonging to user_id"""
+        with self._lock:
+            for session_id in [
+                session_id
+                for session_id, (session, _) in self._entries.items()
+                if session.user_id == user_id
+            ]:
+                del self._entries[session_id]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class LastSeenTracker:
+    """Coalesce session last_seen updates and write them in the background
+
+    A session's last_seen is only marked for writing once it is older than
+    ``threshold_seconds``; ``flush`` writes all pending values in one
+    bulk UPDATE.
+    """
+
+    def __init__(self, threshold_seconds: int) -> None:
+        self.threshold = timedelta(seconds=threshold_seconds)
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session: Session) -> None:
+        """Record that session was used now"""
+        now = datetime.utcnow()
+        if session.last_seen and now - session.last_seen < self.threshold:
+            return
+
+        session.last_seen = now
+        with self._lock:
+            self._pending[session.id] = now
+
+    async def flush(self) -> None:
+        """Write pending last_seen values"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Session),
+                [
+                    {"id": session_id, "last_seen": last_seen}
+                    for session_id, last_seen in pending.items()
+                ],
+            )
+            await db.commit()
+
+
+class AnonymousSessionToken:
+    """Self-contained, HMAC-signed anonymous sessions
+
+    The cookie value is ``anon.<payload>.<signature>``, where payload is
+    base64url JSON holding the session id, user id and expiry, signed with
+    ``settings.secret_key``. Tokens are verified without touching the
+    database, so they can only be revoked all at once, by turning
+    ``settings.anonymous_session_tokens`` off; named users keep
+    database-backed sessions.
+    """
+
+    PREFIX = "anon."
+
+    @staticmethod
+    def _encode(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    @staticmethod
+    def _sign(payload: str) -> str:
+        digest = hmac.new(
+            settings.secret_key.encode(), payload.encode(), hashlib.sha256
+        ).digest()
+        return AnonymousSessionToken._encode(digest)
+
+    @staticmethod
+    def is_token(value: str) -> bool:
+        return value.startswith(AnonymousSessionToken.PREFIX)
+
+    @staticmethod
+    def issue(session_id: str, user_id: str, expires_at: datetime) -> str:
+        """Build a signed token"""
+        expires = int(expires_at.replace(tzinfo=timezone.utc).timestamp())
+        payload = AnonymousSessionToken._encode(
+            json.dumps({"sid": session_id, "uid": user_id, "exp": expires}).encode()
+        )
+        body = AnonymousSessionToken.PREFIX + payload
+        return f"{body}.{AnonymousSessionToken._sign(body)}"
+
+    @staticmethod
+    def verify(token: str) -> Optional[Session]:
+        """Session described by a valid, unexpired token, else None"""
+        body, _, signature = token.rpartition(".")
+        # Cookies may hold any characters; compare_digest only takes ASCII str
+        if not body or not secrets.compare_digest(
+            signature.encode(), AnonymousSessionToken._sign(body).encode()
+        ):
+            return None
+
+        try:
+            payload = body[len(AnonymousSessionToken.PREFIX) :]
+            data = json.loads(
+                base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+            )
+            expires_at = datetime.utcfromtimestamp(data["exp"])
+            session_id, user_id = data["sid"], data["uid"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        if expires_at <= datetime.utcnow():
+            return None
+
+        return Session(
+            id=session_id,
+            user_id=user_id,
+            email="anonymous@anonymous.com",
+            name="Anonymous",
+            expires_at=expires_at,
+            is_active=True,
+        )
+
+
+session_cache = SessionCache(
+    max_size=settings.session_cache_size,
+    ttl_seconds=settings.session_cache_ttl_seconds,
+)
+last_seen_tracker = LastSeenTracker(
+    threshold_seconds=settings.session_last_seen_threshold_seconds
+)
+
+
 class SessionManager:
     """Manage user sessions with secure cookies"""
 
     @staticmethod
-    def create_session(
-        db: DBSession, user_id: str, email: str, name: str, request: Request
+    async def create_session(
+        db: AsyncSession, user_id: str, email: str, name: str, request: Request
     ) -> str:
         """Create a new session"""
         session_id = str(uuid.uuid4())
@@ -44,108 +241,118 @@ class SessionManager:
             + timedelta(hours=settings.session_expire_hours),
         )
         db.add(db_session)
-        db.commit()
+        await db.commit()
 
         return session_id
 
     @staticmethod
-    def get_session(db: DBSession, session_id: str) -> Optional[Session]:
+    async def create_anonymous_session(db: AsyncSession, request: Request) -> str:
+        """Create an anonymous session and return the cookie value
+
+        With ``settings.anonymous_session_tokens`` enabled this is a signed
+        token and no row is written.
+        """
+        if not settings.anonymous_session_tokens:
+            return await SessionManager.create_session(
+                db=db,
+                user_id="anonymous",  # Anonymous session
+                email="anonymous@anonymous.com",
+                name="Anonymous",
+                request=request,
+            )
+
+        return AnonymousSessionToken.issue(
+            session_id=str(uuid.uuid4()),
+            user_id="anonymous",
+            expires_at=datetime.utcnow()
+            + timedelta(hours=settings.session_expire_hours),
+        )
+
+    @staticmethod
+    async def get_session(db: AsyncSession, session_id: str) -> Optional[Session]:
         """Get and validate session"""
         if not session_id:
             return None
 
-        session = (
-            db.query(Session)
-            .filter(
-                Session.id == session_id,
-                Session.is_active == True,
-                Session.expires_at > datetime.utcnow(),
+        # Signed anonymous sessions are verified without the database, and
+        # only accepted while they are enabled
+        if AnonymousSessionToken.is_token(session_id):
+            if not settings.anonymous_session_tokens:
+                return None
+            return AnonymousSessionToken.verify(session_id)
+
+        session = session_cache.get(session_id)
+        if session is None:
+            db_session = await db.scalar(
+                select(Session).where(
+                    Session.id == session_id,
+                    Session.is_active == True,
+                    Session.expires_at > datetime.utcnow(),
+                )
             )
-            .first()
-        )
+            if not db_session:
+                return None
+            session = session_cache.put(db_session)
 
-        if session:
-            # Update last seen
-            session.last_seen = datetime.utcnow()
-            db.commit()
+        # Update last seen (written in the background)
+        last_seen_tracker.touch(session)
 
         return session
 
     @staticmethod
-    def destroy_session(db: DBSession, session_id: str) -> None:
+    async def destroy_session(db: AsyncSession, session_id: str) -> None:
         """Destroy a session"""
-        session = db.query(Session).filter(Session.id == session_id).first()
+        session_cache.invalidate(session_id)
+        session = await db.get(Session, session_id)
         if session:
             session.is_active = False
-            db.commit()
+            await db.commit()
+
+    @staticmethod
+    async def block_user(
+        db: AsyncSession, user: User, reason: Optional[str] = None
+    ) -> None:
+        """Block a user and end all of their sessions"""
+        user.is_blocked = True
+        user.block_reason = reason
+        await db.execute(
+            update(Session)
+            .where(Session.user_id == user.id)
+            .values(is_active=False)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        session_cache.invalidate_user(user.id)
 
 
 class RateLimiter:
     """Rate limiting to prevent abuse"""
 
+    backend: RateLimitBackend = create_rate_limit_backend(settings.rate_limit_backend)
+
     @staticmethod
-    def check_rate_limit(
-        db: DBSession, identifier: str, identifier_type: str = "ip"
+    async def check_rate_limit(
+        db: AsyncSession, identifier: str, identifier_type: str = "ip", cost: int = 1
     ) -> bool:
-        """Check if identifier is rate limited"""
-        now = datetime.utcnow()
-        window_start = now - timedelta(minutes=settings.rate_limit_window_minutes)
-
-        # Get or create rate limit record
-        rate_limit = (
-            db.query(RateLimit)
-            .filter(
-                RateLimit.identifier == identifier,
-                RateLimit.identifier_type == identifier_type,
-            )
-            .first()
-        )
-
-        if not rate_limit:
-            rate_limit = RateLimit(
-                identifier=identifier,
-                identifier_type=identifier_type,
-                request_count=0,
-                window_start=now,
-            )
-            db.add(rate_limit)
-
-        # Check if blocked
-        if rate_limit.is_blocked and rate_limit.block_until > now:
-            return False
-
-        # Reset window if needed
-        if rate_limit.window_start < window_start:
-            rate_limit.window_start = now
-            rate_limit.request_count = 0
-            rate_limit.is_blocked = False
-
-        # Increment counter
-        rate_limit.request_count += 1
-        rate_limit.last_request = now
-
-        # Check limit
-        if rate_limit.request_count > settings.rate_limit_requests:
-            rate_limit.is_blocked = True
-            rate_limit.block_until = now + timedelta(
-                minutes=settings.rate_limit_block_minutes
-            )
-            db.commit()
-            return False
-
-        db.commit()
-        return True
+        """Check if identifier is rate limited, charging ``cost`` requests"""
+        return await RateLimiter.backend.check(identifier, identifier_type, cost, db=db)
 
 
 async def get_current_session(
-    request: Request, db: DBSession = Depends(get_db)
+    request: Request, db: AsyncSession = Depends(get_db)
 ) -> Optional[Session]:
-    """Get current session from cookie"""
-    session_id = request.cookies.get("session_id")
-    if not session_id:
-        return None
+    """Get current session from cookie
+
+    The result is memoized on ``request.state`` so the session is resolved
+    at most once per request, however many dependencies or handlers ask.
+    """
+    if not hasattr(request.state, "session"):
+        session_id = request.cookies.get("session_id")
+        request.state.session = (
+            await SessionManager.get_session(db, session_id) if session_id else None
+        )
 
-    return SessionManager.get_session(db, session_id)
+    return request.state.session
 
 
 async def require_session(
@@ -0,0 +1,87 @@
+"""
+Result cache for admin statistics
+"""
+
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from config import settings
+
+
+class StatsCache:
+    """TTL cache with stale-while-revalidate and single-flight computation
+
+    A value younger than ``ttl_seconds`` is served as is. Up to
+    ``stale_seconds`` after that it is still served, and one background
+    refresh is started. Older or missing values are computed while the
+    caller waits. Concurrent requests for the same key share one
+    computation, so N dashboards polling the same stats cost one query.
+
+    ``compute`` must open its own database session: a refresh can outlive
+    the request that started it. At most ``max_entries`` keys are kept,
+    least recently used first out. A ``ttl_seconds`` of 0 disables caching.
+    """
+
+    def __init__(self, ttl_seconds: float, stale_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached value for key, computing it if needed"""
+        if self.ttl_seconds <= 0:
+            return await compute()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, computed_at = entry
+            age = monotonic() - computed_at
+            if age < self.ttl_seconds + self.stale_seconds:
+                self._entries.move_to_end(key)
+                if age >= self.ttl_seconds:
+                    self._refresh(key, compute)
+                return value
+
+        # Shielded so a disconnecting client does not cancel the
+        # computation other requests are waiting on
+        return await asyncio.shield(self._refresh(key, compute))
+
+    def _refresh(self, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        """Task computing key, started unless one is already running"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._compute(key, compute))
+            task.add_done_callback(self._log_failure)
+            self._inflight[key] = task
+        return task
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        try:
+            value = await compute()
+            self._entries[key] = (value, monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value
+        finally:
+            del self._inflight[key]
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        # Stale entries are kept when a background refresh fails
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ Stats refresh failed: {task.exception()}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+stats_cache = StatsCache(
+    ttl_seconds=settings.stats_cache_ttl_seconds,
+    stale_seconds=settings.stats_cache_stale_seconds,
+    max_entries=settings.stats_cache_max_entries,
+)
@@ -0,0 +1,268 @@
+"""
+Compaction of raw rows past their retention
+
+Stats windows only read the hourly rollups for hours past a table's
+retention (see rollups.rollup_boundary), so the raw rows of those hours can
+go. For each of page_views, events and cad_events with a retention set
+(*_RETENTION_DAYS), the compaction job:
+
+1. rebuilds the rollups of expired hours whose raw row count does not
+   match them (rollups.backfill), so no row is lost from the aggregates
+2. drops partitions wholly before the cutoff (see partitions.py)
+3. deletes the other expired rows COMPACTION_BATCH_SIZE at a time, one
+   transaction per batch, so locks and WAL stay bounded
+
+Each step records in compaction_state, in the same transaction, the hour
+before which the table's raw rows may be gone. Backfills and the rollup
+check above leave those hours alone, so a run that stops part way through
+an hour does not rebuild its rollups from the rows that are left.
+
+With COMPACTION_ARCHIVE_DIR set, rows are appended to gzipped JSON lines
+files there, one per table and day, before they are deleted; partitions
+are then emptied batch by batch before being dropped. A batch whose
+DELETE fails is archived again on the next run.
+
+    python compaction.py run
+"""
+
+import argparse
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Table, case, delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection, Engine
+
+from config import settings
+from database import (
+    engine,
+    CADEvent,
+    CADEventHourly,
+    CompactionState,
+    Event,
+    EventHourly,
+    PageView,
+    PageViewHourly,
+)
+from partitions import (
+    PARTITIONED_TABLES,
+    drop_expired_partitions,
+    partition_range,
+    retention_cutoff,
+)
+from rollups import backfill, hour_of
+
+# Rollup column holding the raw row count of each hour, per raw table
+ROLLUP_COUNTS = {
+    PageView.__table__: PageViewHourly.views,
+    Event.__table__: EventHourly.events,
+    CADEvent.__table__: CADEventHourly.events,
+}
+
+
+def compaction_cutoff(
+    retention_days: int, now: Optional[datetime] = None
+) -> Optional[datetime]:
+    """Raw rows before this are compacted, or None to keep all
+
+    Rounded down to the hour so only whole hours are compacted.
+    """
+    cutoff = retention_cutoff(retention_days, now)
+    return hour_of(cutoff) if cutoff else None
+
+
+def compacted_before(conn: Connection, table_name: str) -> Optional[datetime]:
+    """Hour before which the raw rows of table_name may be gone"""
+    return conn.scalar(
+        select(CompactionState.compacted_before).where(
+            CompactionState.table_name == table_name
+        )
+    )
+
+
+def record_compaction(conn: Connection, table_name: str, before: datetime) -> None:
+    """Remember that raw rows of table_name before ``before`` may be gone"""
+    statement = insert(CompactionState).values(
+        table_name=table_name, compacted_before=before, updated_at=datetime.utcnow()
+    )
+    excluded = statement.excluded
+    conn.execute(
+        statement.on_conflict_do_update(
+            index_elements=["table_name"],
+            set_={
+                "compacted_before": case(
+                    (
+                        CompactionState.compacted_before > excluded.compacted_before,
+                        CompactionState.compacted_before,
+                    ),
+                    else_=excluded.compacted_before,
+                ),
+                "updated_at": excluded.updated_at,
+            },
+        )
+    )
+
+
+def stale_rollup_hours_query(table: Table, since: Optional[datetime], cutoff: datetime):
+    """Hours in [since, cutoff) whose raw row count differs from their rollup"""
+    rollup = ROLLUP_COUNTS[table]
+    rollup_hour = rollup.class_.hour
+    raw_hour = func.date_trunc("hour", table.c.timestamp)
+    # Sampled page views stand for sample_weight views each
+    raw_rows = (
+        func.sum(table.c.sample_weight) if "sample_weight" in table.c else func.count()
+    )
+
+    raw = select(raw_hour.label("hour"), raw_rows.label("rows")).where(
+        table.c.timestamp < cutoff
+    )
+    rolled_up = select(rollup_hour.label("hour"), func.sum(rollup).label("rows")).where(
+        rollup_hour < cutoff
+    )
+    if since:
+        raw = raw.where(table.c.timestamp >= since)
+        rolled_up = rolled_up.where(rollup_hour >= since)
+    raw = raw.group_by(raw_hour).subquery()
+    rolled_up = rolled_up.group_by(rollup_hour).subquery()
+
+    return (
+        select(raw.c.hour)
+        .select_from(raw.outerjoin(rolled_up, rolled_up.c.hour == raw.c.hour))
+        .where(func.coalesce(rolled_up.c.rows, 0) != raw.c.rows)
+        .order_by(raw.c.hour)
+    )
+
+
+def archive_rows(table_name: str, rows: List[Dict[str, Any]], archive_dir: str):
+    """Append rows to the gzipped JSON lines file of their table and day"""
+    by_day = defaultdict(list)
+    for row in rows:
+        by_day[row["timestamp"].strftime("%Y%m%d")].append(row)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    for day, day_rows in sorted(by_day.items()):
+        path = os.path.join(archive_dir, f"{table_name}-{day}.jsonl.gz")
+        with gzip.open(path, "at", encoding="utf-8") as archive:
+            for row in day_rows:
+                archive.write(json.dumps(row, default=str) + "\n")
+
+
+def delete_expired_rows(
+    bind: Engine,
+    table: Table,
+    cutoff: datetime,
+    batch_size: int,
+    max_batches: int,
+    archive_dir: Optional[str] = None,
+) -> int:
+    """Delete (and archive) up to max_batches batches of rows before cutoff
+
+    Returns the number of rows deleted. Each batch records how far the
+    table is compacted and starts at the timestamp the previous one ended
+    at, so it does not rescan the index entries of rows already deleted.
+    """
+    columns = list(table.columns) if archive_dir else [table.c.id, table.c.timestamp]
+    deleted = 0
+    after = None
+    for _ in range(max_batches):
+        with bind.begin() as conn:
+            query = select(*columns).where(table.c.timestamp < cutoff)
+            if after:
+                query = query.where(table.c.timestamp >= after)
+            rows = conn.execute(
+                query.order_by(table.c.timestamp).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            if archive_dir:
+                archive_rows(table.name, [row._asdict() for row in rows], archive_dir)
+            conn.execute(
+                delete(table).where(
+                    table.c.id.in_([row.id for row in rows]),
+                    table.c.timestamp < cutoff,
+                )
+            )
+            # The hour of the last row may be partly deleted
+            after = rows[-1].timestamp
+            record_compaction(
+                conn, table.name, min(hour_of(after) + timedelta(hours=1), cutoff)
+            )
+        deleted += len(rows)
+    return deleted
+
+
+def compact_table(table: Table, cutoff: datetime) -> None:
+    """Compact the rows of table before cutoff"""
+    archive_dir = settings.compaction_archive_dir or None
+
+    with engine.connect() as conn:
+        since = compacted_before(conn, table.name)
+        stale_hours = conn.scalars(stale_rollup_hours_query(table, since, cutoff)).all()
+    if stale_hours:
+        print(
+            f"📊 {len(stale_hours)} {table.name} hours before {cutoff} differ "
+            "from their rollups, rebuilding them"
+        )
+        backfill(stale_hours[0], stale_hours[-1] + timedelta(hours=1))
+
+    dropped = []
+    if not archive_dir:
+        with engine.begin() as conn:
+            dropped = drop_expired_partitions(conn, table, cutoff)
+            if dropped:
+                ends = [partition_range(table.name, name)[1] for name in dropped]
+                record_compaction(conn, table.name, max(ends))
+
+    deleted = delete_expired_rows(
+        engine,
+        table,
+        cutoff,
+        settings.compaction_batch_size,
+        settings.compaction_max_batches,
+        archive_dir,
+    )
+
+    with engine.begin() as conn:
+        remaining = conn.scalar(
+            select(table.c.id).where(table.c.timestamp < cutoff).limit(1)
+        )
+        if remaining is not None:
+            print(f"🧹 {table.name}: deleted {deleted} rows, more left for next run")
+            return
+
+        dropped += drop_expired_partitions(conn, table, cutoff)
+        record_compaction(conn, table.name, cutoff)
+
+    if dropped or deleted:
+        print(
+            f"🧹 {table.name}: compacted rows before {cutoff} "
+            f"({len(dropped)} partitions dropped, {deleted} rows deleted)"
+        )
+
+
+def compact_raw_tables(now: Optional[datetime] = None) -> None:
+    """Compact every raw table with a retention period"""
+    if engine.dialect.name != "postgresql":
+        return
+
+    for table, retention_days in PARTITIONED_TABLES.items():
+        cutoff = compaction_cutoff(retention_days, now)
+        if cutoff:
+            compact_table(table, cutoff)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact expired raw rows")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser(
+        "run", help="Delete raw rows past their retention, keeping the rollups"
+    )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        compact_raw_tables()
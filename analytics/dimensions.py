@@ -0,0 +1,136 @@
+"""
+Interned page view dimensions
+
+Paths, referrers and user agents repeat across many page views, so
+page_views stores ids into the page_paths, referrers and user_agents
+tables instead of the strings. Each process keeps an LRU map from string
+to id per dimension; only strings it has not seen cost a database round
+trip.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal, PagePath, Referrer, UserAgent
+
+# Row key of each interned string -> (page_views id column, dimension table)
+PAGE_VIEW_DIMENSIONS = {
+    "path": ("path_id", PagePath),
+    "user_agent": ("user_agent_id", UserAgent),
+    "referrer": ("referrer_id", Referrer),
+}
+
+
+def value_digest(value: str) -> int:
+    """Signed 64-bit hash the dimension tables are unique on"""
+    digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class DimensionCache:
+    """LRU map from the strings of one dimension table to their ids"""
+
+    def __init__(self, model, max_entries: int) -> None:
+        self.model = model
+        self.max_entries = max_entries
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+
+    def get(self, value: str) -> Optional[int]:
+        """Cached id of value"""
+        id_ = self._ids.get(value)
+        if id_ is not None:
+            self._ids.move_to_end(value)
+        return id_
+
+    def put(self, ids: Dict[str, int]) -> None:
+        """Remember ids, evicting the least recently used"""
+        self._ids.update(ids)
+        for value in ids:
+            self._ids.move_to_end(value)
+        while len(self._ids) > self.max_entries:
+            self._ids.popitem(last=False)
+
+    async def lookup(self, db: AsyncSession, values: Iterable[str]) -> Dict[str, int]:
+        """Ids of values, inserting the ones not in the table yet
+
+        Inserted in digest order so concurrent writers lock rows in the
+        same order; a value another writer inserted first is read back.
+        """
+        by_digest = {value_digest(value): value for value in values}
+        if not by_digest:
+            return {}
+
+        await db.execute(
+            insert(self.model).on_conflict_do_nothing(index_elements=["digest"]),
+            [
+                {"digest": digest, "value": value}
+                for digest, value in sorted(by_digest.items())
+            ],
+        )
+        rows = await db.execute(
+            select(self.model.digest, self.model.id).where(
+                self.model.digest.in_(list(by_digest))
+            )
+        )
+        return {by_digest[digest]: id_ for digest, id_ in rows}
+
+
+dimension_caches = {
+    key: DimensionCache(model, settings.dimension_cache_max_entries)
+    for key, (_, model) in PAGE_VIEW_DIMENSIONS.items()
+}
+
+
+async def encode_page_views(
+    rows: List[Dict[str, Any]], bind: Optional[AsyncEngine] = None
+) -> List[Dict[str, Any]]:
+    """page_views values for rows, with strings replaced by dimension ids
+
+    Strings missing from the caches are resolved in a session of their own
+    (on ``bind`` if given), so a cached id always refers to a committed row
+    even if the caller's INSERT later rolls back. Empty strings become NULL.
+    """
+    ids: Dict[str, Dict[str, int]] = {}
+    missing: Dict[str, set] = {}
+    for key, cache in dimension_caches.items():
+        ids[key] = {}
+        missing[key] = set()
+        for row in rows:
+            value = row.get(key)
+            if value and value not in ids[key]:
+                id_ = cache.get(value)
+                if id_ is None:
+                    missing[key].add(value)
+                else:
+                    ids[key][value] = id_
+
+    if any(missing.values()):
+        session = AsyncSessionLocal() if bind is None else AsyncSession(bind)
+        async with session as db:
+            found = {
+                key: await dimension_caches[key].lookup(db, values)
+                for key, values in missing.items()
+            }
+            await db.commit()
+        for key, values in found.items():
+            dimension_caches[key].put(values)
+            ids[key].update(values)
+
+    encoded = []
+    for row in rows:
+        values = {
+            column: value
+            for column, value in row.items()
+            if column not in PAGE_VIEW_DIMENSIONS
+        }
+        for key, (id_column, _) in PAGE_VIEW_DIMENSIONS.items():
+            value = row.get(key)
+            values[id_column] = ids[key][value] if value else None
+        encoded.append(values)
+    return encoded
@@ -0,0 +1,232 @@
+"""
+Write-behind ingestion buffer for tracking events
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal, Event, PageView
+from dimensions import encode_page_views
+from rollups import record_events, record_page_views, top_items_tracker
+from spill import SpillLog, write_isolating
+
+
+class WriteBehindBuffer:
+    """Bounded in-process queue of rows flushed to the database in batches
+
+    Request handlers append rows and return immediately. A background task
+    writes them as one multi-row INSERT every ``batch_size`` rows or every
+    ``flush_interval_ms`` milliseconds, whichever comes first. When the
+    buffer is not running, ``enqueue`` returns False and the caller is
+    expected to write the row itself. So does a full buffer without a
+    ``spill`` log; with one, rows that do not fit and batches that fail to
+    write are appended to it and replayed later (see spill.py). A batch
+    failing because of some of its rows is split until only those rows are
+    left; they are dropped, or set aside by the spill log.
+
+    ``encode`` maps a batch to the values inserted, e.g. to replace strings
+    by dimension ids. ``on_write`` is awaited with each batch as queued,
+    inside the INSERT's transaction, for derived tables such as rollups
+    that must stay in step with it. ``on_commit`` is called with each batch
+    once its transaction has committed, for state outside the database.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_size: int,
+        batch_size: int,
+        flush_interval_ms: int,
+        on_write: Optional[
+            Callable[[AsyncSession, List[Dict[str, Any]]], Awaitable[None]]
+        ] = None,
+        encode: Optional[
+            Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+        ] = None,
+        spill: Optional[SpillLog] = None,
+        on_commit: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ) -> None:
+        self.model = model
+        self.encode = encode
+        self.spill = spill
+        self.on_write = on_write
+        self.on_commit = on_commit
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._rows: Deque[Dict[str, Any]] = deque()
+        # Batch being written by flush, still to be spilled if stop times out
+        self._in_flight: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        """Whether the flush task is accepting rows"""
+        return self._task is not None and not self._stopping
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def enqueue(self, row: Dict[str, Any]) -> bool:
+        """Queue a single row for writing"""
+        return self.enqueue_many([row])
+
+    def enqueue_many(self, rows: List[Dict[str, Any]]) -> bool:
+        """Queue rows for writing, all or nothing"""
+        if not self.running:
+            return False
+        if len(self._rows) + len(rows) > self.max_size:
+            if self.spill is None:
+                return False
+            self.spill.append(rows)
+            return True
+
+        self._rows.extend(rows)
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def start(self) -> None:
+        """Start the background flush task"""
+        if self._task is not None:
+            return
+
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting rows and drain whatever is still queued"""
+        if self._task is None:
+            return
+
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            # Parts of the cancelled batch may be written already; spilling
+            # it whole keeps delivery at least once
+            unwritten = self._in_flight + list(self._rows)
+            self._in_flight = []
+            self._rows.clear()
+            if self.spill is None:
+                print(
+                    f"⚠️ Ingest buffer drain timed out, {len(unwritten)} rows dropped"
+                )
+            else:
+                print(f"⚠️ Ingest buffer drain timed out, spilling {len(unwritten)}")
+                self.spill.append(unwritten)
+        finally:
+            self._task = None
+            if self.spill is not None:
+                self.spill.close_segment()
+
+    async def _run(self) -> None:
+        """Flush loop: wake on a full batch or on the flush interval"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write all queued rows, at most ``batch_size`` per INSERT"""
+        while self._rows:
+            batch = [
+                self._rows.popleft()
+                for _ in range(min(self.batch_size, len(self._rows)))
+            ]
+            self._in_flight = batch
+            table = self.model.__tablename__
+            try:
+                rejected = await write_isolating(self._write, batch)
+            except Exception as e:
+                rejected = []
+                if self.spill is None:
+                    print(f"❌ Failed to flush {len(batch)} {table}: {e}")
+                else:
+                    print(f"⚠️ Failed to flush {len(batch)} {table}, spilling: {e}")
+                    self.spill.append(batch)
+            self._in_flight = []
+
+            if rejected and self.spill is None:
+                print(
+                    f"❌ Dropped {len(rejected)} {table} rows the database "
+                    f"rejected: {rejected[0][1]}"
+                )
+            elif rejected:
+                self.spill.reject(rejected)
+
+    async def replay_spill(self) -> None:
+        """Write spilled rows back to the database
+
+        Waits while more than a batch is queued: the database is still
+        lagging and new rows go first.
+        """
+        if self.spill is not None and len(self._rows) <= self.batch_size:
+            await self.spill.replay(self._write, self.batch_size)
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> None:
+        """Insert a batch of rows in one transaction"""
+        values = await self.encode(rows) if self.encode else rows
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(self.model), values)
+            if self.on_write:
+                await self.on_write(db, rows)
+            await db.commit()
+        if self.on_commit:
+            self.on_commit(rows)
+
+
+page_view_buffer = WriteBehindBuffer(
+    PageView,
+    max_size=settings.ingest_buffer_max_size,
+    batch_size=settings.ingest_batch_size,
+    flush_interval_ms=settings.ingest_flush_interval_ms,
+    on_write=record_page_views,
+    encode=encode_page_views,
+    on_commit=top_items_tracker.add,
+    spill=(
+        SpillLog(settings.spill_dir, PageView, settings.spill_segment_max_bytes)
+        if settings.spill_dir
+        else None
+    ),
+)
+
+event_buffer = WriteBehindBuffer(
+    Event,
+    max_size=settings.ingest_buffer_max_size,
+    batch_size=settings.ingest_batch_size,
+    flush_interval_ms=settings.ingest_flush_interval_ms,
+    on_write=record_events,
+    spill=(
+        SpillLog(settings.spill_dir, Event, settings.spill_segment_max_bytes)
+        if settings.spill_dir
+        else None
+    ),
+)
+
+
+def sync_spill_logs() -> None:
+    """fsync the spill logs of the ingest buffers"""
+    for buffer in (page_view_buffer, event_buffer):
+        if buffer.spill is not None:
+            buffer.spill.sync()
+
+
+async def replay_spill_logs() -> None:
+    """Replay the spill logs of the ingest buffers"""
+    for buffer in (page_view_buffer, event_buffer):
+        await buffer.replay_spill()
@@ -4,10 +4,22 @@ Migration script for existing user data
 
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from sqlalchemy import column, delete, insert, inspect, or_, select, table, text, update
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session as DBSession
 
-from database import SessionLocal, User, CADEvent
+from compaction import compacted_before, record_compaction
+from database import engine, SessionLocal, User, CADEvent, Event, PageView, PagePath
+from dimensions import PAGE_VIEW_DIMENSIONS, value_digest
+from partitions import PARTITIONED_TABLES, create_partitions, is_partitioned
+
+# Pseudo-paths link clicks and scroll milestones were stored under as page views
+LINK_CLICK_PREFIX = "/link-click/"
+SCROLL_PREFIX = "/scroll/"
+# compaction_state entry: pseudo-path page views before it have been moved
+PSEUDO_PATH_MIGRATION = "page_views_pseudo_paths"
 
 
 def migrate_existing_data(json_file_path: str):
@@ -25,6 +37,18 @@ def migrate_existing_data(json_file_path: str):
 
         print(f"📦 Migrating {len(data)} users...")
 
+        # Historic events need partitions to land in
+        timestamps = [
+            datetime.fromisoformat(prompt["timestamp"])
+            for user_data in data.values()
+            for prompt in user_data.get("prompts", [])
+            if prompt.get("timestamp")
+        ]
+        if timestamps:
+            create_partitions(
+                db.connection(), CADEvent.__table__, min(timestamps), max(timestamps)
+            )
+
         for user_id, user_data in data.items():
             # Check if user already exists
             existing_user = db.query(User).filter(User.id == user_id).first()
@@ -81,6 +105,263 @@ def migrate_existing_data(json_file_path: str):
         db.close()
 
 
+def migrate_page_view_dimensions(batch_size: int = 10000) -> bool:
+    """Replace the path, user agent and referrer strings of page_views by ids
+
+    Tables created before the dimension tables hold the strings themselves.
+    Their distinct values are interned, the id columns filled in one
+    UPDATE and the string columns dropped; the table is then rewritten
+    with VACUUM FULL to give the space back. Returns whether anything was
+    migrated.
+    """
+    existing = {info["name"] for info in inspect(engine).get_columns("page_views")}
+    legacy = [key for key in PAGE_VIEW_DIMENSIONS if key in existing]
+    if not legacy:
+        return False
+
+    print(f"📦 Moving page_views {', '.join(legacy)} to dimension tables...")
+    old = table("page_views", column("id"), *(column(key) for key in legacy))
+    source = old
+    ids = []
+    with engine.begin() as conn:
+        for key in legacy:
+            id_column, model = PAGE_VIEW_DIMENSIONS[key]
+            conn.execute(
+                text(
+                    f"ALTER TABLE page_views ADD COLUMN IF NOT EXISTS {id_column} INTEGER"
+                )
+            )
+            values = conn.scalars(
+                select(old.c[key]).distinct().where(old.c[key] != "")
+            ).all()
+            for start in range(0, len(values), batch_size):
+                conn.execute(
+                    postgresql.insert(model).on_conflict_do_nothing(
+                        index_elements=["digest"]
+                    ),
+                    [
+                        {"digest": value_digest(value), "value": value}
+                        for value in values[start : start + batch_size]
+                    ],
+                )
+            print(f"📦 Interned {len(values)} {model.__tablename__}")
+
+            source = source.outerjoin(model, model.value == old.c[key])
+            ids.append(model.id.label(id_column))
+
+        encoded = select(old.c.id, *ids).select_from(source).subquery()
+        result = conn.execute(
+            update(PageView)
+            .where(PageView.id == encoded.c.id)
+            .values({label.name: encoded.c[label.name] for label in ids})
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE page_views "
+                + ", ".join(f"DROP COLUMN {key}" for key in legacy)
+            )
+        )
+    print(f"📦 Encoded {result.rowcount} page views")
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM FULL page_views"))
+    print("✅ page_views rewritten")
+    return True
+
+
+def migrate_page_view_sample_weight() -> bool:
+    """Add the sample_weight column to page_views tables created without it
+
+    Existing rows get a weight of 1. Returns whether the column was added.
+    """
+    existing = {info["name"] for info in inspect(engine).get_columns("page_views")}
+    if "sample_weight" in existing:
+        return False
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "ALTER TABLE page_views "
+                "ADD COLUMN sample_weight INTEGER NOT NULL DEFAULT 1"
+            )
+        )
+    print("✅ Added page_views.sample_weight")
+    return True
+
+
+def migrate_to_partitioned_tables() -> bool:
+    """Convert unpartitioned raw tables into partitioned ones
+
+    Tables created before partitioning are renamed, their rows copied into
+    a new partitioned table with partitions covering them, and dropped, one
+    table per transaction. Returns whether any table was converted.
+    """
+    if engine.dialect.name != "postgresql":
+        return False
+
+    converted = False
+    for table in PARTITIONED_TABLES:
+        with engine.begin() as conn:
+            if is_partitioned(conn, table.name):
+                continue
+
+            legacy = f"{table.name}_unpartitioned"
+            print(f"📦 Partitioning {table.name}...")
+            sequence = conn.scalar(
+                text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                {"table": table.name},
+            )
+            conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{legacy}"'))
+            if sequence:
+                conn.execute(
+                    text(f'ALTER SEQUENCE {sequence} RENAME TO "{legacy}_id_seq"')
+                )
+
+            # Free the index and constraint names for the new table
+            inspector = inspect(conn)
+            for index in inspector.get_indexes(legacy):
+                conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+            primary_key = inspector.get_pk_constraint(legacy)["name"]
+            if primary_key:
+                conn.execute(
+                    text(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{primary_key}"')
+                )
+
+            table.create(conn)
+            earliest, latest, last_id = conn.execute(
+                text(f'SELECT min(timestamp), max(timestamp), max(id) FROM "{legacy}"')
+            ).one()
+            if earliest:
+                create_partitions(conn, table, earliest, latest)
+
+            columns = ", ".join(f'"{column.name}"' for column in table.columns)
+            result = conn.execute(
+                text(
+                    f'INSERT INTO "{table.name}" ({columns}) '
+                    f'SELECT {columns} FROM "{legacy}"'
+                )
+            )
+            if last_id:
+                conn.execute(
+                    text("SELECT setval(pg_get_serial_sequence(:table, 'id'), :id)"),
+                    {"table": table.name, "id": last_id},
+                )
+            conn.execute(text(f'DROP TABLE "{legacy}"'))
+            print(f"✅ Copied {result.rowcount} rows into partitioned {table.name}")
+            converted = True
+    return converted
+
+
+def pseudo_path_event(path: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Event type and properties encoded in a legacy pseudo-path"""
+    if path.startswith(LINK_CLICK_PREFIX):
+        return "link_click", {"link_type": path[len(LINK_CLICK_PREFIX) :] or "unknown"}
+    if path.startswith(SCROLL_PREFIX):
+        value = path[len(SCROLL_PREFIX) :].rstrip("%")
+        try:
+            percentage = float(value)
+        except ValueError:
+            return "scroll", {"scroll_percentage": value}
+        if percentage.is_integer():
+            percentage = int(percentage)
+        return "scroll", {"scroll_percentage": percentage}
+    return None
+
+
+def migrate_pseudo_path_events(batch_size: int = 10000) -> Optional[datetime]:
+    """Move link clicks and scroll milestones from page_views to events
+
+    Each batch is inserted and deleted in one transaction, so an interrupted
+    run can simply be repeated. Returns the earliest moved timestamp, from
+    which the rollups need rebuilding, or None if nothing was moved.
+
+    page_views.path_id is not indexed, so this runs on every startup
+    without scanning page_views unless needed: not at all when no pseudo
+    path was ever interned, and after a finished run only in the partitions
+    tracked since, which the run records in compaction_state.
+    """
+    db = SessionLocal()
+    earliest = None
+    moved = 0
+    started = datetime.utcnow()
+
+    try:
+        paths = dict(
+            db.execute(
+                select(PagePath.id, PagePath.value).where(
+                    or_(
+                        PagePath.value.startswith(LINK_CLICK_PREFIX),
+                        PagePath.value.startswith(SCROLL_PREFIX),
+                    )
+                )
+            ).all()
+        )
+        if not paths:
+            return None
+
+        pseudo_path_views = PageView.path_id.in_(list(paths))
+        migrated_before = compacted_before(db.connection(), PSEUDO_PATH_MIGRATION)
+        if migrated_before:
+            pseudo_path_views &= PageView.timestamp >= migrated_before
+
+        while True:
+            views = db.scalars(
+                select(PageView)
+                .where(pseudo_path_views)
+                .order_by(PageView.id)
+                .limit(batch_size)
+            ).all()
+            if not views:
+                break
+
+            rows = []
+            for view in views:
+                event_type, properties = pseudo_path_event(paths[view.path_id])
+                rows.append(
+                    {
+                        "timestamp": view.timestamp,
+                        "site": view.site,
+                        "event_type": event_type,
+                        "ip_address": view.ip_address,
+                        "session_id": view.session_id,
+                        "user_id": view.user_id,
+                        "properties": properties,
+                    }
+                )
+            # Historic rows may predate every events partition
+            timestamps = [row["timestamp"] for row in rows if row["timestamp"]]
+            if timestamps:
+                create_partitions(
+                    db.connection(), Event.__table__, min(timestamps), max(timestamps)
+                )
+            db.execute(insert(Event), rows)
+            db.execute(
+                delete(PageView).where(PageView.id.in_([view.id for view in views]))
+            )
+            db.commit()
+
+            moved += len(views)
+            oldest = min(view.timestamp for view in views)
+            earliest = oldest if earliest is None else min(earliest, oldest)
+
+        # Page views still being buffered at the start may be older
+        record_compaction(
+            db.connection(), PSEUDO_PATH_MIGRATION, started - timedelta(hours=1)
+        )
+        db.commit()
+
+        if moved:
+            print(f"📦 Moved {moved} link click and scroll page views to events")
+        return earliest
+
+    except Exception as e:
+        print(f"❌ Event migration error: {str(e)}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
 if __name__ == "__main__":
     # Run migration if executed directly
     migrate_existing_data("/app/collected_user_emails.json")
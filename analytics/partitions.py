@@ -0,0 +1,186 @@
+"""
+Time partitions of the raw event tables
+
+On PostgreSQL, page_views, events and cad_events are range partitioned by
+``timestamp``, one partition per day or month (PARTITION_INTERVAL). Stats
+queries filter on timestamp, so only the partitions of their window are
+scanned. Partitions are created PARTITIONS_AHEAD intervals ahead; the
+compaction job (see compaction.py) drops those wholly older than a
+table's retention period, which expires old rows without a DELETE:
+
+    python partitions.py maintain
+"""
+
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Connection
+
+from config import settings
+from database import engine, CADEvent, Event, PageView
+
+# Partitioned tables and their raw row retention in days (0 keeps all rows)
+PARTITIONED_TABLES: Dict[Table, int] = {
+    PageView.__table__: settings.page_views_retention_days,
+    Event.__table__: settings.events_retention_days,
+    CADEvent.__table__: settings.cad_events_retention_days,
+}
+
+# Partition name suffix per interval, e.g. page_views_p202401
+SUFFIX_FORMATS = {"month": "%Y%m", "day": "%Y%m%d"}
+
+
+def partition_start(timestamp: datetime, interval: str) -> datetime:
+    """Start of the partition containing timestamp"""
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "day":
+        return day
+    if interval == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown partition interval: {interval}")
+
+
+def partition_end(start: datetime, interval: str) -> datetime:
+    """Start of the partition after the one starting at start"""
+    if interval == "day":
+        return start + timedelta(days=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table_name: str, start: datetime, interval: str) -> str:
+    return f"{table_name}_p{start.strftime(SUFFIX_FORMATS[interval])}"
+
+
+def partition_range(table_name: str, name: str) -> Optional[Tuple[datetime, datetime]]:
+    """[start, end) of a partition created here, from its name"""
+    prefix = f"{table_name}_p"
+    if not name.startswith(prefix):
+        return None
+
+    for interval, suffix_format in SUFFIX_FORMATS.items():
+        try:
+            start = datetime.strptime(name[len(prefix) :], suffix_format)
+        except ValueError:
+            continue
+        return start, partition_end(start, interval)
+    return None
+
+
+def is_partitioned(conn: Connection, table_name: str) -> bool:
+    return bool(
+        conn.scalar(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table)"
+            ),
+            {"table": table_name},
+        )
+    )
+
+
+def existing_partitions(
+    conn: Connection, table_name: str
+) -> Dict[str, Tuple[datetime, datetime]]:
+    """Ranges of the table's partitions, by name"""
+    names = conn.scalars(
+        text(
+            "SELECT child.relname FROM pg_inherits i "
+            "JOIN pg_class child ON child.oid = i.inhrelid "
+            "JOIN pg_class parent ON parent.oid = i.inhparent "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": table_name},
+    )
+    ranges = {name: partition_range(table_name, name) for name in names}
+    return {name: bounds for name, bounds in ranges.items() if bounds}
+
+
+def create_partitions(
+    conn: Connection,
+    table: Table,
+    since: datetime,
+    until: datetime,
+    interval: Optional[str] = None,
+) -> List[str]:
+    """Create the missing partitions covering [since, until]
+
+    Ranges overlapping an existing partition, e.g. one created with another
+    interval, are skipped. Does nothing unless the table is partitioned.
+    """
+    if conn.dialect.name != "postgresql" or not is_partitioned(conn, table.name):
+        return []
+
+    interval = interval or settings.partition_interval
+    existing = list(existing_partitions(conn, table.name).values())
+    created = []
+    start = partition_start(since, interval)
+    while start <= until:
+        end = partition_end(start, interval)
+        if not any(
+            start < other_end and other_start < end
+            for other_start, other_end in existing
+        ):
+            name = partition_name(table.name, start, interval)
+            conn.execute(
+                text(
+                    f'CREATE TABLE "{name}" PARTITION OF "{table.name}" '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            )
+            existing.append((start, end))
+            created.append(name)
+        start = end
+    return created
+
+
+def drop_expired_partitions(
+    conn: Connection, table: Table, cutoff: datetime
+) -> List[str]:
+    """Drop the partitions whose rows are all older than cutoff"""
+    dropped = []
+    for name, (_, end) in sorted(existing_partitions(conn, table.name).items()):
+        if end <= cutoff:
+            conn.execute(text(f'DROP TABLE "{name}"'))
+            dropped.append(name)
+    return dropped
+
+
+def retention_cutoff(
+    retention_days: int, now: Optional[datetime] = None
+) -> Optional[datetime]:
+    """Rows older than this may have been dropped, or None to keep all"""
+    if retention_days <= 0:
+        return None
+    return (now or datetime.utcnow()) - timedelta(days=retention_days)
+
+
+def maintain_partitions(now: Optional[datetime] = None) -> None:
+    """Create the current and upcoming partitions"""
+    if engine.dialect.name != "postgresql":
+        return
+
+    now = now or datetime.utcnow()
+    interval = settings.partition_interval
+    until = now
+    for _ in range(settings.partitions_ahead):
+        until = partition_end(partition_start(until, interval), interval)
+
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            created = create_partitions(conn, table, now, until, interval)
+            if created:
+                print(f"🗂️ {table.name}: created {len(created)} partitions")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage raw table partitions")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser(
+        "maintain", help="Create the current and upcoming partitions"
+    )
+    args = parser.parse_args()
+
+    if args.command == "maintain":
+        maintain_partitions()
@@ -0,0 +1,336 @@
+"""
+Rate limiting backends and middleware
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, case, func, not_, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import JSONResponse
+
+from config import settings
+from database import AsyncSessionLocal, RateLimit
+
+
+class RateLimitBackend(ABC):
+    """Interface for rate limit storage"""
+
+    @abstractmethod
+    async def check(
+        self,
+        identifier: str,
+        identifier_type: str = "ip",
+        cost: int = 1,
+        db: Optional[AsyncSession] = None,
+    ) -> bool:
+        """Charge ``cost`` requests to identifier; False if over the limit"""
+
+    async def snapshot(self) -> None:
+        """Persist state the admin should be able to see (optional)"""
+
+
+class DatabaseRateLimitBackend(RateLimitBackend):
+    """Fixed-window counters stored in the rate_limits table
+
+    Every check is a single atomic upsert, so this backend is safe to use
+    from several workers sharing one database.
+    """
+
+    async def check(
+        self,
+        identifier: str,
+        identifier_type: str = "ip",
+        cost: int = 1,
+        db: Optional[AsyncSession] = None,
+    ) -> bool:
+        if db is not None:
+            return await self._check(db, identifier, identifier_type, cost)
+
+        async with AsyncSessionLocal() as db:
+            return await self._check(db, identifier, identifier_type, cost)
+
+    async def _check(
+        self, db: AsyncSession, identifier: str, identifier_type: str, cost: int
+    ) -> bool:
+        """Window reset, increment and block decision in one upsert
+
+        Doing this in a single INSERT ... ON CONFLICT DO UPDATE statement
+        means concurrent requests from one identifier can neither lose
+        increments nor race on the unique constraint.
+        """
+        now = datetime.utcnow()
+        window_floor = now - timedelta(minutes=settings.rate_limit_window_minutes)
+        block_until = now + timedelta(minutes=settings.rate_limit_block_minutes)
+        limit = settings.rate_limit_requests
+
+        # Conditions on the existing row
+        blocked = and_(
+            RateLimit.is_blocked.is_(True),
+            func.coalesce(RateLimit.block_until, now) > now,
+        )
+        expired = RateLimit.window_start < window_floor
+        request_count = case(
+            (blocked, RateLimit.request_count),
+            (expired, cost),
+            else_=RateLimit.request_count + cost,
+        )
+        over_limit = request_count > limit
+
+        stmt = insert(RateLimit).values(
+            identifier=identifier,
+            identifier_type=identifier_type,
+            request_count=cost,
+            window_start=now,
+            last_request=now,
+            is_blocked=cost > limit,
+            block_until=block_until if cost > limit else None,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RateLimit.identifier],
+            set_={
+                "request_count": request_count,
+                "window_start": case(
+                    (and_(not_(blocked), expired), now),
+                    else_=RateLimit.window_start,
+                ),
+                "last_request": case((blocked, RateLimit.last_request), else_=now),
+                "is_blocked": or_(blocked, over_limit),
+                "block_until": case(
+                    (blocked, RateLimit.block_until),
+                    (over_limit, block_until),
+                    else_=RateLimit.block_until,
+                ),
+            },
+        ).returning(RateLimit.is_blocked, RateLimit.block_until)
+
+        is_blocked, until = (await db.execute(stmt)).one()
+        await db.commit()
+
+        return not (is_blocked and until is not None and until > now)
+
+
+class _Counter:
+    """Sliding window state for one identifier"""
+
+    __slots__ = ("window", "current", "previous", "block_until", "last_request")
+
+    def __init__(self, window: int) -> None:
+        self.window = window
+        self.current = 0
+        self.previous = 0
+        self.block_until = 0.0
+        self.last_request = 0.0
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """In-process sliding-window counters
+
+    The count for the current window is combined with the previous window's
+    count, weighted by how much of the previous window still overlaps the
+    sliding window. An identifier that goes over the limit is blocked until
+    ``block_seconds`` have passed, like the database backend.
+
+    At most ``max_entries`` identifiers are tracked; the least recently seen
+    are evicted first. Blocked identifiers are also kept apart until their
+    block expires, so flooding the counters with new identifiers cannot
+    evict a block. They are written to the rate_limits table by
+    ``snapshot`` so they remain visible to the admin.
+    """
+
+    def __init__(
+        self,
+        max_requests: int,
+        window_seconds: int,
+        block_seconds: int,
+        max_entries: int,
+    ) -> None:
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.block_seconds = block_seconds
+        self.max_entries = max_entries
+        self._counters: "OrderedDict[Tuple[str, str], _Counter]" = OrderedDict()
+        self._blocked: Dict[Tuple[str, str], _Counter] = {}
+        self._snapshotted: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    async def check(
+        self,
+        identifier: str,
+        identifier_type: str = "ip",
+        cost: int = 1,
+        db: Optional[AsyncSession] = None,
+    ) -> bool:
+        return self.allow(identifier, identifier_type, cost)
+
+    def allow(
+        self, identifier: str, identifier_type: str = "ip", cost: int = 1
+    ) -> bool:
+        """Synchronous check; never does I/O"""
+        now = time.time()
+        window = int(now // self.window_seconds)
+        key = (identifier_type, identifier)
+
+        with self._lock:
+            blocked = self._blocked.get(key)
+            if blocked is not None:
+                if blocked.block_until > now:
+                    return False
+                del self._blocked[key]
+
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = _Counter(window)
+                self._counters[key] = counter
+                if len(self._counters) > self.max_entries:
+                    self._counters.popitem(last=False)
+            else:
+                self._counters.move_to_end(key)
+
+            if counter.window != window:
+                counter.previous = (
+                    counter.current if counter.window == window - 1 else 0
+                )
+                counter.current = 0
+                counter.window = window
+
+            counter.last_request = now
+            overlap = 1 - (now % self.window_seconds) / self.window_seconds
+            estimated = counter.previous * overlap + counter.current + cost
+            if estimated > self.max_requests:
+                counter.block_until = now + self.block_seconds
+                self._blocked[key] = counter
+                return False
+
+            counter.current += cost
+            return True
+
+    def blocked(self) -> List[Tuple[str, str, _Counter]]:
+        """Identifiers that are currently blocked"""
+        now = time.time()
+        with self._lock:
+            self._blocked = {
+                key: counter
+                for key, counter in self._blocked.items()
+                if counter.block_until > now
+            }
+            return [
+                (identifier_type, identifier, counter)
+                for (identifier_type, identifier), counter in self._blocked.items()
+            ]
+
+    async def snapshot(self) -> None:
+        """Upsert newly blocked identifiers into rate_limits"""
+        rows = []
+        for identifier_type, identifier, counter in self.blocked():
+            key = (identifier_type, identifier)
+            if self._snapshotted.get(key) == counter.block_until:
+                continue
+            self._snapshotted[key] = counter.block_until
+            rows.append(
+                {
+                    "identifier": identifier,
+                    "identifier_type": identifier_type,
+                    "request_count": counter.current,
+                    "window_start": datetime.utcfromtimestamp(
+                        counter.window * self.window_seconds
+                    ),
+                    "last_request": datetime.utcfromtimestamp(counter.last_request),
+                    "is_blocked": True,
+                    "block_until": datetime.utcfromtimestamp(counter.block_until),
+                }
+            )
+
+        # Forget snapshots of blocks that have expired
+        now = time.time()
+        self._snapshotted = {
+            key: until for key, until in self._snapshotted.items() if until > now
+        }
+
+        if not rows:
+            return
+
+        stmt = insert(RateLimit)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RateLimit.identifier],
+            set_={
+                column: stmt.excluded[column]
+                for column in (
+                    "identifier_type",
+                    "request_count",
+                    "window_start",
+                    "last_request",
+                    "is_blocked",
+                    "block_until",
+                )
+            },
+        )
+        async with AsyncSessionLocal() as db:
+            await db.execute(stmt, rows)
+            await db.commit()
+
+
+class RateLimitMiddleware:
+    """ASGI middleware that rejects over-limit clients up front
+
+    Runs before the body is read, dependencies are resolved or a database
+    session is opened, so rejected requests cost one counter lookup. Each
+    route prefix in ``route_costs`` has its own cost; the longest matching
+    prefix wins, and paths with no match or a cost of 0 are not limited.
+    The cost charged is left in ``request.state.rate_limit_cost`` for
+    handlers that charge more once the body is read.
+    """
+
+    def __init__(
+        self, app, backend: RateLimitBackend, route_costs: Dict[str, int]
+    ) -> None:
+        self.app = app
+        self.backend = backend
+        self.route_costs = sorted(
+            route_costs.items(), key=lambda item: len(item[0]), reverse=True
+        )
+
+    def cost_for(self, path: str) -> int:
+        """Cost of a request to path"""
+        for prefix, cost in self.route_costs:
+            if path.startswith(prefix):
+                return cost
+        return 0
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        cost = self.cost_for(scope["path"])
+        if cost:
+            client = scope.get("client")
+            identifier = client[0] if client else "unknown"
+            if not await self.backend.check(identifier, "ip", cost):
+                response = JSONResponse(
+                    {"detail": "Rate limit exceeded"}, status_code=429
+                )
+                await response(scope, receive, send)
+                return
+            scope.setdefault("state", {})["rate_limit_cost"] = cost
+
+        await self.app(scope, receive, send)
+
+
+def create_rate_limit_backend(name: str) -> RateLimitBackend:
+    """Build the backend selected by ``settings.rate_limit_backend``"""
+    if name == "memory":
+        return MemoryRateLimitBackend(
+            max_requests=settings.rate_limit_requests,
+            window_seconds=settings.rate_limit_window_minutes * 60,
+            block_seconds=settings.rate_limit_block_minutes * 60,
+            max_entries=settings.rate_limit_max_entries,
+        )
+    if name == "database":
+        return DatabaseRateLimitBackend()
+    raise ValueError(f"Unknown rate limit backend: {name}")
@@ -0,0 +1,691 @@
+"""
+Hourly rollups of page views, events and CAD events
+
+Raw events are added to the rollup tables in the same transaction that
+inserts them, so the admin stats can read a few rows per hour instead of
+scanning every event. Distinct visitors and users are kept as HyperLogLog
+sketches (see sketches.py), which merge across hours where counts cannot.
+Top paths and referrers are counted in memory with Space-Saving
+summaries (see topk.py) and merged into their table periodically.
+
+``backfill`` rebuilds the rollups from the raw tables for data written
+before they existed:
+
+    python rollups.py backfill [--since 2024-01-01] [--until 2024-02-01]
+"""
+
+import argparse
+import threading
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy import delete, false, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import array, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import (
+    SessionLocal,
+    AsyncSessionLocal,
+    PageView,
+    PagePath,
+    Referrer,
+    Event,
+    CADEvent,
+    PageViewHourly,
+    EventHourly,
+    CADEventHourly,
+    CADDurationHourly,
+    PageViewVisitorsHourly,
+    CADUsersHourly,
+    TopItemsHourly,
+    CompactionState,
+)
+from partitions import retention_cutoff
+from sketches import HyperLogLog
+from topk import SpaceSaving
+
+# Upper bounds (ms) of the CAD duration histogram buckets. Bucket i holds
+# durations in [DURATION_BUCKETS_MS[i - 1], DURATION_BUCKETS_MS[i]); the
+# last bucket is open-ended. Matches Postgres width_bucket(duration, array).
+DURATION_BUCKETS_MS = (
+    50,
+    100,
+    200,
+    300,
+    500,
+    750,
+    1000,
+    1500,
+    2000,
+    3000,
+    5000,
+    7500,
+    10000,
+    15000,
+    20000,
+    30000,
+    60000,
+    120000,
+)
+
+
+def hour_of(timestamp: datetime) -> datetime:
+    """Start of the hour containing timestamp"""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+# Time series bucket widths; buckets are aligned like date_trunc
+BUCKET_WIDTHS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+def bucket_of(timestamp: datetime, bucket: str) -> datetime:
+    """Start of the time series bucket containing timestamp"""
+    start = timestamp.replace(second=0, microsecond=0)
+    if bucket == "minute":
+        return start
+    start = start.replace(minute=0)
+    if bucket == "hour":
+        return start
+    if bucket == "day":
+        return start.replace(hour=0)
+    raise ValueError(f"Unknown time series bucket: {bucket}")
+
+
+def first_full_hour(since: datetime) -> datetime:
+    """First hour boundary at or after since
+
+    Stats windows read whole hours from the rollups and the partial hour
+    before this boundary from the raw tables.
+    """
+    hour = hour_of(since)
+    return hour if hour == since else hour + timedelta(hours=1)
+
+
+def rollup_boundary(since: datetime, retention_days: int) -> datetime:
+    """First hour a stats window reads from the rollups
+
+    Normally ``first_full_hour(since)``. Raw rows past their retention may
+    have been compacted, so a window starting there counts the hour that
+    contains ``since`` in full, as the top items do.
+    """
+    cutoff = retention_cutoff(retention_days)
+    if cutoff and since < cutoff:
+        return hour_of(since)
+    return first_full_hour(since)
+
+
+def duration_bucket(duration_ms: int) -> int:
+    """Histogram bucket of a duration"""
+    return bisect_right(DURATION_BUCKETS_MS, duration_ms)
+
+
+def percentile_from_histogram(buckets: Dict[int, int], fraction: float) -> int:
+    """Estimate a duration percentile from bucket counts
+
+    Interpolates linearly inside the bucket that holds the percentile; the
+    open-ended last bucket reports its lower bound.
+    """
+    total = sum(buckets.values())
+    if not total:
+        return 0
+
+    rank = fraction * total
+    seen = 0
+    for bucket in sorted(buckets):
+        count = buckets[bucket]
+        if count and seen + count >= rank:
+            lower = DURATION_BUCKETS_MS[bucket - 1] if bucket else 0
+            if bucket >= len(DURATION_BUCKETS_MS):
+                return lower
+            upper = DURATION_BUCKETS_MS[bucket]
+            return int(lower + (upper - lower) * (rank - seen) / count)
+        seen += count
+    return DURATION_BUCKETS_MS[-1]
+
+
+def page_view_rollup_rows(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Aggregate page_views rows into page_views_hourly increments"""
+    views: Counter = Counter()
+    for row in rows:
+        key = (hour_of(row["timestamp"]), row["site"] or "", row["path"] or "")
+        views[key] += row.get("sample_weight", 1)
+    return [
+        {"hour": hour, "site": site, "path": path, "views": count}
+        for (hour, site, path), count in sorted(views.items())
+    ]
+
+
+def cad_event_rollup_rows(
+    rows: Iterable[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Aggregate cad_events rows into hourly event and duration increments"""
+    events: Dict[Tuple[datetime, str, bool], Dict[str, int]] = {}
+    durations: Counter = Counter()
+    for row in rows:
+        hour = hour_of(row["timestamp"])
+        key = (hour, row["event_type"] or "unknown", bool(row["success"]))
+        totals = events.setdefault(
+            key, {"events": 0, "duration_count": 0, "duration_sum": 0}
+        )
+        totals["events"] += 1
+        if row.get("duration_ms") is not None:
+            totals["duration_count"] += 1
+            totals["duration_sum"] += row["duration_ms"]
+            durations[(hour, duration_bucket(row["duration_ms"]))] += 1
+
+    return (
+        [
+            {"hour": hour, "event_type": event_type, "success": success, **totals}
+            for (hour, event_type, success), totals in sorted(events.items())
+        ],
+        [
+            {"hour": hour, "bucket": bucket, "events": count}
+            for (hour, bucket), count in sorted(durations.items())
+        ],
+    )
+
+
+def visitor_sketches(
+    rows: Iterable[Dict[str, Any]],
+) -> Dict[Tuple[datetime, str], HyperLogLog]:
+    """Sketch the visitor IPs of page_views rows per (hour, site)"""
+    sketches: Dict[Tuple[datetime, str], HyperLogLog] = defaultdict(HyperLogLog)
+    for row in rows:
+        if row.get("ip_address") is not None:
+            key = (hour_of(row["timestamp"]), row["site"] or "")
+            sketches[key].add(row["ip_address"])
+    return sketches
+
+
+def user_sketches(rows: Iterable[Dict[str, Any]]) -> Dict[Tuple[datetime], HyperLogLog]:
+    """Sketch the user IDs of cad_events rows per hour"""
+    sketches: Dict[Tuple[datetime], HyperLogLog] = defaultdict(HyperLogLog)
+    for row in rows:
+        if row.get("user_id") is not None:
+            sketches[(hour_of(row["timestamp"]),)].add(row["user_id"])
+    return sketches
+
+
+# Properties that label an event in events_hourly, first present wins
+EVENT_LABEL_PROPERTIES = ("link_type", "scroll_percentage")
+EVENT_LABEL_LENGTH = 100
+
+
+def event_label(properties: Dict[str, Any]) -> str:
+    """Rollup label of an event: its link type or scroll percentage"""
+    for name in EVENT_LABEL_PROPERTIES:
+        if properties.get(name) is not None:
+            return str(properties[name])[:EVENT_LABEL_LENGTH]
+    return ""
+
+
+def event_label_column():
+    """SQL expression matching ``event_label`` for rows of events"""
+    return func.substr(
+        func.coalesce(
+            *(Event.properties[name].as_string() for name in EVENT_LABEL_PROPERTIES),
+            "",
+        ),
+        1,
+        EVENT_LABEL_LENGTH,
+    )
+
+
+def event_rollup_rows(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Aggregate events rows into events_hourly increments"""
+    events = Counter(
+        (
+            hour_of(row["timestamp"]),
+            row["site"] or "",
+            row["event_type"],
+            event_label(row["properties"]),
+        )
+        for row in rows
+    )
+    return [
+        {
+            "hour": hour,
+            "site": site,
+            "event_type": event_type,
+            "label": label,
+            "events": count,
+        }
+        for (hour, site, event_type, label), count in sorted(events.items())
+    ]
+
+
+TOP_ITEM_DIMENSIONS = ("path", "referrer")
+
+
+def top_items_of(row: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """(dimension, item) pairs a page_views row counts towards"""
+    items = [("path", row.get("path") or "")]
+    referrer = row.get("referrer")
+    if referrer:
+        items.append(("referrer", (urlparse(referrer).netloc or referrer).lower()))
+    return items
+
+
+def _increment(model, counters: Tuple[str, ...]):
+    """Upsert adding the inserted counters to an existing rollup row
+
+    Rows are sorted by key before execution so concurrent writers lock
+    them in the same order.
+    """
+    stmt = insert(model)
+    return stmt.on_conflict_do_update(
+        index_elements=[column.name for column in model.__table__.primary_key],
+        set_={
+            counter: getattr(model, counter) + stmt.excluded[counter]
+            for counter in counters
+        },
+    )
+
+
+async def _merge_locked(
+    db: AsyncSession,
+    model,
+    column: str,
+    updates: Dict[Tuple[Any, ...], Any],
+    empty: Any,
+    merge: Callable[[Any, Any], Any],
+) -> None:
+    """Merge values into rollup rows that SQL cannot merge
+
+    Missing rows are created with ``empty`` first and all rows are then
+    locked in key order; concurrent writers wait for each other instead of
+    overwriting each other's values. ``merge(stored, update)`` returns the
+    value written back.
+    """
+    if not updates:
+        return
+
+    key_names = [column.name for column in model.__table__.primary_key]
+    key_columns = [getattr(model, name) for name in key_names]
+    keys = sorted(updates)
+
+    await db.execute(
+        insert(model).on_conflict_do_nothing(),
+        [{**dict(zip(key_names, key)), column: empty} for key in keys],
+    )
+    stored = await db.execute(
+        select(*key_columns, getattr(model, column))
+        .where(tuple_(*key_columns).in_(keys))
+        .order_by(*key_columns)
+        .with_for_update()
+    )
+
+    merged = [
+        {**dict(zip(key_names, key)), column: merge(value, updates[tuple(key)])}
+        for *key, value in stored
+    ]
+    if merged:
+        await db.execute(update(model), merged)
+
+
+async def _merge_sketches(
+    db: AsyncSession, model, sketches: Dict[Tuple[Any, ...], HyperLogLog]
+) -> None:
+    """Merge sketches into their rollup rows"""
+    await _merge_locked(
+        db,
+        model,
+        "sketch",
+        sketches,
+        HyperLogLog().to_bytes(),
+        lambda stored, sketch: HyperLogLog.union(
+            [stored, sketch.to_bytes()]
+        ).to_bytes(),
+    )
+
+
+class TopItemsTracker:
+    """Space-Saving summaries of top paths and referrers
+
+    Ingested page views are counted in memory per (hour, site, dimension);
+    ``flush`` merges the pending summaries into top_items_hourly and starts
+    new ones. Memory is bounded by ``capacity`` items per summary.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._pending: Dict[Tuple[datetime, str, str], SpaceSaving] = {}
+        self._lock = threading.Lock()
+
+    def add(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Count page_views rows"""
+        with self._lock:
+            for row in rows:
+                hour = hour_of(row["timestamp"])
+                for dimension, item in top_items_of(row):
+                    key = (hour, row["site"] or "", dimension)
+                    summary = self._pending.get(key)
+                    if summary is None:
+                        summary = self._pending[key] = SpaceSaving(self.capacity)
+                    summary.add(item, row.get("sample_weight", 1))
+
+    def pending(
+        self, since_hour: datetime, site: Optional[str] = None
+    ) -> List[Tuple[str, SpaceSaving]]:
+        """Unflushed (dimension, summary) pairs from since_hour on"""
+        with self._lock:
+            return [
+                (dimension, SpaceSaving.union([summary]))
+                for (hour, summary_site, dimension), summary in self._pending.items()
+                if hour >= since_hour and (not site or summary_site == site)
+            ]
+
+    async def flush(self) -> None:
+        """Merge pending summaries into top_items_hourly"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        def merge(stored: Dict[str, Any], summary: SpaceSaving) -> Dict[str, Any]:
+            return SpaceSaving.union([SpaceSaving.from_dict(stored), summary]).to_dict()
+
+        try:
+            async with AsyncSessionLocal() as db:
+                await _merge_locked(
+                    db,
+                    TopItemsHourly,
+                    "summary",
+                    pending,
+                    SpaceSaving(self.capacity).to_dict(),
+                    merge,
+                )
+                await db.commit()
+        except Exception:
+            # Keep the counts for the next flush
+            with self._lock:
+                for key, summary in pending.items():
+                    if key in self._pending:
+                        summary.merge(self._pending[key])
+                    self._pending[key] = summary
+            raise
+
+
+top_items_tracker = TopItemsTracker(settings.top_items_capacity)
+
+
+async def record_page_views(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """Add page_views rows to the rollups in the caller's transaction
+
+    Their top items are in memory, outside the transaction: the caller adds
+    the rows to ``top_items_tracker`` once it has committed, so a batch
+    that fails and is written again is not counted twice.
+    """
+    values = page_view_rollup_rows(rows)
+    if values:
+        await db.execute(_increment(PageViewHourly, ("views",)), values)
+    await _merge_sketches(db, PageViewVisitorsHourly, visitor_sketches(rows))
+
+
+async def record_events(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """Add events rows to the rollups in the caller's transaction"""
+    values = event_rollup_rows(rows)
+    if values:
+        await db.execute(_increment(EventHourly, ("events",)), values)
+
+
+async def record_cad_events(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """Add cad_events rows to the rollups in the caller's transaction"""
+    events, durations = cad_event_rollup_rows(rows)
+    if events:
+        await db.execute(
+            _increment(CADEventHourly, ("events", "duration_count", "duration_sum")),
+            events,
+        )
+    if durations:
+        await db.execute(_increment(CADDurationHourly, ("events",)), durations)
+    await _merge_sketches(db, CADUsersHourly, user_sketches(rows))
+
+
+def backfill(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Rebuild the rollups for [since, until) from the raw tables
+
+    Both bounds are rounded down to the hour. ``until`` defaults to the
+    start of the current hour, which ingestion may still be writing to.
+    Existing rollup rows in the range are replaced, so reruns are safe.
+    The rollups of each raw table are only rebuilt from where the table
+    has been compacted to (see compaction.py), so rollups of hours whose
+    raw rows are gone are kept.
+    """
+    until = hour_of(until or datetime.utcnow())
+    since = hour_of(since) if since else None
+
+    starts = {model: since for model in (PageView, Event, CADEvent)}
+    with SessionLocal() as db:
+        compacted = dict(
+            db.execute(
+                select(CompactionState.table_name, CompactionState.compacted_before)
+            ).all()
+        )
+    for model in starts:
+        compacted_before = compacted.get(model.__tablename__)
+        if compacted_before and (since is None or since < compacted_before):
+            starts[model] = compacted_before
+            print(
+                f"📊 {model.__tablename__} is compacted before {compacted_before}, "
+                "backfilling its rollups from there"
+            )
+
+    def in_range(column, raw_model):
+        """Conditions on column for the hours rebuilt from raw_model"""
+        conditions = [column < until]
+        if starts[raw_model]:
+            conditions.append(column >= starts[raw_model])
+        return conditions
+
+    page_view_hour = func.date_trunc("hour", PageView.timestamp)
+    page_view_site = func.coalesce(PageView.site, "")
+    event_hour = func.date_trunc("hour", Event.timestamp)
+    event_site = func.coalesce(Event.site, "")
+    event_label_value = event_label_column()
+    cad_hour = func.date_trunc("hour", CADEvent.timestamp)
+    cad_type = func.coalesce(CADEvent.event_type, "unknown")
+    cad_success = func.coalesce(CADEvent.success, false())
+    cad_bucket = func.width_bucket(CADEvent.duration_ms, array(DURATION_BUCKETS_MS))
+
+    # Page views are counted per path id; paths are joined to the counts
+    views_by_path = (
+        select(
+            page_view_hour.label("hour"),
+            page_view_site.label("site"),
+            PageView.path_id,
+            func.sum(PageView.sample_weight).label("views"),
+        )
+        .where(*in_range(PageView.timestamp, PageView))
+        .group_by(page_view_hour, page_view_site, PageView.path_id)
+        .subquery()
+    )
+
+    rebuilds = [
+        (
+            PageViewHourly,
+            PageView,
+            select(
+                views_by_path.c.hour,
+                views_by_path.c.site,
+                func.coalesce(PagePath.value, ""),
+                views_by_path.c.views,
+            ).select_from(
+                views_by_path.outerjoin(
+                    PagePath, PagePath.id == views_by_path.c.path_id
+                )
+            ),
+        ),
+        (
+            EventHourly,
+            Event,
+            select(
+                event_hour,
+                event_site,
+                Event.event_type,
+                event_label_value,
+                func.count(Event.id),
+            )
+            .where(*in_range(Event.timestamp, Event))
+            .group_by(event_hour, event_site, Event.event_type, event_label_value),
+        ),
+        (
+            CADEventHourly,
+            CADEvent,
+            select(
+                cad_hour,
+                cad_type,
+                cad_success,
+                func.count(CADEvent.id),
+                func.count(CADEvent.duration_ms),
+                func.coalesce(func.sum(CADEvent.duration_ms), 0),
+            )
+            .where(*in_range(CADEvent.timestamp, CADEvent))
+            .group_by(cad_hour, cad_type, cad_success),
+        ),
+        (
+            CADDurationHourly,
+            CADEvent,
+            select(cad_hour, cad_bucket, func.count(CADEvent.id))
+            .where(
+                *in_range(CADEvent.timestamp, CADEvent),
+                CADEvent.duration_ms.isnot(None),
+            )
+            .group_by(cad_hour, cad_bucket),
+        ),
+    ]
+
+    # Sketches are built in Python from the distinct values of each hour
+    sketch_rebuilds = [
+        (
+            PageViewVisitorsHourly,
+            PageView,
+            select(page_view_hour, page_view_site, PageView.ip_address).where(
+                *in_range(PageView.timestamp, PageView), PageView.ip_address.isnot(None)
+            ),
+        ),
+        (
+            CADUsersHourly,
+            CADEvent,
+            select(cad_hour, CADEvent.user_id).where(
+                *in_range(CADEvent.timestamp, CADEvent), CADEvent.user_id.isnot(None)
+            ),
+        ),
+    ]
+
+    db = SessionLocal()
+    try:
+        for model, raw_model, source in rebuilds:
+            db.execute(delete(model).where(*in_range(model.hour, raw_model)))
+            result = db.execute(
+                insert(model).from_select(
+                    [column.name for column in model.__table__.columns], source
+                )
+            )
+            print(f"📊 Rebuilt {result.rowcount} {model.__tablename__} rows")
+
+        for model, raw_model, source in sketch_rebuilds:
+            sketches: Dict[Tuple[Any, ...], HyperLogLog] = defaultdict(HyperLogLog)
+            values = db.execute(source.distinct().execution_options(yield_per=10000))
+            for *key, value in values:
+                sketches[tuple(key)].add(value)
+
+            key_names = [column.name for column in model.__table__.primary_key]
+            db.execute(delete(model).where(*in_range(model.hour, raw_model)))
+            if sketches:
+                db.execute(
+                    insert(model),
+                    [
+                        {**dict(zip(key_names, key)), "sketch": sketch.to_bytes()}
+                        for key, sketch in sketches.items()
+                    ],
+                )
+            print(f"📊 Rebuilt {len(sketches)} {model.__tablename__} rows")
+
+        # Top items are summarized in Python from per-hour counts
+        counts = (
+            select(
+                page_view_hour.label("hour"),
+                page_view_site.label("site"),
+                PageView.path_id,
+                PageView.referrer_id,
+                func.sum(PageView.sample_weight).label("views"),
+            )
+            .where(*in_range(PageView.timestamp, PageView))
+            .group_by(
+                page_view_hour,
+                page_view_site,
+                PageView.path_id,
+                PageView.referrer_id,
+            )
+            .subquery()
+        )
+        counts_with_values = (
+            select(
+                counts.c.hour,
+                counts.c.site,
+                PagePath.value,
+                Referrer.value,
+                counts.c.views,
+            )
+            .select_from(
+                counts.outerjoin(PagePath, PagePath.id == counts.c.path_id).outerjoin(
+                    Referrer, Referrer.id == counts.c.referrer_id
+                )
+            )
+            .execution_options(yield_per=10000)
+        )
+        summaries: Dict[Tuple[datetime, str, str], SpaceSaving] = {}
+        for hour, site, path, referrer, count in db.execute(counts_with_values):
+            for dimension, item in top_items_of({"path": path, "referrer": referrer}):
+                key = (hour, site, dimension)
+                if key not in summaries:
+                    summaries[key] = SpaceSaving(settings.top_items_capacity)
+                summaries[key].add(item, count)
+
+        db.execute(
+            delete(TopItemsHourly).where(*in_range(TopItemsHourly.hour, PageView))
+        )
+        if summaries:
+            db.execute(
+                insert(TopItemsHourly),
+                [
+                    {
+                        "hour": hour,
+                        "site": site,
+                        "dimension": dimension,
+                        "summary": summary.to_dict(),
+                    }
+                    for (hour, site, dimension), summary in summaries.items()
+                ],
+            )
+        print(f"📊 Rebuilt {len(summaries)} top_items_hourly rows")
+        db.commit()
+    except Exception as e:
+        print(f"❌ Rollup backfill error: {str(e)}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage hourly rollup tables")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser(
+        "backfill", help="Rebuild rollups from page_views, events and cad_events"
+    )
+    backfill_parser.add_argument("--since", type=datetime.fromisoformat)
+    backfill_parser.add_argument("--until", type=datetime.fromisoformat)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill(args.since, args.until)
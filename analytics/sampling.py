@@ -0,0 +1,89 @@
+"""
+Per-site sampling of ingested page views
+
+Under load a site's page views can be sampled instead of being turned away
+by the rate limiter: at a rate of 0.1 one view in ten is kept, stored with
+a ``sample_weight`` of 10. The rollups and stats add up weights instead of
+rows, so view counts and top pages stay unbiased estimates. Unique visitor
+estimates are not scaled: visitors none of whose views were kept are not
+counted.
+
+Rates are rounded to one view in a whole number so weights stay integers.
+Defaults come from INGEST_SAMPLE_RATES; rates set at runtime through
+``POST /admin/sampling`` are stored in site_sampling and picked up by every
+worker within SAMPLING_REFRESH_SECONDS.
+"""
+
+import random
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal, SiteSampling
+
+
+def sample_weight(rate: float) -> int:
+    """Views each kept view stands for at a sampling rate"""
+    if not 0 < rate <= 1:
+        raise ValueError(f"Sampling rate must be in (0, 1], got {rate}")
+    return max(1, round(1 / rate))
+
+
+class SamplingRates:
+    """Page view sampling rates per site, refreshed from site_sampling
+
+    Sites without a rate are not sampled.
+    """
+
+    def __init__(self, defaults: Dict[str, float]) -> None:
+        for rate in defaults.values():
+            sample_weight(rate)
+        self.defaults = dict(defaults)
+        self._rates = dict(defaults)
+
+    def rates(self) -> Dict[str, float]:
+        return dict(self._rates)
+
+    def weight(self, site: Optional[str]) -> int:
+        return sample_weight(self._rates.get(site or "", 1.0))
+
+    def sample(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Rows kept at their site's rate, with their ``sample_weight`` set"""
+        kept = []
+        for row in rows:
+            weight = self.weight(row["site"])
+            if weight == 1 or random.random() * weight < 1:
+                row["sample_weight"] = weight
+                kept.append(row)
+        return kept
+
+    async def set_rate(self, db: AsyncSession, site: str, rate: float) -> None:
+        """Store the rate of site for every worker"""
+        sample_weight(rate)
+        statement = insert(SiteSampling).values(
+            site=site, rate=rate, updated_at=datetime.utcnow()
+        )
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=["site"],
+                set_={
+                    "rate": statement.excluded.rate,
+                    "updated_at": statement.excluded.updated_at,
+                },
+            )
+        )
+        await db.commit()
+        self._rates = {**self._rates, site: rate}
+
+    async def refresh(self) -> None:
+        """Load the rates set at runtime"""
+        async with AsyncSessionLocal() as db:
+            stored = await db.execute(select(SiteSampling.site, SiteSampling.rate))
+            self._rates = {**self.defaults, **dict(stored.all())}
+
+
+sampling_rates = SamplingRates(settings.ingest_sample_rates)
@@ -0,0 +1,94 @@
+"""
+HyperLogLog sketches for distinct counts
+
+A sketch estimates how many distinct values were added to it using a fixed
+number of registers, and two sketches merge into the sketch of the union of
+their values. Unique visitors and active users are stored as one sketch per
+hour (see rollups.py), so any window is counted by merging its hours.
+
+With the default precision of 12 (4096 one-byte registers) the relative
+standard error is 1.04 / sqrt(4096) ~= 1.6%: about 95% of estimates are
+within 3.3% of the true count. Counts below ~10,000 use linear counting
+and are usually closer than that.
+"""
+
+import math
+from hashlib import blake2b
+from typing import Iterable, Optional
+
+DEFAULT_PRECISION = 12
+
+
+class HyperLogLog:
+    """Mergeable distinct count estimator"""
+
+    def __init__(
+        self, precision: int = DEFAULT_PRECISION, registers: Optional[bytes] = None
+    ) -> None:
+        if not 4 <= precision <= 16:
+            raise ValueError(f"Unsupported HyperLogLog precision: {precision}")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers or self.size)
+        if len(self.registers) != self.size:
+            raise ValueError("Register count does not match precision")
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        """Load a sketch serialized with ``to_bytes``"""
+        precision = len(data).bit_length() - 1
+        return cls(precision, data)
+
+    @classmethod
+    def union(cls, serialized: Iterable[bytes]) -> "HyperLogLog":
+        """Merge many serialized sketches at once
+
+        Taking the maximum of every register across all sketches in one
+        pass is much faster than merging them one at a time.
+        """
+        serialized = list(serialized)
+        if not serialized:
+            return cls()
+        if len(serialized) == 1:
+            return cls.from_bytes(serialized[0])
+        return cls.from_bytes(bytes(map(max, *serialized)))
+
+    def to_bytes(self) -> bytes:
+        """Registers as stored in the rollup tables"""
+        return bytes(self.registers)
+
+    @property
+    def relative_error(self) -> float:
+        """Relative standard error of ``count``"""
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value: str) -> None:
+        """Add a value; adding the same value again has no effect"""
+        hashed = int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]) -> None:
+        """Add several values"""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Fold another sketch into this one (the union of both)"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimated number of distinct values added"""
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size**2 / sum(2.0**-r for r in self.registers)
+
+        # Small range correction: linear counting while registers are empty
+        zeros = self.registers.count(0)
+        if zeros and estimate <= 2.5 * self.size:
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
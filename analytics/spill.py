@@ -0,0 +1,280 @@
+"""
+Durable local spill log for tracking rows the database cannot take
+
+When a write-behind buffer is full or a flush fails, its rows are appended
+to JSON lines segment files under SPILL_DIR instead of being rejected or
+dropped, so tracking requests return without waiting on the database.
+Appends reach the OS at once and are fsynced together every
+SPILL_FSYNC_INTERVAL_MS. Segments are closed once larger than
+SPILL_SEGMENT_MAX_BYTES; the replayer loads them back through the
+buffer's write path, oldest first, once the database takes writes again.
+
+Segment files are named ``<table>-<created ns>-<pid>`` with the suffix
+``.open`` while being appended to and ``.jsonl`` once closed. The writing
+process holds an exclusive lock on its open segment, so workers sharing
+SPILL_DIR never replay a segment still being written, and do replay the
+open segments of a process that died. Replay is at least once: a batch
+written just before a crash is loaded again from its segment.
+
+Rows the database will never accept, e.g. with a NUL character in a text
+column, are isolated by splitting failed batches (``write_isolating``) and
+set aside in ``rejected/<table>.jsonl`` so they do not hold up the rows
+behind them.
+"""
+
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import (
+    IO,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import DateTime
+from sqlalchemy.exc import DataError, IntegrityError
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def is_row_error(error: Exception) -> bool:
+    """Whether a write failed because of the rows written
+
+    Such rows fail however often they are retried: data exceptions such as
+    a NUL character in text (SQLSTATE class 22), constraint violations
+    (class 23), or rows that cannot be encoded at all.
+    """
+    if isinstance(error, (DataError, IntegrityError, TypeError, ValueError)):
+        return True
+    sqlstate = getattr(getattr(error, "orig", None), "sqlstate", None) or ""
+    return sqlstate[:2] in ("22", "23")
+
+
+async def write_isolating(
+    write: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+    rows: List[Dict[str, Any]],
+) -> List[Tuple[Dict[str, Any], Exception]]:
+    """Write rows with ``write``, isolating the rows it rejects
+
+    A batch failing because of its rows is split in half and each half
+    retried, down to single rows. Returns the rows rejected on their own,
+    with their errors. Other errors are raised; halves written before them
+    stay written.
+    """
+    try:
+        await write(rows)
+        return []
+    except Exception as e:
+        if not is_row_error(e):
+            raise
+        if len(rows) == 1:
+            return [(rows[0], e)]
+
+    middle = len(rows) // 2
+    return await write_isolating(write, rows[:middle]) + await write_isolating(
+        write, rows[middle:]
+    )
+
+
+class SpillLog:
+    """Append-only segment files of rows for one table"""
+
+    def __init__(self, directory: str, model, segment_max_bytes: int) -> None:
+        self.directory = directory
+        self.model = model
+        self.name = model.__tablename__
+        self.segment_max_bytes = segment_max_bytes
+        self._datetime_columns = [
+            column.name
+            for column in model.__table__.columns
+            if isinstance(column.type, DateTime)
+        ]
+        self._lock = threading.Lock()
+        self._file: Optional[IO[bytes]] = None
+        self._path: Optional[str] = None
+        self._unsynced = False
+
+    def append(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Append rows to the open segment, starting one if needed"""
+        data = "".join(json.dumps(row, default=_encode) + "\n" for row in rows)
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(data.encode())
+            self._file.flush()
+            self._unsynced = True
+            full = self._file.tell() >= self.segment_max_bytes
+        if full:
+            self.close_segment()
+
+    def sync(self) -> None:
+        """fsync rows appended since the last sync"""
+        with self._lock:
+            if not self._unsynced:
+                return
+            # fsync a duplicate so the segment can be closed meanwhile
+            fd = os.dup(self._file.fileno())
+            self._unsynced = False
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close_segment(self) -> None:
+        """Sync and close the open segment, making it ready for replay"""
+        with self._lock:
+            if self._file is None:
+                return
+            os.fsync(self._file.fileno())
+            closed_path = self._path[: -len(".open")] + ".jsonl"
+            os.rename(self._path, closed_path)
+            self._file.close()
+            self._file = None
+            self._path = None
+            self._unsynced = False
+
+    def reject(self, rejected: List[Tuple[Dict[str, Any], Exception]]) -> None:
+        """Set aside rows the database rejected, with their errors
+
+        They are appended to ``rejected/<table>.jsonl`` for inspection and
+        are never replayed.
+        """
+        directory = os.path.join(self.directory, "rejected")
+        os.makedirs(directory, exist_ok=True)
+        data = "".join(
+            json.dumps(
+                {"error": str(error).splitlines()[0], "row": row}, default=_encode
+            )
+            + "\n"
+            for row, error in rejected
+        )
+        with open(os.path.join(directory, f"{self.name}.jsonl"), "ab") as log:
+            log.write(data.encode())
+        print(f"🚫 Set aside {len(rejected)} {self.name} rows the database rejected")
+
+    async def replay(
+        self,
+        write: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        batch_size: int,
+    ) -> int:
+        """Write spilled rows back with ``write``, oldest segment first
+
+        The open segment is closed and replayed too once every older one
+        has been. Rows the database rejects are set aside (see ``reject``);
+        any other failed write stops the replay, and the rest of that
+        segment is retried on the next call. Returns the number of rows
+        written.
+        """
+        replayed = 0
+
+        async def counted_write(rows: List[Dict[str, Any]]) -> None:
+            nonlocal replayed
+            await write(rows)
+            replayed += len(rows)
+
+        try:
+            for path in self._segments():
+                await self._replay_segment(path, counted_write, batch_size)
+
+            if self._file is not None:
+                path = self._path[: -len(".open")] + ".jsonl"
+                self.close_segment()
+                await self._replay_segment(path, counted_write, batch_size)
+        except Exception as e:
+            print(f"⚠️ Spill replay of {self.name} paused: {e}")
+
+        if replayed:
+            print(f"📼 Replayed {replayed} spilled {self.name} rows")
+        return replayed
+
+    def _segments(self) -> List[str]:
+        """Segment paths, oldest first"""
+        paths = glob.glob(os.path.join(self.directory, f"{self.name}-*.jsonl"))
+        paths += glob.glob(os.path.join(self.directory, f"{self.name}-*.open"))
+        return sorted(paths, key=os.path.basename)
+
+    def _open_segment(self) -> None:
+        """Create and lock a new segment
+
+        It is created under a temporary name and renamed once locked, so a
+        replayer never locks it first.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(
+            self.directory, f"{self.name}-{time.time_ns():020d}-{os.getpid()}"
+        )
+        self._file = open(base + ".tmp", "ab")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        os.rename(base + ".tmp", base + ".open")
+        self._path = base + ".open"
+
+    def _decode(self, line: bytes) -> Optional[Dict[str, Any]]:
+        """Row of a segment line, or None for a line cut short by a crash"""
+        try:
+            row = json.loads(line)
+        except ValueError:
+            return None
+        for name in self._datetime_columns:
+            if row.get(name):
+                row[name] = datetime.fromisoformat(row[name])
+        return row
+
+    async def _replay_segment(
+        self,
+        path: str,
+        write: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        batch_size: int,
+    ) -> None:
+        """Write the rows of one segment back, then delete it
+
+        Progress is saved after every batch so a failed write resumes at
+        the batch it stopped on.
+        """
+        progress_path = path + ".replayed"
+        try:
+            segment = open(path, "rb")
+        except FileNotFoundError:
+            return  # replayed by another process meanwhile
+
+        with segment:
+            try:
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # being written or replayed by another process
+            if not os.path.exists(path):
+                return
+
+            done = 0
+            if os.path.exists(progress_path):
+                with open(progress_path) as progress:
+                    done = int(progress.read() or 0)
+
+            lines = segment.read().splitlines()
+            for start in range(done, len(lines), batch_size):
+                chunk = lines[start : start + batch_size]
+                rows = [row for row in map(self._decode, chunk) if row is not None]
+                if rows:
+                    rejected = await write_isolating(write, rows)
+                    if rejected:
+                        self.reject(rejected)
+                with open(progress_path + ".tmp", "w") as progress:
+                    progress.write(str(start + len(chunk)))
+                os.replace(progress_path + ".tmp", progress_path)
+
+            os.remove(path)
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
@@ -0,0 +1,72 @@
+"""
+Periodic background tasks
+"""
+
+import asyncio
+from typing import Callable, Optional
+
+
+class PeriodicTask:
+    """Run a function every ``interval_seconds`` until stopped
+
+    Coroutine functions are awaited on the event loop; plain functions run
+    in the default executor so blocking database work stays off the loop.
+    The function runs once more on stop so pending state is not lost,
+    unless ``run_on_stop`` is False, e.g. for long maintenance jobs that
+    would only hold up shutdown.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        interval_seconds: float,
+        run_on_stop: bool = True,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.interval = interval_seconds
+        self.run_on_stop = run_on_stop
+        self._stopped: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start running in the background"""
+        if self._task is not None:
+            return
+
+        self._stopped = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the loop, after one final run if ``run_on_stop``"""
+        if self._task is None:
+            return
+
+        self._stopped.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Background task {self.name} did not stop in time")
+        finally:
+            self._task = None
+
+    async def run_once(self) -> None:
+        """Run the function once, logging instead of raising"""
+        try:
+            if asyncio.iscoroutinefunction(self.func):
+                await self.func()
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, self.func)
+        except Exception as e:
+            print(f"❌ Background task {self.name} failed: {e}")
+
+    async def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopped.is_set() and not self.run_on_stop:
+                break
+            await self.run_once()
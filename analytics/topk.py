@@ -0,0 +1,128 @@
+"""
+Space-Saving summaries for approximate top-k counts
+
+A summary monitors at most ``capacity`` items. An unmonitored item replaces
+the item with the smallest count and inherits that count as its error, so
+every reported count overestimates the true count by at most its error,
+and any item that occurs more than total / capacity times is monitored.
+While fewer than ``capacity`` distinct items have been seen, counts are
+exact. Summaries merge, so per-hour summaries (see rollups.py) answer the
+top items of any window.
+
+The item to evict is found with a min-heap of counts that is only fixed up
+lazily: counting an item leaves its heap entry stale, and stale entries
+are refreshed as they reach the top. An update is amortized O(log
+capacity) instead of a scan of every monitored item.
+"""
+
+import heapq
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_CAPACITY = 1000
+
+
+class SpaceSaving:
+    """Bounded-memory heavy hitter counts"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        if capacity < 1:
+            raise ValueError("Space-Saving capacity must be positive")
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        # One (count, item) entry per monitored item, its count possibly
+        # stale (too low); built on the first eviction
+        self._heap: Optional[List[Tuple[int, str]]] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SpaceSaving":
+        """Load a summary serialized with ``to_dict``"""
+        summary = cls(data["capacity"])
+        for item, count, error in data["items"]:
+            summary.counts[item] = count
+            summary.errors[item] = error
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable form stored in the rollup table"""
+        return {
+            "capacity": self.capacity,
+            "items": [[item, count, self.errors[item]] for item, count in self.top()],
+        }
+
+    @classmethod
+    def union(cls, summaries: Iterable["SpaceSaving"]) -> "SpaceSaving":
+        """Merge several summaries into a new one
+
+        An item missing from a summary may still have occurred up to that
+        summary's floor times, which is added to both its count and error.
+        Done in one pass over all items rather than merging pairwise.
+        """
+        summaries = list(summaries)
+        if not summaries:
+            return cls()
+
+        total_floor = 0
+        counts: Dict[str, int] = defaultdict(int)
+        errors: Dict[str, int] = defaultdict(int)
+        for summary in summaries:
+            floor = summary.floor
+            total_floor += floor
+            for item, count in summary.counts.items():
+                counts[item] += count - floor
+                errors[item] += summary.errors[item] - floor
+
+        merged = cls(summaries[0].capacity)
+        ranked = sorted(counts, key=lambda item: (-counts[item], item))
+        for item in ranked[: merged.capacity]:
+            merged.counts[item] = counts[item] + total_floor
+            merged.errors[item] = errors[item] + total_floor
+        return merged
+
+    @property
+    def floor(self) -> int:
+        """Largest count an unmonitored item can have"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def add(self, item: str, count: int = 1) -> None:
+        """Count ``count`` occurrences of item"""
+        if item in self.counts:
+            self.counts[item] += count
+            return
+
+        error = 0
+        if len(self.counts) >= self.capacity:
+            evicted = self._pop_min()
+            error = self.counts.pop(evicted)
+            del self.errors[evicted]
+        self.counts[item] = error + count
+        self.errors[item] = error
+        if self._heap is not None:
+            heapq.heappush(self._heap, (error + count, item))
+
+    def _pop_min(self) -> str:
+        """Remove and return the monitored item with the smallest count"""
+        if self._heap is None:
+            self._heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts[item] == count:
+                return item
+            heapq.heappush(self._heap, (self.counts[item], item))
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """Fold another summary into this one"""
+        merged = SpaceSaving.union([self, other])
+        self.counts = merged.counts
+        self.errors = merged.errors
+        self._heap = None
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Items by estimated count, largest first"""
+        ranked = sorted(self.counts.items(), key=lambda entry: (-entry[1], entry[0]))
+        return ranked if n is None else ranked[:n]
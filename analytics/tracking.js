@@ -1,56 +1,125 @@
 /**
  * Analytics tracking script
  * Include this in all pages to track page views
+ *
+ * Events are queued in memory and sent in batches with navigator.sendBeacon
+ * when the queue fills up, after a short delay, and when the page is hidden.
  */
 (function() {
+    const BEACON_URL = '/analytics/track/beacon';
+    const MAX_BATCH_SIZE = 20;
+    const FLUSH_DELAY_MS = 5000;
+
     // Determine site based on URL
     const site = window.location.pathname.startsWith('/text-to-cad') ? 'text-to-cad' : 'portfolio';
-    
-    // Create session if needed
+
+    let queue = [];
+    let flushTimer = null;
+
+    // Create session once per tab; the cookie identifies it after that
     async function ensureSession() {
+        try {
+            if (sessionStorage.getItem('analytics_session')) {
+                return true;
+            }
+        } catch (err) {
+            // sessionStorage may be unavailable (e.g. privacy mode)
+        }
+
         try {
             const response = await fetch('/analytics/session', {
                 method: 'POST',
                 credentials: 'include'
             });
+            if (response.ok) {
+                try {
+                    sessionStorage.setItem('analytics_session', '1');
+                } catch (err) {
+                    // Ignore, the session is simply re-checked next load
+                }
+            }
             return response.ok;
         } catch (err) {
             console.error('Session creation error:', err);
             return false;
         }
     }
-    
-    // Track page view
-    async function trackPageView() {
-        // Ensure session exists first
-        await ensureSession();
-        
-        fetch('/analytics/track/pageview', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            credentials: 'include',
-            body: JSON.stringify({
-                site: site,
-                path: window.location.pathname
-            })
-        }).catch(err => console.error('Analytics error:', err));
+
+    // Send everything queued so far
+    function flush() {
+        if (flushTimer) {
+            clearTimeout(flushTimer);
+            flushTimer = null;
+        }
+
+        while (queue.length > 0) {
+            const payload = JSON.stringify({ events: queue.splice(0, MAX_BATCH_SIZE) });
+            const sent = navigator.sendBeacon && navigator.sendBeacon(BEACON_URL, payload);
+            if (!sent) {
+                fetch(BEACON_URL, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'text/plain',
+                    },
+                    credentials: 'include',
+                    keepalive: true,
+                    body: payload
+                }).catch(err => console.error('Analytics error:', err));
+            }
+        }
     }
-    
-    // Track on page load
-    if (document.readyState === 'loading') {
-        document.addEventListener('DOMContentLoaded', trackPageView);
-    } else {
-        trackPageView();
+
+    // Queue an event; only schedule a timer while something is pending
+    function track(type, data) {
+        queue.push(Object.assign({ type: type, site: site }, data));
+
+        if (queue.length >= MAX_BATCH_SIZE) {
+            flush();
+        } else if (!flushTimer) {
+            flushTimer = setTimeout(flush, FLUSH_DELAY_MS);
+        }
+    }
+
+    // Track page view
+    function trackPageView() {
+        track('pageview', { path: window.location.pathname });
     }
-    
+
     // Track on route change (for SPAs)
     let lastPath = window.location.pathname;
-    setInterval(() => {
+    function onRouteChange() {
         if (window.location.pathname !== lastPath) {
             lastPath = window.location.pathname;
             trackPageView();
         }
-    }, 1000);
-})();
\ No newline at end of file
+    }
+
+    ['pushState', 'replaceState'].forEach(method => {
+        const original = history[method];
+        history[method] = function() {
+            const result = original.apply(this, arguments);
+            onRouteChange();
+            return result;
+        };
+    });
+    window.addEventListener('popstate', onRouteChange);
+
+    // Flush before the page goes away
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') {
+            flush();
+        }
+    });
+    window.addEventListener('pagehide', flush);
+
+    // Expose for link click and scroll tracking from the page
+    window.analyticsTracker = { track: track, flush: flush };
+
+    // Track on page load
+    ensureSession();
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', trackPageView);
+    } else {
+        trackPageView();
+    }
+})();
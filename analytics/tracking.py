@@ -2,48 +2,166 @@
 Analytics tracking functions
 """
 
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
-from sqlalchemy.orm import Session as DBSession
-from sqlalchemy import func, and_
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import (
+    Numeric,
+    and_,
+    cast,
+    func,
+    insert,
+    select,
+    tuple_,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.postgresql import array
 from fastapi import Request
 
-from database import PageView, CADEvent, User, Session, GeneratedModel
+from config import settings
+from database import (
+    PageView,
+    Event,
+    CADEvent,
+    User,
+    GeneratedModel,
+    PageViewHourly,
+    EventHourly,
+    CADEventHourly,
+    CADDurationHourly,
+    PageViewVisitorsHourly,
+    CADUsersHourly,
+    TopItemsHourly,
+)
+from dimensions import encode_page_views
+from ingest import event_buffer, page_view_buffer
+from rollups import (
+    BUCKET_WIDTHS,
+    DURATION_BUCKETS_MS,
+    TOP_ITEM_DIMENSIONS,
+    bucket_of,
+    event_label_column,
+    hour_of,
+    percentile_from_histogram,
+    record_cad_events,
+    record_events,
+    record_page_views,
+    rollup_boundary,
+    top_items_tracker,
+)
+from sampling import sampling_rates
+from sketches import HyperLogLog
+from topk import SpaceSaving
 
 
 class AnalyticsTracker:
     """Track analytics events"""
 
     @staticmethod
-    def track_page_view(
-        db: DBSession,
+    def page_view_row(
         request: Request,
         site: str,
         path: str,
         session_id: Optional[str] = None,
         user_id: Optional[str] = None,
-        additional_data: Optional[Dict[str, Any]] = None,
-    ) -> None:
-        """Track a page view"""
+    ) -> Dict[str, Any]:
+        """Build a page_views row from the request"""
         ip_address = request.client.host if request.client else "unknown"
         user_agent = request.headers.get("user-agent", "")
         referrer = request.headers.get("referer", "")
 
-        page_view = PageView(
-            site=site,
-            path=path,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            referrer=referrer,
-            session_id=session_id,
-            user_id=user_id,
-        )
-        db.add(page_view)
-        db.commit()
+        # Truncate to column sizes so one bad value can't fail a whole batch
+        return {
+            "timestamp": datetime.utcnow(),
+            "site": site[:50],
+            "path": path[:500],
+            "ip_address": ip_address[:45],
+            "user_agent": user_agent,
+            "referrer": referrer,
+            "session_id": session_id,
+            "user_id": user_id,
+            "sample_weight": 1,
+        }
+
+    @staticmethod
+    async def track_page_view(
+        db: AsyncSession,
+        request: Request,
+        site: str,
+        path: str,
+        session_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> None:
+        """Track a page view
+
+        The row is handed to the write-behind buffer; it is only written
+        directly when the buffer is stopped, or full without a spill log.
+        Rows of sampled sites may be left out (see sampling.py).
+        """
+        row = AnalyticsTracker.page_view_row(request, site, path, session_id, user_id)
+        await AnalyticsTracker.track_page_views(db, [row])
+
+    @staticmethod
+    async def track_page_views(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+        """Track several page view rows in one transaction"""
+        rows = sampling_rates.sample(rows)
+        if not rows or page_view_buffer.enqueue_many(rows):
+            return
+
+        await db.execute(insert(PageView), await encode_page_views(rows, db.bind))
+        await record_page_views(db, rows)
+        await db.commit()
+        top_items_tracker.add(rows)
+
+    @staticmethod
+    def event_row(
+        request: Request,
+        site: str,
+        event_type: str,
+        properties: Dict[str, Any],
+        path: Optional[str] = None,
+        session_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Build an events row from the request
+
+        Empty properties are left out to keep the stored JSON small. site
+        and path come from untyped JSON bodies and are coerced to strings.
+        """
+        ip_address = request.client.host if request.client else "unknown"
+        return {
+            "timestamp": datetime.utcnow(),
+            "site": str(site or "portfolio")[:50],
+            "event_type": event_type[:30],
+            "path": str(path)[:500] if path else None,
+            "ip_address": ip_address[:45],
+            "session_id": session_id,
+            "user_id": user_id,
+            "properties": {
+                name: value
+                for name, value in properties.items()
+                if value is not None and value != {}
+            },
+        }
+
+    @staticmethod
+    async def track_events(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+        """Track several events rows in one transaction
+
+        Buffered like page views (see ``track_page_view``).
+        """
+        if not rows or event_buffer.enqueue_many(rows):
+            return
+
+        await db.execute(insert(Event), rows)
+        await record_events(db, rows)
+        await db.commit()
 
     @staticmethod
-    def track_cad_event(
-        db: DBSession,
+    async def track_cad_event(
+        db: AsyncSession,
         user_id: str,
         session_id: str,
         event_type: str,
@@ -59,6 +177,7 @@ class AnalyticsTracker:
     ) -> None:
         """Track CAD generation event"""
         event = CADEvent(
+            timestamp=datetime.utcnow(),
             user_id=user_id,
             session_id=session_id,
             event_type=event_type,
@@ -73,11 +192,23 @@ class AnalyticsTracker:
             stl_file_path=stl_file_path,
         )
         db.add(event)
-        db.commit()
+        await record_cad_events(
+            db,
+            [
+                {
+                    "timestamp": event.timestamp,
+                    "user_id": user_id,
+                    "event_type": event_type,
+                    "success": success,
+                    "duration_ms": duration_ms,
+                }
+            ],
+        )
+        await db.commit()
 
     @staticmethod
-    def store_generated_model(
-        db: DBSession,
+    async def store_generated_model(
+        db: AsyncSession,
         model_id: str,
         user_id: str,
         session_id: str,
@@ -107,131 +238,444 @@ class AnalyticsTracker:
             error_message=error_message,
         )
         db.add(model)
-        db.commit()
+        await db.commit()
 
     @staticmethod
-    def track_model_download(db: DBSession, model_id: str) -> None:
+    async def track_model_download(db: AsyncSession, model_id: str) -> None:
         """Track when a model is downloaded"""
-        model = db.query(GeneratedModel).filter(GeneratedModel.id == model_id).first()
-        if model:
-            model.download_count += 1
-            db.commit()
+        # Increment in SQL so concurrent downloads are not lost
+        await db.execute(
+            update(GeneratedModel)
+            .where(GeneratedModel.id == model_id)
+            .values(download_count=GeneratedModel.download_count + 1)
+        )
+        await db.commit()
 
     @staticmethod
-    def get_page_view_stats(
-        db: DBSession, hours: int = 24, site: Optional[str] = None
-    ) -> Dict[str, Any]:
-        """Get page view statistics"""
-        since = datetime.utcnow() - timedelta(hours=hours)
+    def page_view_stats_query(since: datetime, site: Optional[str] = None):
+        """Views per site since ``since``
 
-        query = db.query(PageView).filter(PageView.timestamp >= since)
+        Whole hours come from page_views_hourly and only the partial hour
+        before the first hour boundary is aggregated from page_views.
+        """
+        boundary = rollup_boundary(since, settings.page_views_retention_days)
+        hourly = select(PageViewHourly.site, PageViewHourly.views).where(
+            PageViewHourly.hour >= boundary
+        )
+        recent = (
+            select(PageView.site, func.sum(PageView.sample_weight))
+            .where(PageView.timestamp >= since, PageView.timestamp < boundary)
+            .group_by(PageView.site)
+        )
         if site:
-            query = query.filter(PageView.site == site)
+            hourly = hourly.where(PageViewHourly.site == site)
+            recent = recent.where(PageView.site == site)
+        counts = union_all(hourly, recent).subquery()
+
+        return select(counts.c.site, func.sum(counts.c.views)).group_by(counts.c.site)
+
+    @staticmethod
+    async def get_top_items(
+        db: AsyncSession, since: datetime, site: Optional[str] = None, limit: int = 10
+    ) -> Dict[str, List[Tuple[str, int]]]:
+        """Top paths and referrers since ``since``
 
-        total_views = query.count()
-        unique_visitors = (
-            db.query(func.count(func.distinct(PageView.ip_address)))
-            .filter(PageView.timestamp >= since)
-            .scalar()
+        Merges the hourly Space-Saving summaries with the ones this process
+        has not flushed yet. Summaries cover whole hours, so the hour that
+        contains ``since`` is included in full; counts are upper bounds
+        (see topk.py).
+        """
+        start = hour_of(since)
+        query = select(TopItemsHourly.dimension, TopItemsHourly.summary).where(
+            TopItemsHourly.hour >= start
         )
+        if site:
+            query = query.where(TopItemsHourly.site == site)
 
-        # Views by site
-        views_by_site = (
-            db.query(PageView.site, func.count(PageView.id).label("count"))
-            .filter(PageView.timestamp >= since)
-            .group_by(PageView.site)
-            .all()
+        summaries = defaultdict(list)
+        for dimension, summary in await db.execute(query):
+            summaries[dimension].append(SpaceSaving.from_dict(summary))
+        for dimension, summary in top_items_tracker.pending(start, site):
+            summaries[dimension].append(summary)
+
+        return {
+            dimension: SpaceSaving.union(summaries[dimension]).top(limit)
+            for dimension in TOP_ITEM_DIMENSIONS
+        }
+
+    @staticmethod
+    async def get_page_view_stats(
+        db: AsyncSession, hours: int = 24, site: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Get page view statistics, optionally for one site"""
+        since = datetime.utcnow() - timedelta(hours=hours)
+        views_by_site = {
+            row_site: int(views)
+            for row_site, views in await db.execute(
+                AnalyticsTracker.page_view_stats_query(since, site)
+            )
+        }
+        top_items = await AnalyticsTracker.get_top_items(db, since, site)
+
+        return {
+            "total_views": sum(views_by_site.values()),
+            "unique_visitors": await AnalyticsTracker.count_unique_visitors(
+                db, since, site
+            ),
+            "views_by_site": views_by_site,
+            "top_pages": [
+                {"path": path, "views": views} for path, views in top_items["path"]
+            ],
+            "top_referrers": [
+                {"referrer": referrer, "views": views}
+                for referrer, views in top_items["referrer"]
+            ],
+        }
+
+    @staticmethod
+    def event_stats_query(since: datetime, site: Optional[str] = None):
+        """Event counts per type and label since ``since``
+
+        Whole hours come from events_hourly and the partial leading hour
+        from events.
+        """
+        boundary = rollup_boundary(since, settings.events_retention_days)
+        label = event_label_column()
+        hourly = select(
+            EventHourly.event_type, EventHourly.label, EventHourly.events
+        ).where(EventHourly.hour >= boundary)
+        recent = (
+            select(Event.event_type, label, func.count(Event.id))
+            .where(Event.timestamp >= since, Event.timestamp < boundary)
+            .group_by(Event.event_type, label)
         )
+        if site:
+            hourly = hourly.where(EventHourly.site == site)
+            recent = recent.where(Event.site == site)
+        counts = union_all(hourly, recent).subquery()
 
-        # Top pages
-        top_pages = (
-            db.query(PageView.path, func.count(PageView.id).label("count"))
-            .filter(PageView.timestamp >= since)
-            .group_by(PageView.path)
-            .order_by(func.count(PageView.id).desc())
-            .limit(10)
-            .all()
+        return select(
+            counts.c.event_type, counts.c.label, func.sum(counts.c.events)
+        ).group_by(counts.c.event_type, counts.c.label)
+
+    @staticmethod
+    async def get_event_stats(
+        db: AsyncSession, hours: int = 24, site: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Get link click and scroll depth statistics, optionally for one site"""
+        since = datetime.utcnow() - timedelta(hours=hours)
+        counts: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for event_type, label, events in await db.execute(
+            AnalyticsTracker.event_stats_query(since, site)
+        ):
+            counts[event_type][label] = int(events)
+
+        link_types = sorted(
+            counts["link_click"].items(), key=lambda entry: (-entry[1], entry[0])
         )
+        scroll_depth = []
+        for label, events in counts["scroll"].items():
+            try:
+                percentage = float(label)
+            except ValueError:
+                continue
+            if percentage.is_integer():
+                percentage = int(percentage)
+            scroll_depth.append({"percentage": percentage, "events": events})
 
         return {
-            "total_views": total_views,
-            "unique_visitors": unique_visitors,
-            "views_by_site": {site: count for site, count in views_by_site},
-            "top_pages": [{"path": path, "views": count} for path, count in top_pages],
+            "link_clicks": sum(counts["link_click"].values()),
+            "top_link_types": [
+                {"link_type": link_type, "clicks": clicks}
+                for link_type, clicks in link_types[:10]
+            ],
+            "scroll_milestones": sum(counts["scroll"].values()),
+            "scroll_depth": sorted(scroll_depth, key=lambda row: row["percentage"]),
         }
 
     @staticmethod
-    def get_cad_stats(db: DBSession, hours: int = 24) -> Dict[str, Any]:
-        """Get CAD generation statistics"""
-        since = datetime.utcnow() - timedelta(hours=hours)
+    async def count_unique_visitors(
+        db: AsyncSession, since: datetime, site: Optional[str] = None
+    ) -> int:
+        """Estimated distinct visitor IPs since ``since``
 
-        # Total events
-        total_events = db.query(CADEvent).filter(CADEvent.timestamp >= since).count()
+        Merges the hourly HyperLogLog sketches and adds the distinct IPs of
+        the partial hour before the first hour boundary (see sketches.py
+        for the error bound).
+        """
+        boundary = rollup_boundary(since, settings.page_views_retention_days)
+        sketches = select(PageViewVisitorsHourly.sketch).where(
+            PageViewVisitorsHourly.hour >= boundary
+        )
+        recent = (
+            select(PageView.ip_address)
+            .distinct()
+            .where(
+                PageView.timestamp >= since,
+                PageView.timestamp < boundary,
+                PageView.ip_address.isnot(None),
+            )
+        )
+        if site:
+            sketches = sketches.where(PageViewVisitorsHourly.site == site)
+            recent = recent.where(PageView.site == site)
 
-        # Events by type
-        events_by_type = (
-            db.query(CADEvent.event_type, func.count(CADEvent.id).label("count"))
-            .filter(CADEvent.timestamp >= since)
-            .group_by(CADEvent.event_type)
-            .all()
+        visitors = HyperLogLog.union(await db.scalars(sketches))
+        visitors.update(await db.scalars(recent))
+        return visitors.count()
+
+    @staticmethod
+    async def count_active_users(db: AsyncSession, since: datetime) -> int:
+        """Estimated distinct CAD users since ``since``"""
+        boundary = rollup_boundary(since, settings.cad_events_retention_days)
+        users = HyperLogLog.union(
+            await db.scalars(
+                select(CADUsersHourly.sketch).where(CADUsersHourly.hour >= boundary)
+            )
         )
+        users.update(
+            await db.scalars(
+                select(CADEvent.user_id)
+                .distinct()
+                .where(
+                    CADEvent.timestamp >= since,
+                    CADEvent.timestamp < boundary,
+                    CADEvent.user_id.isnot(None),
+                )
+            )
+        )
+        return users.count()
+
+    @staticmethod
+    def cad_stats_query(since: datetime):
+        """CAD event totals and per-type counts since ``since``
 
-        # Success rate
-        success_count = (
-            db.query(CADEvent)
-            .filter(and_(CADEvent.timestamp >= since, CADEvent.success == True))
-            .count()
+        Whole hours come from cad_events_hourly and the partial leading
+        hour from cad_events. GROUPING SETS over the combined counts give
+        a row for the whole window (grouping = 1) and one per event type
+        (grouping = 0); FILTER sums the successful events.
+        """
+        boundary = rollup_boundary(since, settings.cad_events_retention_days)
+        hourly = select(
+            CADEventHourly.event_type,
+            CADEventHourly.success,
+            CADEventHourly.events,
+            CADEventHourly.duration_count,
+            CADEventHourly.duration_sum,
+        ).where(CADEventHourly.hour >= boundary)
+        recent = (
+            select(
+                CADEvent.event_type,
+                CADEvent.success,
+                func.count(CADEvent.id),
+                func.count(CADEvent.duration_ms),
+                func.coalesce(func.sum(CADEvent.duration_ms), 0),
+            )
+            .where(CADEvent.timestamp >= since, CADEvent.timestamp < boundary)
+            .group_by(CADEvent.event_type, CADEvent.success)
         )
+        counts = union_all(hourly, recent).subquery()
 
-        success_rate = (success_count / total_events * 100) if total_events > 0 else 0
+        events = func.sum(counts.c.events)
+        return select(
+            func.grouping(counts.c.event_type).label("grouping"),
+            counts.c.event_type,
+            events.label("events"),
+            func.round(
+                cast(events.filter(counts.c.success == True), Numeric)
+                * 100
+                / func.nullif(events, 0),
+                2,
+            ).label("success_rate"),
+            func.sum(counts.c.duration_count).label("duration_count"),
+            func.sum(counts.c.duration_sum).label("duration_sum"),
+        ).group_by(func.grouping_sets(tuple_(), counts.c.event_type))
 
-        # Active users
-        active_users = (
-            db.query(func.count(func.distinct(CADEvent.user_id)))
-            .filter(CADEvent.timestamp >= since)
-            .scalar()
+    @staticmethod
+    def cad_duration_histogram_query(since: datetime):
+        """Duration histogram bucket counts since ``since``"""
+        boundary = rollup_boundary(since, settings.cad_events_retention_days)
+        bucket = func.width_bucket(CADEvent.duration_ms, array(DURATION_BUCKETS_MS))
+        hourly = select(CADDurationHourly.bucket, CADDurationHourly.events).where(
+            CADDurationHourly.hour >= boundary
+        )
+        recent = (
+            select(bucket, func.count(CADEvent.id))
+            .where(
+                CADEvent.timestamp >= since,
+                CADEvent.timestamp < boundary,
+                CADEvent.duration_ms.isnot(None),
+            )
+            .group_by(bucket)
         )
+        counts = union_all(hourly, recent).subquery()
 
-        # Average generation time
-        avg_duration = (
-            db.query(func.avg(CADEvent.duration_ms))
-            .filter(and_(CADEvent.timestamp >= since, CADEvent.duration_ms.isnot(None)))
-            .scalar()
+        return select(counts.c.bucket, func.sum(counts.c.events)).group_by(
+            counts.c.bucket
         )
 
+    @staticmethod
+    async def get_cad_stats(db: AsyncSession, hours: int = 24) -> Dict[str, Any]:
+        """Get CAD generation statistics"""
+        since = datetime.utcnow() - timedelta(hours=hours)
+        rows = await db.execute(AnalyticsTracker.cad_stats_query(since))
+
+        # The () grouping set yields a totals row even for an empty window
+        events_by_type = {}
+        for row in rows:
+            if row.grouping:
+                totals = row
+            else:
+                events_by_type[row.event_type] = int(row.events)
+
+        histogram = {
+            bucket: int(count)
+            for bucket, count in await db.execute(
+                AnalyticsTracker.cad_duration_histogram_query(since)
+            )
+        }
+
+        active_users = await AnalyticsTracker.count_active_users(db, since)
+
         return {
-            "total_events": total_events,
-            "events_by_type": {
-                event_type: count for event_type, count in events_by_type
-            },
-            "success_rate": round(success_rate, 2),
+            "total_events": int(totals.events or 0),
+            "events_by_type": events_by_type,
+            "success_rate": float(totals.success_rate or 0),
             "active_users": active_users,
-            "avg_duration_ms": int(avg_duration) if avg_duration else 0,
+            "avg_duration_ms": (
+                int(totals.duration_sum / totals.duration_count)
+                if totals.duration_count
+                else 0
+            ),
+            "p50_duration_ms": percentile_from_histogram(histogram, 0.5),
+            "p95_duration_ms": percentile_from_histogram(histogram, 0.95),
+        }
+
+    @staticmethod
+    def timeseries_query(
+        metric: str, bucket: str, start: datetime, site: Optional[str] = None
+    ):
+        """(bucket, value) rows of a metric from ``start`` on
+
+        Minute buckets are aggregated from the raw tables, so they only
+        reach back as far as the raw rows are kept; hour and day buckets
+        come from the hourly rollups. For unique visitors by hour or day
+        the value is an hourly sketch, merged per bucket by the caller.
+        Buckets without rows are left out. ``site`` only applies to page
+        view metrics.
+        """
+        if bucket == "minute":
+            if metric in ("page_views", "unique_visitors"):
+                time, model = PageView.timestamp, PageView
+            else:
+                time, model = CADEvent.timestamp, CADEvent
+        elif metric == "page_views":
+            time, model = PageViewHourly.hour, PageViewHourly
+        elif metric == "unique_visitors":
+            time, model = PageViewVisitorsHourly.hour, PageViewVisitorsHourly
+        else:
+            time, model = CADEventHourly.hour, CADEventHourly
+        bucket_start = func.date_trunc(bucket, time).label("bucket")
+
+        if metric == "unique_visitors" and bucket != "minute":
+            query = select(bucket_start, PageViewVisitorsHourly.sketch)
+        else:
+            if metric == "page_views":
+                value = func.sum(
+                    PageView.sample_weight
+                    if bucket == "minute"
+                    else PageViewHourly.views
+                )
+            elif metric == "unique_visitors":
+                value = func.count(PageView.ip_address.distinct())
+            elif bucket == "minute":
+                value = func.count(CADEvent.id)
+            else:
+                value = func.sum(CADEventHourly.events)
+
+            if metric == "error_rate":
+                successes = value.filter(model.success == True)
+                value = func.round(
+                    cast(value - func.coalesce(successes, 0), Numeric)
+                    * 100
+                    / func.nullif(value, 0),
+                    2,
+                )
+            query = select(bucket_start, value).group_by(bucket_start)
+
+        query = query.where(time >= start)
+        if site and model in (PageView, PageViewHourly, PageViewVisitorsHourly):
+            query = query.where(model.site == site)
+        return query
+
+    @staticmethod
+    async def get_timeseries(
+        db: AsyncSession,
+        metric: str,
+        bucket: str,
+        hours: int = 24,
+        site: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """A metric per bucket over the last ``hours``, gaps filled
+
+        The series starts at the bucket containing the window start and
+        ends with the current, partial bucket. Empty buckets count 0, or
+        None for the error rate.
+        """
+        step = BUCKET_WIDTHS[bucket]
+        now = datetime.utcnow()
+        start = bucket_of(now - timedelta(hours=hours), bucket)
+        rows = await db.execute(
+            AnalyticsTracker.timeseries_query(metric, bucket, start, site)
+        )
+
+        if metric == "unique_visitors" and bucket != "minute":
+            sketches = defaultdict(list)
+            for bucket_start, sketch in rows:
+                sketches[bucket_start].append(sketch)
+            values = {
+                bucket_start: HyperLogLog.union(bucket_sketches).count()
+                for bucket_start, bucket_sketches in sketches.items()
+            }
+        elif metric == "error_rate":
+            values = {
+                bucket_start: float(value)
+                for bucket_start, value in rows
+                if value is not None
+            }
+        else:
+            values = {bucket_start: int(value) for bucket_start, value in rows}
+
+        empty = None if metric == "error_rate" else 0
+        buckets = int((now - start) / step) + 1
+        return {
+            "metric": metric,
+            "bucket": bucket,
+            "start": start.isoformat(),
+            "step_seconds": int(step.total_seconds()),
+            "values": [values.get(start + step * i, empty) for i in range(buckets)],
         }
 
     @staticmethod
-    def get_user_activity(db: DBSession, user_id: str) -> Dict[str, Any]:
+    async def get_user_activity(db: AsyncSession, user_id: str) -> Dict[str, Any]:
         """Get activity for specific user"""
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             return {}
 
         # Recent events
-        recent_events = (
-            db.query(CADEvent)
-            .filter(CADEvent.user_id == user_id)
+        recent_events = await db.scalars(
+            select(CADEvent)
+            .where(CADEvent.user_id == user_id)
             .order_by(CADEvent.timestamp.desc())
             .limit(10)
-            .all()
         )
 
         # Total generations
-        total_generations = (
-            db.query(CADEvent)
-            .filter(
+        total_generations = await db.scalar(
+            select(func.count(CADEvent.id)).where(
                 and_(CADEvent.user_id == user_id, CADEvent.event_type == "generate")
             )
-            .count()
         )
 
         return {
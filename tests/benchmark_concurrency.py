@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Concurrency load test for the analytics service
+
+Fires a fixed number of requests at one endpoint at increasing concurrency
+and reports throughput and latency percentiles. With a blocking database
+layer throughput stays flat as concurrency grows; with the async layer it
+should scale until the connection pool or Postgres saturates.
+
+Usage:
+    python tests/benchmark_concurrency.py
+    python tests/benchmark_concurrency.py --path "/admin/stats?hours=720&password=..." \\
+        --requests 400 --concurrency 1 4 16 32
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+ANALYTICS_BASE_URL = "http://localhost:8001"
+
+
+async def run_level(client, path, total, concurrency):
+    """Send ``total`` GET requests with at most ``concurrency`` in flight"""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default=ANALYTICS_BASE_URL)
+    parser.add_argument(
+        "--path", default="/admin/stats?hours=1&password=change_me_in_production"
+    )
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    args = parser.parse_args()
+
+    print(f"🔥 Load testing {args.base_url}{args.path}")
+    print(
+        f"{'concurrency':>12} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'errors':>8}"
+    )
+
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=60
+    ) as client:
+        # Warm up connections and caches
+        await run_level(client, args.path, min(args.requests, 20), 4)
+
+        for concurrency in args.concurrency:
+            result = await run_level(client, args.path, args.requests, concurrency)
+            print(
+                f"{result['concurrency']:>12} {result['rps']:>10.1f} "
+                f"{result['p50_ms']:>10.1f} {result['p95_ms']:>10.1f} "
+                f"{result['errors']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
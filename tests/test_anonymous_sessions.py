@@ -0,0 +1,119 @@
+"""
+Unit tests for signed anonymous session tokens
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from auth import AnonymousSessionToken, SessionManager
+
+
+def issue(expires_in_hours=1):
+    return AnonymousSessionToken.issue(
+        session_id="0b7d3a52-5a0c-4a8e-9d52-3f0f6c1b8f11",
+        user_id="anonymous",
+        expires_at=datetime.utcnow() + timedelta(hours=expires_in_hours),
+    )
+
+
+def test_token_round_trip():
+    """A freshly issued token verifies to the same session"""
+    token = issue()
+    session = AnonymousSessionToken.verify(token)
+
+    assert AnonymousSessionToken.is_token(token)
+    assert session.id == "0b7d3a52-5a0c-4a8e-9d52-3f0f6c1b8f11"
+    assert session.user_id == "anonymous"
+    assert session.expires_at > datetime.utcnow()
+    print("✅ Anonymous token round trip works")
+
+
+def test_tampered_token_rejected():
+    """Changing the payload invalidates the signature"""
+    token = issue()
+    body, _, signature = token.rpartition(".")
+    forged = AnonymousSessionToken.issue(
+        session_id="someone-else",
+        user_id="admin",
+        expires_at=datetime.utcnow() + timedelta(hours=1),
+    ).rpartition(".")[0]
+
+    assert AnonymousSessionToken.verify(f"{forged}.{signature}") is None
+    assert AnonymousSessionToken.verify(f"{body}.{signature[:-2]}xx") is None
+    assert AnonymousSessionToken.verify("anon.garbage") is None
+    print("✅ Tampered tokens are rejected")
+
+
+def test_expired_token_rejected():
+    """Tokens past their expiry are rejected"""
+    assert AnonymousSessionToken.verify(issue(expires_in_hours=-1)) is None
+    print("✅ Expired tokens are rejected")
+
+
+def test_get_session_verifies_token_without_db():
+    """SessionManager.get_session never queries for signed tokens"""
+    db = AsyncMock()
+
+    with patch("auth.settings.anonymous_session_tokens", True):
+        session = asyncio.run(SessionManager.get_session(db, issue()))
+
+    assert session is not None
+    db.execute.assert_not_called()
+    db.scalar.assert_not_called()
+    print("✅ Anonymous tokens are verified without the database")
+
+
+def test_tokens_revoked_when_disabled():
+    """Turning anonymous tokens off rejects the ones already issued"""
+    db = AsyncMock()
+
+    with patch("auth.settings.anonymous_session_tokens", False):
+        session = asyncio.run(SessionManager.get_session(db, issue()))
+
+    assert session is None
+    db.scalar.assert_not_called()
+    print("✅ Disabled anonymous tokens are rejected")
+
+
+def test_non_ascii_token_rejected():
+    """Cookies with non-ASCII characters are not a session, not an error"""
+    token = issue()
+    body, _, _ = token.rpartition(".")
+
+    assert AnonymousSessionToken.verify("anon.a.é") is None
+    assert AnonymousSessionToken.verify(f"{body}.é") is None
+    print("✅ Non-ASCII tokens are rejected")
+
+
+def test_create_anonymous_session_without_row():
+    """With tokens enabled no sessions row is written"""
+    db = AsyncMock()
+    request = MagicMock()
+
+    with patch("auth.settings.anonymous_session_tokens", True):
+        cookie = asyncio.run(SessionManager.create_anonymous_session(db, request))
+
+    assert AnonymousSessionToken.is_token(cookie)
+    db.add.assert_not_called()
+    db.commit.assert_not_called()
+    print("✅ Anonymous sessions skip the sessions table")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Anonymous Session Tests...\n")
+
+    test_token_round_trip()
+    test_tampered_token_rejected()
+    test_expired_token_rejected()
+    test_get_session_verifies_token_without_db()
+    test_tokens_revoked_when_disabled()
+    test_non_ascii_token_rejected()
+    test_create_anonymous_session_without_row()
+
+    print("\n✅ All anonymous session tests passed!")
@@ -0,0 +1,127 @@
+"""
+Unit tests for the CAD statistics queries
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from sqlalchemy.dialects import postgresql
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from sketches import HyperLogLog
+from tracking import AnalyticsTracker
+
+
+def compile_query(query):
+    return str(
+        query.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def sketch(*values):
+    hll = HyperLogLog()
+    hll.update(values)
+    return hll.to_bytes()
+
+
+def row(grouping, event_type=None, events=0, **totals):
+    values = {"success_rate": None, "duration_count": None, "duration_sum": None}
+    values.update(totals)
+    return SimpleNamespace(
+        grouping=grouping, event_type=event_type, events=events, **values
+    )
+
+
+def test_query_is_one_aggregate_statement():
+    """Totals and per-type counts come from one statement over the rollup"""
+    sql = compile_query(AnalyticsTracker.cad_stats_query(datetime(2024, 1, 1, 9, 30)))
+
+    assert "FROM cad_events_hourly" in sql
+    assert "cad_events_hourly.hour >= '2024-01-01 10:00:00'" in sql
+    assert "cad_events.timestamp < '2024-01-01 10:00:00'" in sql
+    assert "GROUPING SETS((), anon_1.event_type)" in sql
+    assert "FILTER (WHERE anon_1.success = true)" in sql
+    print("✅ CAD stats use one aggregate statement")
+
+
+def test_histogram_query_reads_rollup():
+    """Duration percentiles come from the hourly histogram"""
+    sql = compile_query(
+        AnalyticsTracker.cad_duration_histogram_query(datetime(2024, 1, 1, 9, 30))
+    )
+
+    assert "FROM cad_durations_hourly" in sql
+    assert "width_bucket(cad_events.duration_ms" in sql
+    print("✅ CAD durations read the hourly histogram")
+
+
+def test_rows_are_assembled_into_stats():
+    """The response keeps the dashboard's shape and adds percentiles"""
+    db = AsyncMock()
+    db.execute.side_effect = [
+        [
+            row(0, "generate", Decimal(3)),
+            row(0, "download", Decimal(1)),
+            row(
+                1,
+                events=Decimal(4),
+                success_rate=Decimal("75.00"),
+                duration_count=Decimal(4),
+                duration_sum=Decimal(5002),
+            ),
+        ],
+        # Bucket 6 is [750, 1000), bucket 8 is [1500, 2000)
+        [(6, Decimal(2)), (8, Decimal(2))],
+    ]
+    # Hourly user sketches, then the users of the partial hour
+    db.scalars.side_effect = [[sketch("u1", "u2"), sketch("u2")], ["u1", "u3"]]
+
+    stats = asyncio.run(AnalyticsTracker.get_cad_stats(db, hours=24))
+
+    assert stats == {
+        "total_events": 4,
+        "events_by_type": {"generate": 3, "download": 1},
+        "success_rate": 75.0,
+        "active_users": 3,
+        "avg_duration_ms": 1250,
+        "p50_duration_ms": 1000,
+        "p95_duration_ms": 1950,
+    }
+    print("✅ CAD stats assembled from the rollups")
+
+
+def test_empty_window():
+    """An empty window only has the totals row"""
+    db = AsyncMock()
+    db.execute.side_effect = [[row(1)], []]
+    db.scalars.return_value = []
+
+    stats = asyncio.run(AnalyticsTracker.get_cad_stats(db, hours=1))
+
+    assert stats["total_events"] == 0
+    assert stats["events_by_type"] == {}
+    assert stats["success_rate"] == 0
+    assert stats["active_users"] == 0
+    assert stats["avg_duration_ms"] == 0
+    assert stats["p95_duration_ms"] == 0
+    print("✅ Empty window handled")
+
+
+if __name__ == "__main__":
+    print("🧪 Running CAD Stats Tests...\n")
+
+    test_query_is_one_aggregate_statement()
+    test_histogram_query_reads_rollup()
+    test_rows_are_assembled_into_stats()
+    test_empty_window()
+
+    print("\n✅ All CAD stats tests passed!")
@@ -0,0 +1,190 @@
+"""
+Unit tests for compaction of raw rows past their retention
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import StaticPool
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from compaction import (
+    compacted_before,
+    compaction_cutoff,
+    delete_expired_rows,
+    stale_rollup_hours_query,
+)
+from config import settings
+from database import CADEvent, CompactionState
+from rollups import first_full_hour, hour_of, rollup_boundary
+from tasks import PeriodicTask
+from tracking import AnalyticsTracker
+
+cad_events = CADEvent.__table__
+
+
+def compile_sql(query):
+    return str(
+        query.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def cad_events_db(timestamps):
+    """In-memory database with a cad_events row per timestamp"""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    cad_events.create(engine)
+    CompactionState.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            cad_events.insert(),
+            [
+                {"timestamp": timestamp, "event_type": "generate", "user_id": "u1"}
+                for timestamp in timestamps
+            ],
+        )
+    return engine
+
+
+def remaining_timestamps(engine):
+    with engine.connect() as conn:
+        return conn.scalars(
+            select(cad_events.c.timestamp).order_by(cad_events.c.timestamp)
+        ).all()
+
+
+def test_cutoff_is_a_whole_hour():
+    now = datetime(2024, 6, 1, 9, 45)
+
+    assert compaction_cutoff(30, now) == datetime(2024, 5, 2, 9)
+    assert compaction_cutoff(0, now) is None
+    print("✅ Compaction cutoff rounded to the hour")
+
+
+def test_expired_rows_are_deleted_in_batches():
+    """Rows before the cutoff go, max_batches batches at a time"""
+    start = datetime(2024, 1, 1)
+    engine = cad_events_db([start + timedelta(minutes=10 * i) for i in range(10)])
+    cutoff = start + timedelta(minutes=75)
+
+    first = delete_expired_rows(engine, cad_events, cutoff, 3, max_batches=1)
+    with engine.connect() as conn:
+        partly_compacted = compacted_before(conn, "cad_events")
+    rest = delete_expired_rows(engine, cad_events, cutoff, 3, max_batches=5)
+    with engine.connect() as conn:
+        compacted = compacted_before(conn, "cad_events")
+
+    assert (first, rest) == (3, 5)
+    assert remaining_timestamps(engine)[0] == start + timedelta(minutes=80)
+    assert len(remaining_timestamps(engine)) == 2
+    # The partly deleted hour counts as compacted, but not past the cutoff
+    assert partly_compacted == start + timedelta(hours=1)
+    assert compacted == cutoff
+    print("✅ Expired rows deleted in batches")
+
+
+def test_rows_are_archived_before_deletion():
+    """Archived rows land in one gzipped JSON lines file per day"""
+    timestamps = [datetime(2024, 1, 1, 23), datetime(2024, 1, 2, 1)]
+    engine = cad_events_db(timestamps + [datetime(2024, 1, 3)])
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        deleted = delete_expired_rows(
+            engine, cad_events, datetime(2024, 1, 3), 10, 10, archive_dir
+        )
+        files = sorted(os.listdir(archive_dir))
+        with gzip.open(os.path.join(archive_dir, files[0]), "rt") as archive:
+            archived = [json.loads(line) for line in archive]
+
+    assert deleted == 2
+    assert files == ["cad_events-20240101.jsonl.gz", "cad_events-20240102.jsonl.gz"]
+    assert archived[0]["timestamp"] == "2024-01-01 23:00:00"
+    assert archived[0]["event_type"] == "generate"
+    assert remaining_timestamps(engine) == [datetime(2024, 1, 3)]
+    print("✅ Rows archived before deletion")
+
+
+def test_stale_rollups_are_found_per_hour():
+    """Raw hour counts are compared with the rollup totals"""
+    sql = compile_sql(
+        stale_rollup_hours_query(
+            cad_events, datetime(2023, 12, 1), datetime(2024, 1, 1)
+        )
+    )
+
+    assert "date_trunc('hour', cad_events.timestamp)" in sql
+    assert "cad_events.timestamp < '2024-01-01 00:00:00'" in sql
+    # Compacted hours are left alone
+    assert "cad_events.timestamp >= '2023-12-01 00:00:00'" in sql
+    assert "cad_events_hourly.hour >= '2023-12-01 00:00:00'" in sql
+    assert "sum(cad_events_hourly.events)" in sql
+    assert "LEFT OUTER JOIN" in sql
+    print("✅ Stale rollup hours query built")
+
+
+def test_windows_past_retention_read_whole_hours():
+    """Past the retention the leading partial hour comes from the rollups"""
+    recent = datetime.utcnow() - timedelta(days=1, minutes=30)
+    old = datetime.utcnow() - timedelta(days=40, minutes=30)
+
+    assert rollup_boundary(recent, 30) == first_full_hour(recent)
+    assert rollup_boundary(old, 30) == hour_of(old)
+    assert rollup_boundary(old, 0) == first_full_hour(old)
+
+    with patch.object(settings, "page_views_retention_days", 30):
+        sql = compile_sql(AnalyticsTracker.page_view_stats_query(old))
+    assert f"page_views_hourly.hour >= '{hour_of(old)}'" in sql
+    print("✅ Windows past retention read whole hours")
+
+
+def test_compaction_does_not_run_on_shutdown():
+    """Maintenance tasks skip the final run flush tasks get on stop"""
+    runs = {"flush": 0, "compaction": 0}
+
+    def counter(name):
+        async def run():
+            runs[name] += 1
+
+        return run
+
+    async def main():
+        tasks = [
+            PeriodicTask("flush", counter("flush"), 3600),
+            PeriodicTask("compaction", counter("compaction"), 3600, run_on_stop=False),
+        ]
+        for task in tasks:
+            await task.start()
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            await task.stop()
+
+    asyncio.run(main())
+
+    assert runs == {"flush": 1, "compaction": 0}
+    print("✅ Compaction does not run on shutdown")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Compaction Tests...\n")
+
+    test_cutoff_is_a_whole_hour()
+    test_expired_rows_are_deleted_in_batches()
+    test_rows_are_archived_before_deletion()
+    test_stale_rollups_are_found_per_hour()
+    test_windows_past_retention_read_whole_hours()
+    test_compaction_does_not_run_on_shutdown()
+
+    print("\n✅ All compaction tests passed!")
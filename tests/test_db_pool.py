@@ -0,0 +1,123 @@
+"""
+Unit tests for the database connection pool metrics
+"""
+
+import asyncio
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from app import app
+from config import settings
+from database import InstrumentedAsyncQueuePool, PoolStats, get_pool_status
+
+
+def pooled_engine():
+    return create_async_engine(
+        "sqlite+aiosqlite://",
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+
+
+def test_stats_average_checkout_waits():
+    stats = PoolStats()
+
+    stats.record(0.002)
+    stats.record(0.004)
+    stats.record(0.009, timed_out=True)
+
+    assert stats.as_dict() == {
+        "checkouts": 3,
+        "timeouts": 1,
+        "avg_wait_ms": 5.0,
+        "max_wait_ms": 9.0,
+    }
+    assert PoolStats().as_dict()["avg_wait_ms"] == 0
+    print("✅ Pool stats average checkout waits")
+
+
+def test_pool_status_reports_checkouts_and_timeouts():
+    """A checkout past pool_size + max_overflow times out and is counted"""
+    engine = pooled_engine()
+    stats = PoolStats()
+
+    async def main():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            busy = get_pool_status()
+            with pytest.raises(PoolTimeoutError):
+                async with engine.connect():
+                    pass
+        idle = get_pool_status()
+        await engine.dispose()
+        return busy, idle
+
+    with patch("database.async_engine", engine), patch("database.pool_stats", stats):
+        busy, idle = asyncio.run(main())
+
+    assert set(busy) == {
+        "pooled",
+        "size",
+        "checked_out",
+        "checked_in",
+        "overflow",
+        "max_overflow",
+        "checkouts",
+        "timeouts",
+        "avg_wait_ms",
+        "max_wait_ms",
+    }
+    assert busy["pooled"] is True
+    assert (busy["size"], busy["checked_out"], busy["overflow"]) == (1, 1, 0)
+    assert (idle["checked_out"], idle["checked_in"]) == (0, 1)
+    assert (idle["checkouts"], idle["timeouts"]) == (2, 1)
+    assert idle["max_wait_ms"] >= 50
+    print("✅ Pool status reports checkouts and timeouts")
+
+
+def test_unpooled_engine_reports_no_pool():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=NullPool)
+
+    with patch("database.async_engine", engine):
+        assert get_pool_status() == {"pooled": False}
+    print("✅ Unpooled engine reported")
+
+
+def test_pool_endpoint_requires_admin_password():
+    client = TestClient(app)
+
+    with patch("database.async_engine", pooled_engine()):
+        unauthorized = client.get("/admin/db-pool")
+        wrong = client.get("/admin/db-pool", params={"password": "wrong"})
+        with patch.object(settings, "admin_password", "pw"):
+            authorized = client.get("/admin/db-pool", params={"password": "pw"})
+
+    assert unauthorized.status_code == 401
+    assert wrong.status_code == 401
+    assert authorized.status_code == 200
+    assert authorized.json()["pooled"] is True
+    print("✅ /admin/db-pool requires the admin password")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Database Pool Tests...\n")
+
+    test_stats_average_checkout_waits()
+    test_pool_status_reports_checkouts_and_timeouts()
+    test_unpooled_engine_reports_no_pool()
+    test_pool_endpoint_requires_admin_password()
+
+    print("\n✅ All database pool tests passed!")
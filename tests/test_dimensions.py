@@ -0,0 +1,156 @@
+"""
+Unit tests for interned page view dimensions
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from database import Base, PagePath, PageView, Referrer, UserAgent
+from dimensions import (
+    PAGE_VIEW_DIMENSIONS,
+    DimensionCache,
+    encode_page_views,
+    value_digest,
+)
+
+
+@pytest.fixture
+def test_db():
+    """In-memory database, empty caches and a log of dimension queries"""
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    queries = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def log_dimension_queries(conn, cursor, statement, parameters, context, many):
+        if any(table in statement for table in ("page_paths", "user_agents")):
+            queries.append(statement)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(setup())
+    caches = {
+        key: DimensionCache(model, max_entries=100)
+        for key, (_, model) in PAGE_VIEW_DIMENSIONS.items()
+    }
+    with patch.dict("dimensions.dimension_caches", caches):
+        yield engine, queries
+
+    asyncio.run(engine.dispose())
+
+
+def page_view(path, user_agent="Mozilla/5.0", referrer=""):
+    return {
+        "timestamp": datetime(2024, 1, 1, 9),
+        "site": "portfolio",
+        "path": path,
+        "ip_address": "1.1.1.1",
+        "user_agent": user_agent,
+        "referrer": referrer,
+        "session_id": None,
+        "user_id": None,
+    }
+
+
+def test_strings_are_replaced_by_ids(test_db):
+    """Rows are inserted with ids; each distinct string is stored once"""
+    engine, _ = test_db
+    rows = [page_view("/a"), page_view("/b"), page_view("/a", referrer="https://x")]
+
+    async def scenario():
+        encoded = await encode_page_views(rows, engine)
+        async with AsyncSession(engine) as db:
+            await db.execute(insert(PageView), encoded)
+            await db.commit()
+            paths = dict((await db.execute(select(PagePath.id, PagePath.value))).all())
+            user_agents = (await db.scalars(select(UserAgent.value))).all()
+            referrers = (await db.scalars(select(Referrer.value))).all()
+        return encoded, paths, user_agents, referrers
+
+    encoded, paths, user_agents, referrers = asyncio.run(scenario())
+
+    assert [paths[row["path_id"]] for row in encoded] == ["/a", "/b", "/a"]
+    assert user_agents == ["Mozilla/5.0"]
+    assert referrers == ["https://x"]
+    assert [row["referrer_id"] for row in encoded][:2] == [None, None]
+    assert "path" not in encoded[0] and "user_agent" not in encoded[0]
+    assert encoded[0]["ip_address"] == "1.1.1.1"
+    print("✅ Page view strings interned")
+
+
+def test_cached_strings_need_no_queries(test_db):
+    """Only strings missing from the cache are looked up"""
+    engine, queries = test_db
+
+    async def scenario():
+        first = await encode_page_views([page_view("/a")], engine)
+        lookups = len(queries)
+        second = await encode_page_views([page_view("/a")], engine)
+        return first, second, lookups
+
+    first, second, lookups = asyncio.run(scenario())
+
+    assert lookups > 0
+    assert len(queries) == lookups
+    assert first == second
+    print("✅ Cache hits skip the database")
+
+
+def test_existing_values_are_reused(test_db):
+    """A value interned by another process is read back, not duplicated"""
+    engine, _ = test_db
+
+    async def scenario():
+        async with AsyncSession(engine) as db:
+            await db.execute(
+                insert(PagePath), [{"digest": value_digest("/a"), "value": "/a"}]
+            )
+            await db.commit()
+        encoded = await encode_page_views([page_view("/a")], engine)
+        async with AsyncSession(engine) as db:
+            count = len((await db.scalars(select(PagePath.id))).all())
+        return encoded, count
+
+    encoded, count = asyncio.run(scenario())
+
+    assert encoded[0]["path_id"] == 1
+    assert count == 1
+    print("✅ Existing values reused")
+
+
+def test_cache_evicts_least_recently_used():
+    cache = DimensionCache(PagePath, max_entries=2)
+    cache.put({"/a": 1, "/b": 2})
+    cache.get("/a")
+    cache.put({"/c": 3})
+
+    assert cache.get("/b") is None
+    assert (cache.get("/a"), cache.get("/c")) == (1, 3)
+    print("✅ Least recently used values evicted")
+
+
+def test_digests_are_signed_64_bit():
+    """Digests fit a BIGINT column and are stable across processes"""
+    digests = [value_digest(f"/page/{i}") for i in range(1000)]
+
+    assert all(-(2**63) <= digest < 2**63 for digest in digests)
+    assert len(set(digests)) == 1000
+    assert value_digest("/") == value_digest("/")
+    print("✅ Digests are signed 64-bit integers")
+
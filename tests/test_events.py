@@ -0,0 +1,209 @@
+"""
+Unit tests for link click and scroll milestone events
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sqlalchemy.dialects import postgresql
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from database import Event
+from migration import migrate_pseudo_path_events, pseudo_path_event
+from tracking import AnalyticsTracker
+
+
+def compile_sql(query):
+    return str(
+        query.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def fake_request(host="1.2.3.4"):
+    request = MagicMock()
+    request.client.host = host
+    return request
+
+
+def test_event_rows_keep_properties_compact():
+    """Missing and empty properties are not stored"""
+    row = AnalyticsTracker.event_row(
+        fake_request(),
+        "portfolio",
+        "link_click",
+        {"link_type": "github", "metadata": {}, "label": None},
+        path="/projects",
+        session_id="s1",
+    )
+
+    assert row["event_type"] == "link_click"
+    assert row["path"] == "/projects"
+    assert row["ip_address"] == "1.2.3.4"
+    assert row["properties"] == {"link_type": "github"}
+    assert AnalyticsTracker.event_row(fake_request(), "x", "scroll", {})["path"] is None
+    print("✅ Event properties kept compact")
+
+
+def test_event_stats_query_reads_rollups_and_partial_hour():
+    """Whole hours come from events_hourly, the partial hour from events"""
+    sql = compile_sql(
+        AnalyticsTracker.event_stats_query(datetime(2024, 1, 1, 9, 30), "portfolio")
+    )
+
+    assert "events_hourly.hour >= '2024-01-01 10:00:00'" in sql
+    assert "events_hourly.site = 'portfolio'" in sql
+    assert "events.timestamp >= '2024-01-01 09:30:00'" in sql
+    assert "events.timestamp < '2024-01-01 10:00:00'" in sql
+    assert "events.site = 'portfolio'" in sql
+    assert "events.properties ->> 'link_type'" in sql
+    assert "page_views" not in sql
+    print("✅ Event stats read the hourly rollup")
+
+
+def test_event_stats_are_assembled():
+    """Link types are ranked by clicks and scroll depth by percentage"""
+    db = AsyncMock()
+    db.execute.return_value = [
+        ("link_click", "github", 5),
+        ("link_click", "email", 2),
+        ("link_click", "linkedin", 5),
+        ("scroll", "75", 3),
+        ("scroll", "25", 9),
+        ("scroll", "50.5", 4),
+        ("scroll", "bottom", 1),
+    ]
+
+    stats = asyncio.run(AnalyticsTracker.get_event_stats(db, hours=24))
+
+    assert stats == {
+        "link_clicks": 12,
+        "top_link_types": [
+            {"link_type": "github", "clicks": 5},
+            {"link_type": "linkedin", "clicks": 5},
+            {"link_type": "email", "clicks": 2},
+        ],
+        "scroll_milestones": 17,
+        "scroll_depth": [
+            {"percentage": 25, "events": 9},
+            {"percentage": 50.5, "events": 4},
+            {"percentage": 75, "events": 3},
+        ],
+    }
+    print("✅ Event stats assembled")
+
+
+def test_empty_event_window():
+    db = AsyncMock()
+    db.execute.return_value = []
+
+    stats = asyncio.run(AnalyticsTracker.get_event_stats(db, hours=1))
+
+    assert stats == {
+        "link_clicks": 0,
+        "top_link_types": [],
+        "scroll_milestones": 0,
+        "scroll_depth": [],
+    }
+    print("✅ Empty event window handled")
+
+
+def test_pseudo_paths_are_parsed_into_events():
+    """Legacy page view paths map to event types and properties"""
+    assert pseudo_path_event("/link-click/github") == (
+        "link_click",
+        {"link_type": "github"},
+    )
+    assert pseudo_path_event("/scroll/75%") == ("scroll", {"scroll_percentage": 75})
+    assert pseudo_path_event("/scroll/50.5%") == (
+        "scroll",
+        {"scroll_percentage": 50.5},
+    )
+    assert pseudo_path_event("/about") is None
+    print("✅ Pseudo-paths parsed")
+
+
+def run_migration(paths, views, migrated_before=None, db=None):
+    """migrate_pseudo_path_events on a mock session
+
+    paths are the pseudo-path page_paths rows, views the page views found.
+    """
+    db = db or MagicMock()
+    db.execute.return_value.all.return_value = list(paths.items())
+    db.scalars.return_value.all.side_effect = [views, []]
+
+    with patch("migration.SessionLocal", return_value=db), patch(
+        "migration.compacted_before", return_value=migrated_before
+    ), patch("migration.record_compaction") as record, patch(
+        "migration.create_partitions"
+    ) as create, patch(
+        "migration.print", create=True
+    ):
+        earliest = migrate_pseudo_path_events()
+    return db, earliest, create, record
+
+
+def test_moved_events_get_partitions_first():
+    """Pseudo-path rows older than any partition get one before the insert"""
+    views = [
+        MagicMock(id=1, path_id=7, timestamp=datetime(2020, 3, 5)),
+        MagicMock(id=2, path_id=8, timestamp=datetime(2019, 12, 31)),
+    ]
+    paths = {7: "/link-click/github", 8: "/scroll/50%"}
+    db = MagicMock()
+    # Only the page_paths select has run when the partitions are created
+    db.connection.side_effect = lambda: db.execute.call_count
+
+    _, earliest, create, _ = run_migration(paths, views, db=db)
+
+    create.assert_called_once_with(
+        1, Event.__table__, datetime(2019, 12, 31), datetime(2020, 3, 5)
+    )
+    assert earliest == datetime(2019, 12, 31)
+    print("✅ Partitions created before moving events")
+
+
+def test_no_pseudo_paths_skips_page_views():
+    """Without any pseudo path interned, page_views is not scanned"""
+    db, earliest, _, record = run_migration({}, [])
+
+    assert earliest is None
+    db.scalars.assert_not_called()
+    record.assert_not_called()
+    print("✅ page_views not scanned without pseudo paths")
+
+
+def test_finished_migration_reads_recent_page_views():
+    """A finished run is recorded, and later runs only read newer rows"""
+    paths = {7: "/link-click/github"}
+
+    _, _, _, record = run_migration(paths, [])
+    db, earliest, _, _ = run_migration(paths, [], datetime(2024, 1, 1))
+    query = compile_sql(db.scalars.call_args.args[0])
+
+    assert record.call_args.args[1] == "page_views_pseudo_paths"
+    assert earliest is None
+    assert "page_views.path_id IN (7)" in query
+    assert "page_views.timestamp >= '2024-01-01 00:00:00'" in query
+    print("✅ Finished migration only reads recent page views")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Event Tests...\n")
+
+    test_event_rows_keep_properties_compact()
+    test_event_stats_query_reads_rollups_and_partial_hour()
+    test_event_stats_are_assembled()
+    test_empty_event_window()
+    test_pseudo_paths_are_parsed_into_events()
+    test_moved_events_get_partitions_first()
+    test_no_pseudo_paths_skips_page_views()
+    test_finished_migration_reads_recent_page_views()
+
+    print("\n✅ All event tests passed!")
@@ -0,0 +1,228 @@
+"""
+Unit tests for the write-behind ingestion buffer
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from database import PageView
+from ingest import WriteBehindBuffer
+from spill import SpillLog
+
+
+def rows(count):
+    return [
+        {"timestamp": datetime(2024, 1, 1), "site": "portfolio", "path": f"/{i}"}
+        for i in range(count)
+    ]
+
+
+def make_buffer(max_size=100, batch_size=100, flush_interval_ms=60000, fail_on=()):
+    """Buffer recording its batches instead of writing them
+
+    Write calls numbered in fail_on raise, and so do batches holding a path
+    with a NUL character.
+    """
+    buffer = WriteBehindBuffer(PageView, max_size, batch_size, flush_interval_ms)
+    buffer.batches = []
+
+    async def write(batch):
+        if len(buffer.batches) + 1 in fail_on:
+            buffer.batches.append(None)
+            raise ConnectionError("database unavailable")
+        if any("\x00" in row["path"] for row in batch):
+            raise ValueError("NUL character in path")
+        buffer.batches.append(batch)
+
+    buffer._write = write
+    return buffer
+
+
+def test_full_batch_is_flushed_at_once():
+    """Reaching batch_size wakes the flush task before the interval"""
+    buffer = make_buffer(batch_size=3)
+
+    async def main():
+        await buffer.start()
+        buffer.enqueue_many(rows(2))
+        await asyncio.sleep(0.05)
+        before_full = len(buffer.batches)
+        buffer.enqueue(rows(1)[0])
+        await asyncio.sleep(0.05)
+        await buffer.stop()
+        return before_full
+
+    before_full = asyncio.run(main())
+
+    assert before_full == 0
+    assert [len(batch) for batch in buffer.batches] == [3]
+    print("✅ Full batches flushed at once")
+
+
+def test_partial_batch_is_flushed_on_interval():
+    """Rows short of a batch are written after flush_interval_ms"""
+    buffer = make_buffer(flush_interval_ms=20)
+
+    async def main():
+        await buffer.start()
+        buffer.enqueue_many(rows(2))
+        await asyncio.sleep(0.2)
+        written = list(buffer.batches)
+        await buffer.stop()
+        return written
+
+    written = asyncio.run(main())
+
+    assert [len(batch) for batch in written] == [2]
+    print("✅ Partial batches flushed on the interval")
+
+
+def test_stop_drains_queued_rows():
+    """stop() writes what is still queued and stops accepting rows"""
+    buffer = make_buffer(batch_size=2)
+
+    async def main():
+        await buffer.start()
+        # Below the batch size, so only stop() flushes
+        buffer.enqueue_many(rows(1))
+        await buffer.stop()
+        return buffer.enqueue_many(rows(1))
+
+    accepted_after_stop = asyncio.run(main())
+
+    assert buffer.batches == [rows(1)]
+    assert len(buffer) == 0
+    assert accepted_after_stop is False
+    print("✅ stop() drains queued rows")
+
+
+def test_full_buffer_rejects_rows():
+    """Without a spill log, rows that do not fit are left to the caller"""
+    buffer = make_buffer(max_size=3)
+
+    async def main():
+        stopped = buffer.enqueue_many(rows(1))
+        await buffer.start()
+        results = [buffer.enqueue_many(rows(2)), buffer.enqueue_many(rows(2))]
+        queued = len(buffer)
+        await buffer.stop()
+        return stopped, results, queued
+
+    stopped, results, queued = asyncio.run(main())
+
+    assert stopped is False
+    assert results == [True, False]
+    assert queued == 2
+    print("✅ Full buffer rejects rows")
+
+
+def test_failed_write_is_logged_and_dropped():
+    """A failed batch is logged, not retried, and later batches still go"""
+    buffer = make_buffer(batch_size=2, fail_on={1})
+
+    async def main():
+        await buffer.start()
+        buffer.enqueue_many(rows(4))
+        await buffer.stop()
+
+    with patch("ingest.print", create=True) as log:
+        asyncio.run(main())
+
+    assert buffer.batches == [None, rows(4)[2:]]
+    assert "❌ Failed to flush 2 page_views" in log.call_args.args[0]
+    print("✅ Failed writes logged")
+
+
+def test_rejected_rows_are_dropped_alone():
+    """Only the rows the database rejects are lost from a failed batch"""
+    buffer = make_buffer(batch_size=4)
+    batch = rows(4)
+    batch[1]["path"] = "/\x00"
+
+    async def main():
+        await buffer.start()
+        buffer.enqueue_many(batch)
+        await buffer.stop()
+
+    with patch("ingest.print", create=True) as log:
+        asyncio.run(main())
+
+    assert [row for written in buffer.batches for row in written] == [
+        batch[0],
+        batch[2],
+        batch[3],
+    ]
+    assert "❌ Dropped 1 page_views rows" in log.call_args.args[0]
+    print("✅ Rejected rows dropped alone")
+
+
+def test_stop_timeout_spills_in_flight_batch():
+    """A batch cut short by the drain timeout is spilled with the queue"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = SpillLog(spill_dir, PageView, 1024 * 1024)
+        buffer = WriteBehindBuffer(
+            PageView, max_size=10, batch_size=2, flush_interval_ms=60000, spill=spill
+        )
+        replayed = []
+
+        async def hang(batch):
+            await asyncio.sleep(10)
+
+        async def record(batch):
+            replayed.extend(batch)
+
+        async def main():
+            buffer._write = hang
+            await buffer.start()
+            buffer.enqueue_many(rows(3))
+            await asyncio.sleep(0.05)
+            await buffer.stop(timeout=0.05)
+            await spill.replay(record, batch_size=10)
+
+        with patch("ingest.print", create=True), patch("spill.print", create=True):
+            asyncio.run(main())
+
+    assert sorted(row["path"] for row in replayed) == ["/0", "/1", "/2"]
+    print("✅ In-flight batch spilled on drain timeout")
+
+
+def test_on_commit_waits_for_the_commit():
+    """Batches whose commit fails are not passed to on_commit"""
+    committed = []
+    buffer = WriteBehindBuffer(PageView, 10, 10, 60000, on_commit=committed.extend)
+    db = AsyncMock()
+    db.commit.side_effect = [ConnectionError("connection lost"), None]
+    session = MagicMock()
+    session.return_value.__aenter__.return_value = db
+
+    with patch("ingest.AsyncSessionLocal", session):
+        try:
+            asyncio.run(buffer._write(rows(1)))
+        except ConnectionError:
+            pass
+        asyncio.run(buffer._write(rows(2)))
+
+    assert committed == rows(2)
+    print("✅ on_commit waits for the commit")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Ingest Buffer Tests...\n")
+
+    test_full_batch_is_flushed_at_once()
+    test_partial_batch_is_flushed_on_interval()
+    test_stop_drains_queued_rows()
+    test_full_buffer_rejects_rows()
+    test_failed_write_is_logged_and_dropped()
+    test_rejected_rows_are_dropped_alone()
+    test_stop_timeout_spills_in_flight_batch()
+    test_on_commit_waits_for_the_commit()
+
+    print("\n✅ All ingest buffer tests passed!")
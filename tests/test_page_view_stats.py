@@ -0,0 +1,184 @@
+"""
+Unit tests for the page view statistics query
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy.dialects import postgresql
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from rollups import TopItemsTracker
+from sketches import HyperLogLog
+from topk import SpaceSaving
+from tracking import AnalyticsTracker
+
+
+def compile_sql(query):
+    return str(
+        query.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def compile_query(site=None, since=datetime(2024, 1, 1, 9, 30)):
+    return compile_sql(AnalyticsTracker.page_view_stats_query(since, site))
+
+
+def sketch(*values):
+    hll = HyperLogLog()
+    hll.update(values)
+    return hll.to_bytes()
+
+
+def summary(counts):
+    top = SpaceSaving()
+    for item, count in counts.items():
+        top.add(item, count)
+    return top.to_dict()
+
+
+def test_query_reads_rollups_and_partial_hour():
+    """Whole hours come from the rollup, the leading partial hour from raw rows"""
+    sql = compile_query()
+
+    assert "FROM page_views_hourly" in sql
+    assert "page_views_hourly.hour >= '2024-01-01 10:00:00'" in sql
+    assert "page_views.timestamp >= '2024-01-01 09:30:00'" in sql
+    assert "page_views.timestamp < '2024-01-01 10:00:00'" in sql
+    assert "path" not in sql
+    print("✅ Page view stats read the hourly rollup")
+
+
+def test_site_filter_applies_to_every_source():
+    """The site filter is applied to both the rollup and the raw rows"""
+    assert "site = 'portfolio'" not in compile_query()
+
+    sql = compile_query(site="portfolio")
+    assert "page_views_hourly.site = 'portfolio'" in sql
+    assert "page_views.site = 'portfolio'" in sql
+    print("✅ Site filter applies to every statistic")
+
+
+def test_unique_visitors_merge_sketches_with_partial_hour():
+    """Visitors come from the hourly sketches plus the raw partial hour"""
+    db = AsyncMock()
+    db.scalars.side_effect = [[sketch("1.1.1.1")], ["1.1.1.1", "2.2.2.2"]]
+
+    count = asyncio.run(
+        AnalyticsTracker.count_unique_visitors(
+            db, datetime(2024, 1, 1, 9, 30), "portfolio"
+        )
+    )
+
+    sketches, recent = [
+        compile_sql(call.args[0]) for call in db.scalars.await_args_list
+    ]
+    assert "page_view_visitors_hourly.hour >= '2024-01-01 10:00:00'" in sketches
+    assert "page_view_visitors_hourly.site = 'portfolio'" in sketches
+    assert "SELECT DISTINCT page_views.ip_address" in recent
+    assert "page_views.timestamp < '2024-01-01 10:00:00'" in recent
+    assert "page_views.site = 'portfolio'" in recent
+    assert count == 2
+    print("✅ Unique visitors merged from sketches")
+
+
+def test_top_items_merge_stored_and_pending_summaries():
+    """Stored hourly summaries are merged with this process's unflushed ones"""
+    since = datetime.utcnow() - timedelta(hours=2)
+    tracker = TopItemsTracker(capacity=10)
+    tracker.add(
+        [
+            {"timestamp": datetime.utcnow(), "site": "portfolio", "path": "/b"},
+            {
+                "timestamp": since - timedelta(hours=1),
+                "site": "portfolio",
+                "path": "/c",
+            },
+        ]
+    )
+    db = AsyncMock()
+    db.execute.return_value = [
+        ("path", summary({"/a": 3, "/b": 1})),
+        ("path", summary({"/b": 2})),
+        ("referrer", summary({"github.com": 2})),
+    ]
+
+    with patch("tracking.top_items_tracker", tracker):
+        top = asyncio.run(AnalyticsTracker.get_top_items(db, since, "portfolio"))
+
+    sql = compile_sql(db.execute.await_args.args[0])
+    assert "top_items_hourly.hour >= '%s'" % since.strftime("%Y-%m-%d %H:00:00") in sql
+    assert "top_items_hourly.site = 'portfolio'" in sql
+    assert top == {
+        "path": [("/b", 4), ("/a", 3)],
+        "referrer": [("github.com", 2)],
+    }
+    print("✅ Top items merged from hourly summaries")
+
+
+def test_rows_are_assembled_into_stats():
+    """Site totals, sketches and top item summaries map onto the response"""
+    db = AsyncMock()
+    db.execute.side_effect = [
+        [("portfolio", 7), ("text-to-cad", 3)],
+        [
+            ("path", summary({"/a": 6, "/b": 4})),
+            ("referrer", summary({"news.ycombinator.com": 2})),
+        ],
+    ]
+    # Hourly visitor sketches, then the visitors of the partial hour
+    db.scalars.side_effect = [
+        [sketch("1.1.1.1", "2.2.2.2"), sketch("2.2.2.2", "3.3.3.3")],
+        ["1.1.1.1", "4.4.4.4"],
+    ]
+
+    with patch("tracking.top_items_tracker", TopItemsTracker(capacity=10)):
+        stats = asyncio.run(AnalyticsTracker.get_page_view_stats(db, hours=24))
+
+    assert stats == {
+        "total_views": 10,
+        "unique_visitors": 4,
+        "views_by_site": {"portfolio": 7, "text-to-cad": 3},
+        "top_pages": [{"path": "/a", "views": 6}, {"path": "/b", "views": 4}],
+        "top_referrers": [{"referrer": "news.ycombinator.com", "views": 2}],
+    }
+    print("✅ Page view stats assembled")
+
+
+def test_empty_window():
+    """No page views yields zeroed stats"""
+    db = AsyncMock()
+    db.execute.return_value = []
+    db.scalars.return_value = []
+
+    with patch("tracking.top_items_tracker", TopItemsTracker(capacity=10)):
+        stats = asyncio.run(AnalyticsTracker.get_page_view_stats(db, hours=1))
+
+    assert stats == {
+        "total_views": 0,
+        "unique_visitors": 0,
+        "views_by_site": {},
+        "top_pages": [],
+        "top_referrers": [],
+    }
+    print("✅ Empty window handled")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Page View Stats Tests...\n")
+
+    test_query_reads_rollups_and_partial_hour()
+    test_site_filter_applies_to_every_source()
+    test_unique_visitors_merge_sketches_with_partial_hour()
+    test_top_items_merge_stored_and_pending_summaries()
+    test_rows_are_assembled_into_stats()
+    test_empty_window()
+
+    print("\n✅ All page view stats tests passed!")
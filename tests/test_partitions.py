@@ -0,0 +1,165 @@
+"""
+Unit tests for time partitions of the raw event tables
+"""
+
+import os
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from database import PageView, PagePath
+from partitions import (
+    create_partitions,
+    drop_expired_partitions,
+    partition_end,
+    partition_name,
+    partition_range,
+    partition_start,
+)
+
+
+def fake_conn(partitions):
+    """PostgreSQL connection whose table is partitioned into partitions"""
+    conn = MagicMock()
+    conn.dialect.name = "postgresql"
+    conn.scalar.return_value = True
+    conn.scalars.return_value = partitions
+    return conn
+
+
+def executed_sql(conn):
+    return [str(call.args[0]) for call in conn.execute.call_args_list]
+
+
+def test_partition_bounds():
+    """Partitions start at midnight or the first of the month"""
+    timestamp = datetime(2024, 1, 31, 13, 45)
+
+    assert partition_start(timestamp, "day") == datetime(2024, 1, 31)
+    assert partition_end(datetime(2024, 1, 31), "day") == datetime(2024, 2, 1)
+    assert partition_start(timestamp, "month") == datetime(2024, 1, 1)
+    assert partition_end(datetime(2024, 1, 1), "month") == datetime(2024, 2, 1)
+    assert partition_end(datetime(2024, 12, 1), "month") == datetime(2025, 1, 1)
+    print("✅ Partition bounds computed")
+
+
+def test_partition_names_round_trip():
+    """The range of a partition is recovered from its name"""
+    monthly = partition_name("page_views", datetime(2024, 2, 1), "month")
+    daily = partition_name("page_views", datetime(2024, 2, 3), "day")
+
+    assert monthly == "page_views_p202402"
+    assert daily == "page_views_p20240203"
+    assert partition_range("page_views", monthly) == (
+        datetime(2024, 2, 1),
+        datetime(2024, 3, 1),
+    )
+    assert partition_range("page_views", daily) == (
+        datetime(2024, 2, 3),
+        datetime(2024, 2, 4),
+    )
+    assert partition_range("page_views", "page_views_default") is None
+    assert partition_range("events", monthly) is None
+    print("✅ Partition names round-trip")
+
+
+def test_missing_partitions_are_created():
+    """Only ranges not covered by an existing partition are created"""
+    conn = fake_conn(["page_views_p202401"])
+
+    created = create_partitions(
+        conn,
+        PageView.__table__,
+        datetime(2024, 1, 15),
+        datetime(2024, 3, 2),
+        "month",
+    )
+
+    assert created == ["page_views_p202402", "page_views_p202403"]
+    assert "FROM ('2024-02-01T00:00:00') TO ('2024-03-01T00:00:00')" in (
+        executed_sql(conn)[0]
+    )
+    print("✅ Missing partitions created")
+
+
+def test_overlapping_intervals_are_skipped():
+    """Daily partitions are not created inside an existing monthly one"""
+    conn = fake_conn(["page_views_p202401"])
+
+    created = create_partitions(
+        conn,
+        PageView.__table__,
+        datetime(2024, 1, 30),
+        datetime(2024, 2, 1, 12),
+        "day",
+    )
+
+    assert created == ["page_views_p20240201"]
+    print("✅ Overlapping partitions skipped")
+
+
+def test_unpartitioned_tables_are_left_alone():
+    conn = fake_conn([])
+    conn.scalar.return_value = False
+    sqlite_conn = MagicMock()
+    sqlite_conn.dialect.name = "sqlite"
+
+    for connection in (conn, sqlite_conn):
+        assert (
+            create_partitions(
+                connection,
+                PageView.__table__,
+                datetime(2024, 1, 1),
+                datetime(2024, 2, 1),
+            )
+            == []
+        )
+        connection.execute.assert_not_called()
+    print("✅ Unpartitioned tables left alone")
+
+
+def test_expired_partitions_are_dropped():
+    """Partitions ending at or before the cutoff are dropped"""
+    conn = fake_conn(["page_views_p202401", "page_views_p202402", "page_views_p202403"])
+
+    dropped = drop_expired_partitions(conn, PageView.__table__, datetime(2024, 3, 1))
+
+    assert dropped == ["page_views_p202401", "page_views_p202402"]
+    assert executed_sql(conn) == [
+        'DROP TABLE "page_views_p202401"',
+        'DROP TABLE "page_views_p202402"',
+    ]
+    print("✅ Expired partitions dropped")
+
+
+def test_partition_key_joins_the_primary_key():
+    """PostgreSQL requires the partition key in a partitioned primary key"""
+    dialect = postgresql.dialect()
+    page_views = str(CreateTable(PageView.__table__).compile(dialect=dialect))
+    page_paths = str(CreateTable(PagePath.__table__).compile(dialect=dialect))
+
+    assert "PRIMARY KEY (id, timestamp)" in page_views
+    assert "PARTITION BY RANGE (timestamp)" in page_views
+    assert "id SERIAL" in page_views
+    assert "PRIMARY KEY (id)" in page_paths
+    print("✅ Partition key added to the primary key")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Partition Tests...\n")
+
+    test_partition_bounds()
+    test_partition_names_round_trip()
+    test_missing_partitions_are_created()
+    test_overlapping_intervals_are_skipped()
+    test_unpartitioned_tables_are_left_alone()
+    test_expired_partitions_are_dropped()
+    test_partition_key_joins_the_primary_key()
+
+    print("\n✅ All partition tests passed!")
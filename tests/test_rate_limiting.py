@@ -0,0 +1,311 @@
+"""
+Unit tests for analytics rate limiting backends
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from config import settings
+from database import RateLimit
+from ratelimit import (
+    DatabaseRateLimitBackend,
+    MemoryRateLimitBackend,
+    RateLimitBackend,
+    RateLimitMiddleware,
+    create_rate_limit_backend,
+)
+
+
+def make_backend(max_requests=5, max_entries=100):
+    return MemoryRateLimitBackend(
+        max_requests=max_requests,
+        window_seconds=60,
+        block_seconds=300,
+        max_entries=max_entries,
+    )
+
+
+def run_database_backend(scenario, max_requests=3):
+    """Await scenario(backend, db) against an in-memory SQLite rate_limits
+
+    The upsert is built with SQLite's insert, which supports the same
+    ON CONFLICT DO UPDATE ... RETURNING as PostgreSQL's.
+    """
+
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with engine.begin() as conn:
+            await conn.run_sync(RateLimit.__table__.create)
+        async with AsyncSession(engine) as db:
+            result = await scenario(DatabaseRateLimitBackend(), db)
+        await engine.dispose()
+        return result
+
+    with patch("ratelimit.insert", sqlite.insert), patch.object(
+        settings, "rate_limit_requests", max_requests
+    ):
+        return asyncio.run(main())
+
+
+async def request_count(db, identifier="1.2.3.4"):
+    return await db.scalar(
+        select(RateLimit.request_count).where(RateLimit.identifier == identifier)
+    )
+
+
+def test_memory_backend_allows_up_to_limit():
+    """Requests within the limit pass, the next one is rejected"""
+    backend = make_backend()
+
+    with patch("ratelimit.time.time", return_value=6000.0):
+        results = [backend.allow("1.2.3.4") for _ in range(6)]
+
+    assert results == [True] * 5 + [False]
+    print("✅ Memory backend enforces the request limit")
+
+
+def test_memory_backend_blocks_until_block_expires():
+    """A blocked identifier stays blocked even after the window rolls over"""
+    backend = make_backend()
+
+    with patch("ratelimit.time.time", return_value=6000.0):
+        for _ in range(6):
+            backend.allow("1.2.3.4")
+
+    # Next window, but still inside the block period
+    with patch("ratelimit.time.time", return_value=6120.0):
+        assert backend.allow("1.2.3.4") is False
+
+    # Block expired and the old windows no longer overlap
+    with patch("ratelimit.time.time", return_value=6301.0):
+        assert backend.allow("1.2.3.4") is True
+    print("✅ Memory backend honours block_until")
+
+
+def test_memory_backend_sliding_window_weights_previous_window():
+    """Requests from the previous window count in proportion to the overlap"""
+    backend = make_backend(max_requests=10)
+
+    with patch("ratelimit.time.time", return_value=6000.0):
+        for _ in range(10):
+            assert backend.allow("1.2.3.4")
+
+    # Halfway through the next window, half of the previous 10 still count
+    with patch("ratelimit.time.time", return_value=6090.0):
+        results = [backend.allow("1.2.3.4") for _ in range(6)]
+
+    assert results == [True] * 5 + [False]
+    print("✅ Sliding window carries over the previous window")
+
+
+def test_memory_backend_charges_cost():
+    """A batch is charged as several requests in one check"""
+    backend = make_backend()
+
+    with patch("ratelimit.time.time", return_value=6000.0):
+        assert backend.allow("1.2.3.4", cost=5) is True
+        assert backend.allow("1.2.3.4") is False
+    print("✅ Batch cost is charged against the limit")
+
+
+def test_memory_backend_is_bounded():
+    """Least recently seen identifiers are evicted past max_entries"""
+    backend = make_backend(max_entries=3)
+
+    with patch("ratelimit.time.time", return_value=6000.0):
+        for i in range(10):
+            backend.allow(f"10.0.0.{i}")
+
+    assert len(backend._counters) == 3
+    print("✅ Memory backend stays within max_entries")
+
+
+def test_blocks_survive_eviction():
+    """New identifiers pushing a blocked one out of the counters keep its block"""
+    backend = make_backend(max_requests=1, max_entries=3)
+
+    with patch("ratelimit.time.time", return_value=6000.0):
+        backend.allow("1.1.1.1")
+        assert not backend.allow("1.1.1.1")
+        for i in range(10):
+            backend.allow(f"10.0.0.{i}")
+        still_blocked = backend.allow("1.1.1.1")
+    with patch("ratelimit.time.time", return_value=6000.0 + 301):
+        after_block = backend.allow("1.1.1.1")
+
+    assert still_blocked is False
+    assert after_block is True
+    print("✅ Blocks survive counter eviction")
+
+
+def test_blocked_lists_only_active_blocks():
+    """blocked() reports identifiers whose block has not expired"""
+    backend = make_backend(max_requests=1)
+
+    with patch("ratelimit.time.time", return_value=6000.0):
+        backend.allow("1.1.1.1")
+        backend.allow("1.1.1.1")
+        backend.allow("2.2.2.2")
+        blocked = [identifier for _, identifier, _ in backend.blocked()]
+
+    assert blocked == ["1.1.1.1"]
+    print("✅ Blocked identifiers reported for snapshots")
+
+
+def test_create_rate_limit_backend():
+    """Backends are selected by name"""
+    assert isinstance(create_rate_limit_backend("memory"), MemoryRateLimitBackend)
+
+    try:
+        create_rate_limit_backend("redis")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unknown backend should raise ValueError")
+    print("✅ Rate limit backend factory works")
+
+
+def test_backend_must_implement_check():
+    """Backends without check cannot be instantiated"""
+
+    class SnapshotOnly(RateLimitBackend):
+        async def snapshot(self):
+            pass
+
+    try:
+        SnapshotOnly()
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("A backend without check should not instantiate")
+    print("✅ Backends must implement check")
+
+
+def test_middleware_longest_prefix_wins():
+    """Route costs are matched by the longest prefix"""
+    middleware = RateLimitMiddleware(
+        None,
+        backend=make_backend(),
+        route_costs={"/track/": 1, "/track/batch": 5, "/track/cad-event": 0},
+    )
+
+    assert middleware.cost_for("/track/pageview") == 1
+    assert middleware.cost_for("/track/batch") == 5
+    assert middleware.cost_for("/track/cad-event") == 0
+    assert middleware.cost_for("/health") == 0
+    print("✅ Middleware picks the longest matching prefix")
+
+
+def test_middleware_rejects_before_app():
+    """Over-limit requests get a 429 without reaching the wrapped app"""
+    from starlette.testclient import TestClient
+
+    calls = []
+    charged = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        charged.append(scope.get("state", {}).get("rate_limit_cost"))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = RateLimitMiddleware(
+        app, backend=make_backend(max_requests=2), route_costs={"/track/": 1}
+    )
+    client = TestClient(middleware)
+
+    statuses = [client.post("/track/pageview").status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    assert client.get("/health").status_code == 200
+    assert calls == ["/track/pageview", "/track/pageview", "/health"]
+    # Handlers can see what the middleware charged
+    assert charged == [1, 1, None]
+    print("✅ Middleware rejects over-limit requests up front")
+
+
+def test_database_backend_counts_within_window():
+    """Each check adds its cost to the identifier's row"""
+
+    async def scenario(backend, db):
+        results = [await backend.check("1.2.3.4", db=db) for _ in range(2)]
+        results.append(await backend.check("1.2.3.4", cost=1, db=db))
+        await backend.check("5.6.7.8", db=db)
+        return results, await request_count(db), await request_count(db, "5.6.7.8")
+
+    results, count, other_count = run_database_backend(scenario)
+
+    assert results == [True, True, True]
+    assert (count, other_count) == (3, 1)
+    print("✅ Database backend counts requests in the window")
+
+
+def test_database_backend_rejects_over_limit():
+    """The request over the limit is rejected and blocks the identifier"""
+
+    async def scenario(backend, db):
+        results = [await backend.check("1.2.3.4", db=db) for _ in range(5)]
+        row = await db.scalar(select(RateLimit))
+        return results, row.is_blocked, row.block_until
+
+    results, is_blocked, block_until = run_database_backend(scenario)
+
+    assert results == [True, True, True, False, False]
+    assert is_blocked
+    assert block_until > datetime.utcnow()
+    print("✅ Database backend rejects requests over the limit")
+
+
+def test_database_backend_resets_expired_window():
+    """A check after the window restarts the count at its cost"""
+
+    async def scenario(backend, db):
+        for _ in range(3):
+            await backend.check("1.2.3.4", db=db)
+        window = timedelta(minutes=settings.rate_limit_window_minutes + 1)
+        await db.execute(
+            update(RateLimit).values(window_start=datetime.utcnow() - window)
+        )
+        await db.commit()
+        allowed = await backend.check("1.2.3.4", cost=2, db=db)
+        row = await db.scalar(select(RateLimit))
+        await db.refresh(row)
+        return allowed, row.request_count, row.window_start
+
+    allowed, count, window_start = run_database_backend(scenario)
+
+    assert allowed
+    assert count == 2
+    assert window_start > datetime.utcnow() - timedelta(minutes=1)
+    print("✅ Database backend resets expired windows")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Rate Limiting Tests...\n")
+
+    test_memory_backend_allows_up_to_limit()
+    test_memory_backend_blocks_until_block_expires()
+    test_memory_backend_sliding_window_weights_previous_window()
+    test_memory_backend_charges_cost()
+    test_memory_backend_is_bounded()
+    test_blocks_survive_eviction()
+    test_blocked_lists_only_active_blocks()
+    test_create_rate_limit_backend()
+    test_backend_must_implement_check()
+    test_middleware_longest_prefix_wins()
+    test_middleware_rejects_before_app()
+    test_database_backend_counts_within_window()
+    test_database_backend_rejects_over_limit()
+    test_database_backend_resets_expired_window()
+
+    print("\n✅ All rate limiting tests passed!")
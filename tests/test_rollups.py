@@ -0,0 +1,396 @@
+"""
+Unit tests for hourly rollup maintenance
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from rollups import (
+    DURATION_BUCKETS_MS,
+    cad_event_rollup_rows,
+    duration_bucket,
+    event_label,
+    event_rollup_rows,
+    first_full_hour,
+    hour_of,
+    page_view_rollup_rows,
+    percentile_from_histogram,
+    record_cad_events,
+    record_events,
+    record_page_views,
+    TopItemsTracker,
+    top_items_of,
+    user_sketches,
+    visitor_sketches,
+)
+from sketches import HyperLogLog
+
+
+def test_hour_boundaries():
+    """Timestamps truncate to their hour; windows start at the next full hour"""
+    assert hour_of(datetime(2024, 1, 1, 9, 59, 59, 999)) == datetime(2024, 1, 1, 9)
+    assert first_full_hour(datetime(2024, 1, 1, 9, 0, 1)) == datetime(2024, 1, 1, 10)
+    assert first_full_hour(datetime(2024, 1, 1, 9)) == datetime(2024, 1, 1, 9)
+    print("✅ Hour boundaries computed")
+
+
+def test_duration_buckets_match_width_bucket():
+    """Bucket i holds [bounds[i - 1], bounds[i]) like Postgres width_bucket"""
+    assert duration_bucket(0) == 0
+    assert duration_bucket(49) == 0
+    assert duration_bucket(50) == 1
+    assert duration_bucket(999) == 6
+    assert duration_bucket(10**7) == len(DURATION_BUCKETS_MS)
+    print("✅ Duration buckets match width_bucket")
+
+
+def test_percentile_from_histogram():
+    """Percentiles interpolate inside the bucket that holds them"""
+    assert percentile_from_histogram({}, 0.5) == 0
+    # 10 events in [100, 200)
+    assert percentile_from_histogram({2: 10}, 0.5) == 150
+    # The open-ended bucket reports its lower bound
+    assert percentile_from_histogram({2: 1, len(DURATION_BUCKETS_MS): 9}, 0.95) == (
+        DURATION_BUCKETS_MS[-1]
+    )
+    print("✅ Percentiles estimated from histogram")
+
+
+def test_page_view_rollup_rows_aggregate_by_hour():
+    """A batch collapses into one increment per (hour, site, path)"""
+    rows = [
+        {"timestamp": datetime(2024, 1, 1, 9, 5), "site": "portfolio", "path": "/"},
+        {"timestamp": datetime(2024, 1, 1, 9, 55), "site": "portfolio", "path": "/"},
+        {"timestamp": datetime(2024, 1, 1, 10, 1), "site": "portfolio", "path": "/"},
+        {"timestamp": datetime(2024, 1, 1, 9, 5), "site": "portfolio", "path": "/a"},
+    ]
+
+    assert page_view_rollup_rows(rows) == [
+        {"hour": datetime(2024, 1, 1, 9), "site": "portfolio", "path": "/", "views": 2},
+        {
+            "hour": datetime(2024, 1, 1, 9),
+            "site": "portfolio",
+            "path": "/a",
+            "views": 1,
+        },
+        {
+            "hour": datetime(2024, 1, 1, 10),
+            "site": "portfolio",
+            "path": "/",
+            "views": 1,
+        },
+    ]
+    print("✅ Page views aggregated per hour")
+
+
+def test_cad_event_rollup_rows_aggregate_counts_and_durations():
+    """CAD events add to counts, duration totals and the histogram"""
+    hour = datetime(2024, 1, 1, 9)
+    rows = [
+        {
+            "timestamp": hour,
+            "event_type": "generate",
+            "success": True,
+            "duration_ms": 120,
+        },
+        {
+            "timestamp": hour,
+            "event_type": "generate",
+            "success": True,
+            "duration_ms": 180,
+        },
+        {"timestamp": hour, "event_type": "generate", "success": False},
+        {"timestamp": hour, "event_type": None, "success": None, "duration_ms": 40},
+    ]
+
+    events, durations = cad_event_rollup_rows(rows)
+
+    assert events == [
+        {
+            "hour": hour,
+            "event_type": "generate",
+            "success": False,
+            "events": 1,
+            "duration_count": 0,
+            "duration_sum": 0,
+        },
+        {
+            "hour": hour,
+            "event_type": "generate",
+            "success": True,
+            "events": 2,
+            "duration_count": 2,
+            "duration_sum": 300,
+        },
+        {
+            "hour": hour,
+            "event_type": "unknown",
+            "success": False,
+            "events": 1,
+            "duration_count": 1,
+            "duration_sum": 40,
+        },
+    ]
+    assert durations == [
+        {"hour": hour, "bucket": 0, "events": 1},
+        {"hour": hour, "bucket": 2, "events": 2},
+    ]
+    print("✅ CAD events aggregated per hour")
+
+
+def test_sketches_group_distinct_values_by_hour():
+    """Visitors are sketched per (hour, site) and users per hour"""
+    hour = datetime(2024, 1, 1, 9)
+    rows = [
+        {"timestamp": hour, "site": "portfolio", "ip_address": "1.1.1.1"},
+        {"timestamp": hour, "site": "portfolio", "ip_address": "1.1.1.1"},
+        {"timestamp": hour, "site": "portfolio", "ip_address": "2.2.2.2"},
+        {"timestamp": hour, "site": "text-to-cad", "ip_address": None},
+    ]
+
+    visitors = visitor_sketches(rows)
+    assert list(visitors) == [(hour, "portfolio")]
+    assert visitors[(hour, "portfolio")].count() == 2
+
+    users = user_sketches([{"timestamp": hour, "user_id": "u1"}, {"timestamp": hour}])
+    assert list(users) == [(hour,)]
+    assert users[(hour,)].count() == 1
+    print("✅ Distinct values sketched per hour")
+
+
+def test_record_page_views_upserts_increments():
+    """Rollup rows are added to existing counts, not overwritten"""
+    db = AsyncMock()
+    rows = [{"timestamp": datetime(2024, 1, 1, 9), "site": "portfolio", "path": "/"}]
+
+    asyncio.run(record_page_views(db, rows))
+
+    statement, values = db.execute.await_args_list[0].args
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (hour, site, path) DO UPDATE" in sql
+    assert "views = (page_views_hourly.views + excluded.views)" in sql
+    assert values[0]["views"] == 1
+    print("✅ Page view rollups upserted as increments")
+
+
+def test_record_cad_events_writes_both_rollups():
+    """CAD events update the counts and the duration histogram"""
+    db = AsyncMock()
+    rows = [
+        {
+            "timestamp": datetime(2024, 1, 1, 9),
+            "event_type": "generate",
+            "success": True,
+            "duration_ms": 700,
+        }
+    ]
+
+    asyncio.run(record_cad_events(db, rows))
+
+    tables = [call.args[0].table.name for call in db.execute.await_args_list]
+    assert tables == ["cad_events_hourly", "cad_durations_hourly"]
+    print("✅ CAD rollups written")
+
+
+def test_sketches_are_merged_under_row_locks():
+    """Sketch rows are created, locked, merged in Python and written back"""
+    hour = datetime(2024, 1, 1, 9)
+    stored = HyperLogLog()
+    stored.add("1.1.1.1")
+    db = AsyncMock()
+    db.execute.side_effect = [
+        None,  # page_views_hourly increment
+        None,  # empty sketch rows
+        [(hour, "portfolio", stored.to_bytes())],  # locked sketch rows
+        None,  # merged sketches
+    ]
+    rows = [
+        {"timestamp": hour, "site": "portfolio", "path": "/", "ip_address": "2.2.2.2"}
+    ]
+
+    asyncio.run(record_page_views(db, rows))
+
+    _, create, lock, write = db.execute.await_args_list
+    create_sql = str(create.args[0].compile(dialect=postgresql.dialect()))
+    assert "page_view_visitors_hourly" in create_sql
+    assert "ON CONFLICT DO NOTHING" in create_sql
+    assert "FOR UPDATE" in str(lock.args[0].compile(dialect=postgresql.dialect()))
+    merged = write.args[1]
+    assert merged[0]["hour"] == hour and merged[0]["site"] == "portfolio"
+    assert HyperLogLog.from_bytes(merged[0]["sketch"]).count() == 2
+    print("✅ Sketches merged under row locks")
+
+
+def test_event_rollup_rows_label_by_link_type_and_percentage():
+    """Events are counted per hour, site, type and label"""
+    hour = datetime(2024, 1, 1, 9)
+    rows = [
+        {
+            "timestamp": hour.replace(minute=5),
+            "site": "portfolio",
+            "event_type": "link_click",
+            "properties": {"link_type": "github", "metadata": {"href": "x"}},
+        },
+        {
+            "timestamp": hour.replace(minute=50),
+            "site": "portfolio",
+            "event_type": "link_click",
+            "properties": {"link_type": "github"},
+        },
+        {
+            "timestamp": hour,
+            "site": None,
+            "event_type": "scroll",
+            "properties": {"scroll_percentage": 75},
+        },
+    ]
+
+    assert event_rollup_rows(rows) == [
+        {
+            "hour": hour,
+            "site": "",
+            "event_type": "scroll",
+            "label": "75",
+            "events": 1,
+        },
+        {
+            "hour": hour,
+            "site": "portfolio",
+            "event_type": "link_click",
+            "label": "github",
+            "events": 2,
+        },
+    ]
+    assert event_label({}) == ""
+    assert len(event_label({"link_type": "x" * 500})) == 100
+    print("✅ Event rollup rows aggregated")
+
+
+def test_record_events_upserts_increments():
+    """Event rollup rows are added to existing counts"""
+    db = AsyncMock()
+    rows = [
+        {
+            "timestamp": datetime(2024, 1, 1, 9),
+            "site": "portfolio",
+            "event_type": "scroll",
+            "properties": {"scroll_percentage": 50},
+        }
+    ]
+
+    asyncio.run(record_events(db, rows))
+
+    statement, values = db.execute.await_args.args
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (hour, site, event_type, label) DO UPDATE" in sql
+    assert values == [
+        {
+            "hour": datetime(2024, 1, 1, 9),
+            "site": "portfolio",
+            "event_type": "scroll",
+            "label": "50",
+            "events": 1,
+        }
+    ]
+    print("✅ Event rollups upserted as increments")
+
+
+def test_top_items_of_paths_and_referrer_hosts():
+    """Page views count towards their path and referrer host"""
+    assert top_items_of(
+        {"path": "/about", "referrer": "https://News.ycombinator.com/item?id=1"}
+    ) == [("path", "/about"), ("referrer", "news.ycombinator.com")]
+    assert top_items_of({"path": "/", "referrer": ""}) == [("path", "/")]
+    print("✅ Top item dimensions classified")
+
+
+def test_top_items_tracker_keeps_pending_summaries_per_hour_and_site():
+    """Pending summaries are filtered by hour and site"""
+    tracker = TopItemsTracker(capacity=10)
+    tracker.add(
+        [
+            {
+                "timestamp": datetime(2024, 1, 1, 9, 5),
+                "site": "portfolio",
+                "path": "/a",
+            },
+            {
+                "timestamp": datetime(2024, 1, 1, 10, 5),
+                "site": "portfolio",
+                "path": "/b",
+            },
+            {
+                "timestamp": datetime(2024, 1, 1, 10, 5),
+                "site": "text-to-cad",
+                "path": "/",
+            },
+        ]
+    )
+
+    pending = tracker.pending(datetime(2024, 1, 1, 10), "portfolio")
+
+    assert [(dimension, summary.top()) for dimension, summary in pending] == [
+        ("path", [("/b", 1)])
+    ]
+    assert len(tracker.pending(datetime(2024, 1, 1, 9))) == 3
+    print("✅ Pending summaries filtered")
+
+
+def test_top_items_flush_keeps_counts_on_failure():
+    """A failed flush leaves the counts for the next one"""
+    tracker = TopItemsTracker(capacity=10)
+    row = {"timestamp": datetime(2024, 1, 1, 9), "site": "portfolio", "path": "/a"}
+    tracker.add([row])
+
+    with patch("rollups.AsyncSessionLocal", side_effect=RuntimeError("down")):
+        with pytest.raises(RuntimeError):
+            asyncio.run(tracker.flush())
+    tracker.add([row])
+
+    [(_, summary)] = tracker.pending(datetime(2024, 1, 1))
+    assert summary.top() == [("/a", 2)]
+    print("✅ Failed flushes keep their counts")
+
+
+def test_empty_batches_do_nothing():
+    """No rows means no statements"""
+    db = AsyncMock()
+
+    asyncio.run(record_page_views(db, []))
+    asyncio.run(record_events(db, []))
+    asyncio.run(record_cad_events(db, []))
+
+    db.execute.assert_not_called()
+    print("✅ Empty batches skipped")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Rollup Tests...\n")
+
+    test_hour_boundaries()
+    test_duration_buckets_match_width_bucket()
+    test_percentile_from_histogram()
+    test_page_view_rollup_rows_aggregate_by_hour()
+    test_cad_event_rollup_rows_aggregate_counts_and_durations()
+    test_sketches_group_distinct_values_by_hour()
+    test_record_page_views_upserts_increments()
+    test_record_cad_events_writes_both_rollups()
+    test_sketches_are_merged_under_row_locks()
+    test_event_rollup_rows_label_by_link_type_and_percentage()
+    test_record_events_upserts_increments()
+    test_top_items_of_paths_and_referrer_hosts()
+    test_top_items_tracker_keeps_pending_summaries_per_hour_and_site()
+    test_top_items_flush_keeps_counts_on_failure()
+    test_empty_batches_do_nothing()
+
+    print("\n✅ All rollup tests passed!")
@@ -0,0 +1,108 @@
+"""
+Unit tests for per-site page view sampling
+"""
+
+import os
+import random
+import sys
+from datetime import datetime
+
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from compaction import stale_rollup_hours_query
+from database import PageView
+from rollups import TopItemsTracker, page_view_rollup_rows
+from sampling import SamplingRates, sample_weight
+from tracking import AnalyticsTracker
+
+
+def compile_sql(query):
+    return str(
+        query.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def page_views(count, site="portfolio", path="/"):
+    return [
+        {
+            "timestamp": datetime(2024, 1, 1, 9, 5),
+            "site": site,
+            "path": path,
+            "sample_weight": 1,
+        }
+        for _ in range(count)
+    ]
+
+
+def test_rates_round_to_whole_weights():
+    """A rate keeps one view in a whole number of them"""
+    assert sample_weight(1.0) == 1
+    assert sample_weight(0.1) == 10
+    assert sample_weight(0.3) == 3
+    assert sample_weight(0.9) == 1
+    for rate in (0, -0.5, 1.5):
+        with pytest.raises(ValueError):
+            sample_weight(rate)
+    print("✅ Rates rounded to whole weights")
+
+
+def test_only_sampled_sites_lose_rows():
+    """Kept rows carry their weight; unsampled sites keep every row"""
+    random.seed(1)
+    rates = SamplingRates({"portfolio": 0.1})
+
+    kept = rates.sample(page_views(10000) + page_views(100, site="text-to-cad"))
+    portfolio = [row for row in kept if row["site"] == "portfolio"]
+    text_to_cad = [row for row in kept if row["site"] == "text-to-cad"]
+
+    assert 900 < len(portfolio) < 1100
+    assert {row["sample_weight"] for row in portfolio} == {10}
+    assert len(text_to_cad) == 100
+    assert {row["sample_weight"] for row in text_to_cad} == {1}
+    print("✅ Only sampled sites lose rows")
+
+
+def test_rollups_count_weights():
+    """Rollup views and top items add up the weights of sampled rows"""
+    rows = page_views(2, path="/a") + page_views(1, path="/b")
+    rows[0]["sample_weight"] = 10
+    tracker = TopItemsTracker(capacity=10)
+
+    tracker.add(rows)
+
+    assert [row["views"] for row in page_view_rollup_rows(rows)] == [11, 1]
+    [(_, summary)] = tracker.pending(datetime(2024, 1, 1))
+    assert summary.top() == [("/a", 11), ("/b", 1)]
+    print("✅ Rollups count weights")
+
+
+def test_raw_counts_sum_weights():
+    """The partial hour and the compaction check sum weights, not rows"""
+    stats_sql = compile_sql(
+        AnalyticsTracker.page_view_stats_query(datetime(2024, 1, 1, 9, 30))
+    )
+    stale_sql = compile_sql(
+        stale_rollup_hours_query(PageView.__table__, None, datetime(2024, 1, 1))
+    )
+
+    assert "sum(page_views.sample_weight)" in stats_sql
+    assert "sum(page_views.sample_weight)" in stale_sql
+    print("✅ Raw counts sum weights")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Sampling Tests...\n")
+
+    test_rates_round_to_whole_weights()
+    test_only_sampled_sites_lose_rows()
+    test_rollups_count_weights()
+    test_raw_counts_sum_weights()
+
+    print("\n✅ All sampling tests passed!")
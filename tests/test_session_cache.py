@@ -0,0 +1,130 @@
+"""
+Unit tests for analytics session caching
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from auth import SessionCache, LastSeenTracker
+from database import Session
+
+
+def make_session(session_id="s1", user_id="u1", expires_in_hours=1, last_seen=None):
+    return Session(
+        id=session_id,
+        user_id=user_id,
+        email="test@analytics.test",
+        name="Test",
+        expires_at=datetime.utcnow() + timedelta(hours=expires_in_hours),
+        last_seen=last_seen or datetime.utcnow(),
+        is_active=True,
+    )
+
+
+def test_cache_returns_detached_copy():
+    """Cached sessions are copies with the same column values"""
+    cache = SessionCache(max_size=10, ttl_seconds=60)
+    original = make_session()
+
+    cached = cache.put(original)
+
+    assert cached is not original
+    assert cache.get("s1") is cached
+    assert cached.user_id == "u1"
+    print("✅ Session cache stores detached copies")
+
+
+def test_cache_expires_after_ttl():
+    """Entries older than the TTL are dropped"""
+    cache = SessionCache(max_size=10, ttl_seconds=60)
+
+    with patch("auth.time.monotonic", return_value=1000.0):
+        cache.put(make_session())
+    with patch("auth.time.monotonic", return_value=1030.0):
+        assert cache.get("s1") is not None
+    with patch("auth.time.monotonic", return_value=1061.0):
+        assert cache.get("s1") is None
+    print("✅ Session cache honours its TTL")
+
+
+def test_cache_drops_expired_sessions():
+    """A session past expires_at is never served from the cache"""
+    cache = SessionCache(max_size=10, ttl_seconds=60)
+    cache.put(make_session(expires_in_hours=-1))
+
+    assert cache.get("s1") is None
+    print("✅ Expired sessions are not served")
+
+
+def test_cache_is_bounded_lru():
+    """The least recently used entry is evicted first"""
+    cache = SessionCache(max_size=2, ttl_seconds=60)
+    cache.put(make_session("a"))
+    cache.put(make_session("b"))
+    cache.get("a")
+    cache.put(make_session("c"))
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    print("✅ Session cache evicts least recently used")
+
+
+def test_cache_invalidation():
+    """Sessions can be dropped one at a time or per user"""
+    cache = SessionCache(max_size=10, ttl_seconds=60)
+    cache.put(make_session("a", user_id="u1"))
+    cache.put(make_session("b", user_id="u1"))
+    cache.put(make_session("c", user_id="u2"))
+
+    cache.invalidate("c")
+    cache.invalidate_user("u1")
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") is None
+    print("✅ Session cache invalidation works")
+
+
+def test_last_seen_coalesced_below_threshold():
+    """Recently seen sessions are not queued for a write"""
+    tracker = LastSeenTracker(threshold_seconds=300)
+    session = make_session(last_seen=datetime.utcnow() - timedelta(seconds=10))
+
+    tracker.touch(session)
+
+    assert tracker._pending == {}
+    print("✅ Recent last_seen values are not rewritten")
+
+
+def test_last_seen_queued_once_past_threshold():
+    """A stale last_seen is queued once and then considered fresh"""
+    tracker = LastSeenTracker(threshold_seconds=300)
+    session = make_session(last_seen=datetime.utcnow() - timedelta(hours=1))
+
+    tracker.touch(session)
+    first = dict(tracker._pending)
+    tracker.touch(session)
+
+    assert list(first) == ["s1"]
+    assert tracker._pending == first
+    print("✅ Stale last_seen values are queued once")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Session Cache Tests...\n")
+
+    test_cache_returns_detached_copy()
+    test_cache_expires_after_ttl()
+    test_cache_drops_expired_sessions()
+    test_cache_is_bounded_lru()
+    test_cache_invalidation()
+    test_last_seen_coalesced_below_threshold()
+    test_last_seen_queued_once_past_threshold()
+
+    print("\n✅ All session cache tests passed!")
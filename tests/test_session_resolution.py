@@ -0,0 +1,264 @@
+"""
+Tests that sessions are resolved at most once per request and then cached
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from starlette.requests import Request
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from app import app
+from auth import LastSeenTracker, get_current_session, session_cache
+from database import Base, Session, get_db
+
+
+@pytest.fixture
+def test_db():
+    """In-memory database with a counter of queries against sessions"""
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    TestingSession = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    session_queries = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_session_queries(conn, cursor, statement, parameters, context, many):
+        if (
+            statement.lstrip().upper().startswith("SELECT")
+            and "FROM sessions" in statement
+        ):
+            session_queries.append(statement)
+
+    async def override_get_db():
+        async with TestingSession() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    session_cache.clear()
+
+    session_id = str(uuid.uuid4())
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with TestingSession() as db:
+            db.add(
+                Session(
+                    id=session_id,
+                    user_id="test_user",
+                    email="test@analytics.test",
+                    name="Test User",
+                    expires_at=datetime.utcnow() + timedelta(hours=1),
+                )
+            )
+            await db.commit()
+
+    asyncio.run(setup())
+
+    yield TestingSession, session_id, session_queries
+
+    app.dependency_overrides.clear()
+    session_cache.clear()
+    asyncio.run(engine.dispose())
+
+
+def count_sessions(TestingSession):
+    async def count():
+        async with TestingSession() as db:
+            return await db.scalar(select(func.count()).select_from(Session))
+
+    return asyncio.run(count())
+
+
+def update_session(TestingSession, session_id, **values):
+    async def write():
+        async with TestingSession() as db:
+            await db.execute(
+                update(Session).where(Session.id == session_id).values(**values)
+            )
+            await db.commit()
+
+    asyncio.run(write())
+
+
+def make_request(session_id):
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(b"cookie", f"session_id={session_id}".encode())],
+        }
+    )
+
+
+def test_repeated_resolution_is_memoized(test_db):
+    """Resolving twice on one request queries sessions once"""
+    TestingSession, session_id, session_queries = test_db
+    request = make_request(session_id)
+
+    async def resolve_twice():
+        async with TestingSession() as db:
+            first = await get_current_session(request, db)
+            # Even with the cache emptied the request keeps its resolved session
+            session_cache.clear()
+            second = await get_current_session(request, db)
+        return first, second
+
+    first, second = asyncio.run(resolve_twice())
+
+    assert first is second
+    assert first.id == session_id
+    assert len(session_queries) == 1
+    print("✅ Session resolved once per request")
+
+
+def test_missing_session_is_memoized(test_db):
+    """An unknown cookie is looked up once, not on every call"""
+    TestingSession, _, session_queries = test_db
+    request = make_request("does-not-exist")
+
+    async def resolve_twice():
+        async with TestingSession() as db:
+            return [await get_current_session(request, db) for _ in range(2)]
+
+    assert asyncio.run(resolve_twice()) == [None, None]
+    assert len(session_queries) == 1
+    print("✅ Missing sessions are memoized too")
+
+
+def test_track_pageview_queries_sessions_once(test_db):
+    """/track/pageview resolves the session with a single query"""
+    _, session_id, session_queries = test_db
+    client = TestClient(app)
+    client.cookies.set("session_id", session_id)
+
+    response = client.post(
+        "/track/pageview", json={"site": "portfolio", "path": "/test-page"}
+    )
+
+    assert response.status_code == 200
+    assert len(session_queries) == 1
+    print("✅ /track/pageview queries sessions once")
+
+
+def test_require_session_endpoint_queries_sessions_once(test_db):
+    """require_session and get_current_session share one lookup"""
+    _, session_id, session_queries = test_db
+    client = TestClient(app)
+    client.cookies.set("session_id", session_id)
+
+    response = client.post(
+        "/track/cad-event", json={"event_type": "generate", "prompt": "a cube"}
+    )
+
+    assert response.status_code == 200
+    assert len(session_queries) == 1
+    print("✅ /track/cad-event queries sessions once")
+
+
+def test_session_cache_hit_skips_query(test_db):
+    """A second request for the same session is served from the cache"""
+    _, session_id, session_queries = test_db
+    client = TestClient(app)
+    client.cookies.set("session_id", session_id)
+
+    for _ in range(3):
+        response = client.post(
+            "/track/pageview", json={"site": "portfolio", "path": "/test-page"}
+        )
+        assert response.status_code == 200
+
+    assert len(session_queries) == 1
+    print("✅ Later requests hit the session cache")
+
+
+def test_create_session_reuses_cookie_session(test_db):
+    """POST /session returns the cookie's session without a new row"""
+    TestingSession, session_id, session_queries = test_db
+    client = TestClient(app)
+    client.cookies.set("session_id", session_id)
+
+    responses = [client.post("/session") for _ in range(2)]
+    queries = len(session_queries)
+
+    assert [response.json()["session_id"] for response in responses] == [
+        session_id,
+        session_id,
+    ]
+    assert all("set-cookie" not in response.headers for response in responses)
+    # The second call is a cache hit
+    assert queries == 1
+    assert count_sessions(TestingSession) == 1
+    print("✅ POST /session reuses the cookie session")
+
+
+def test_expired_session_is_evicted(test_db):
+    """A session that expired while cached is dropped and replaced"""
+    TestingSession, session_id, _ = test_db
+    client = TestClient(app)
+    client.cookies.set("session_id", session_id)
+    client.post("/session")
+
+    expired = datetime.utcnow() - timedelta(minutes=1)
+    update_session(TestingSession, session_id, expires_at=expired)
+    session_cache.get(session_id).expires_at = expired
+    with patch("auth.settings.anonymous_session_tokens", False):
+        response = client.post("/session")
+
+    assert response.json()["session_id"] != session_id
+    assert session_id not in session_cache._entries
+    assert count_sessions(TestingSession) == 2
+    print("✅ Expired sessions evicted from the cache")
+
+
+def test_last_seen_writes_are_coalesced(test_db):
+    """Requests within the threshold share one last_seen UPDATE"""
+    TestingSession, session_id, _ = test_db
+    update_session(
+        TestingSession, session_id, last_seen=datetime.utcnow() - timedelta(hours=1)
+    )
+    updates = []
+
+    @event.listens_for(TestingSession.kw["bind"].sync_engine, "before_cursor_execute")
+    def count_updates(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().upper().startswith("UPDATE SESSIONS"):
+            updates.append(statement)
+
+    tracker = LastSeenTracker(threshold_seconds=300)
+    client = TestClient(app)
+    client.cookies.set("session_id", session_id)
+
+    with patch("auth.last_seen_tracker", tracker), patch(
+        "auth.AsyncSessionLocal", TestingSession
+    ):
+        for _ in range(3):
+            client.post("/track/pageview", json={"site": "portfolio", "path": "/"})
+        asyncio.run(tracker.flush())
+        client.post("/track/pageview", json={"site": "portfolio", "path": "/"})
+        asyncio.run(tracker.flush())
+
+    async def last_seen():
+        async with TestingSession() as db:
+            return await db.scalar(
+                select(Session.last_seen).where(Session.id == session_id)
+            )
+
+    assert len(updates) == 1
+    assert datetime.utcnow() - asyncio.run(last_seen()) < timedelta(minutes=1)
+    print("✅ last_seen writes coalesced")
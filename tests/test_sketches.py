@@ -0,0 +1,100 @@
+"""
+Unit tests for HyperLogLog distinct count sketches
+"""
+
+import os
+import sys
+
+import pytest
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from sketches import HyperLogLog
+
+
+def sketch_of(values, precision=12):
+    hll = HyperLogLog(precision)
+    hll.update(values)
+    return hll
+
+
+def test_small_counts_are_close_to_exact():
+    """Linear counting keeps small cardinalities within a value or two"""
+    assert HyperLogLog().count() == 0
+    assert sketch_of(["1.2.3.4"]).count() == 1
+    assert sketch_of(["1.2.3.4"] * 100).count() == 1
+    assert abs(sketch_of(str(i) for i in range(100)).count() - 100) <= 2
+    print("✅ Small counts estimated")
+
+
+def test_large_counts_within_error_bound():
+    """Estimates stay within three standard errors"""
+    for n in (5000, 50000):
+        hll = sketch_of(f"10.0.{i // 256}.{i % 256}-{i}" for i in range(n))
+        assert abs(hll.count() - n) <= 3 * hll.relative_error * n
+    print("✅ Large counts within the error bound")
+
+
+def test_merge_is_union():
+    """Merged sketches count the union, not the sum"""
+    a = sketch_of(str(i) for i in range(3000))
+    b = sketch_of(str(i) for i in range(2000, 5000))
+    union = sketch_of(str(i) for i in range(5000))
+
+    a.merge(b)
+
+    assert a.registers == union.registers
+    print("✅ Merge counts the union")
+
+
+def test_union_of_serialized_sketches():
+    """union() matches merging one at a time"""
+    parts = [
+        sketch_of(str(i) for i in range(start, start + 1000))
+        for start in (0, 500, 3000)
+    ]
+    merged = HyperLogLog()
+    for part in parts:
+        merged.merge(part)
+
+    assert HyperLogLog.union([]).count() == 0
+    assert HyperLogLog.union([parts[0].to_bytes()]).registers == parts[0].registers
+    assert HyperLogLog.union(part.to_bytes() for part in parts).registers == (
+        merged.registers
+    )
+    print("✅ Serialized sketches unioned")
+
+
+def test_serialization_round_trip():
+    """Precision is recovered from the register count"""
+    hll = sketch_of(["a", "b", "c"], precision=10)
+    data = hll.to_bytes()
+
+    assert len(data) == 1024
+    restored = HyperLogLog.from_bytes(data)
+    assert restored.precision == 10
+    assert restored.count() == 3
+    print("✅ Sketches round-trip through bytes")
+
+
+def test_mismatched_precision_is_rejected():
+    """Sketches of different precision cannot be merged"""
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+    with pytest.raises(ValueError):
+        HyperLogLog(20)
+    print("✅ Mismatched precision rejected")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Sketch Tests...\n")
+
+    test_small_counts_are_close_to_exact()
+    test_large_counts_within_error_bound()
+    test_merge_is_union()
+    test_union_of_serialized_sketches()
+    test_serialization_round_trip()
+    test_mismatched_precision_is_rejected()
+
+    print("\n✅ All sketch tests passed!")
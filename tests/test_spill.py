@@ -0,0 +1,304 @@
+"""
+Unit tests for the local spill log of tracking rows
+"""
+
+import asyncio
+import fcntl
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy.exc import DBAPIError
+from starlette.requests import Request
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from app import _tracking_session
+from config import settings
+from database import Event, PageView
+from ingest import WriteBehindBuffer
+from spill import SpillLog, is_row_error, write_isolating
+
+
+def page_view(i):
+    return {
+        "timestamp": datetime(2024, 1, 1, 12, i),
+        "site": "portfolio",
+        "path": f"/page/{i}",
+    }
+
+
+class PostgresError(Exception):
+    sqlstate = "22021"
+
+
+def nul_error():
+    """The error asyncpg gives for a NUL character in a text column"""
+    return DBAPIError(
+        "INSERT INTO page_views ...",
+        None,
+        PostgresError('invalid byte sequence for encoding "UTF8": 0x00'),
+    )
+
+
+class Writes:
+    """Records written batches, failing the calls numbered in fail_on
+
+    Batches holding a path with a NUL character fail like in Postgres.
+    """
+
+    def __init__(self, fail_on=()):
+        self.batches = []
+        self.calls = 0
+        self.fail_on = set(fail_on)
+
+    async def __call__(self, rows):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            raise ConnectionError("database unavailable")
+        if any("\x00" in row.get("path", "") for row in rows):
+            raise nul_error()
+        self.batches.append(rows)
+
+    @property
+    def rows(self):
+        return [row for batch in self.batches for row in batch]
+
+
+def test_spilled_rows_are_replayed_in_order():
+    """Rows come back in order, in batches, with their datetimes"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = SpillLog(spill_dir, PageView, 1024 * 1024)
+        spill.append([page_view(i) for i in range(3)])
+        spill.append([page_view(3), page_view(4)])
+        spill.sync()
+        writes = Writes()
+
+        replayed = asyncio.run(spill.replay(writes, batch_size=2))
+        left = os.listdir(spill_dir)
+
+    assert replayed == 5
+    assert [len(batch) for batch in writes.batches] == [2, 2, 1]
+    assert writes.rows == [page_view(i) for i in range(5)]
+    assert left == []
+    print("✅ Spilled rows replayed in order")
+
+
+def test_failed_replay_resumes_at_its_batch():
+    """Batches written before a failure are not written again"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = SpillLog(spill_dir, PageView, 1024 * 1024)
+        spill.append([page_view(i) for i in range(5)])
+        writes = Writes(fail_on={2})
+
+        first = asyncio.run(spill.replay(writes, batch_size=2))
+        second = asyncio.run(spill.replay(writes, batch_size=2))
+        left = os.listdir(spill_dir)
+
+    assert (first, second) == (2, 3)
+    assert writes.rows == [page_view(i) for i in range(5)]
+    assert left == []
+    print("✅ Failed replay resumed at its batch")
+
+
+def test_row_errors_are_told_from_outages():
+    assert is_row_error(nul_error())
+    assert is_row_error(ValueError("bad row"))
+    assert not is_row_error(ConnectionError("database unavailable"))
+    assert not is_row_error(DBAPIError("SELECT 1", None, Exception("closed")))
+    print("✅ Row errors told from outages")
+
+
+def test_rejected_rows_are_isolated():
+    """Failed batches are halved until only the bad rows are left"""
+    rows = [page_view(i) for i in range(8)]
+    rows[5]["path"] = "/\x00"
+    writes = Writes()
+
+    rejected = asyncio.run(write_isolating(writes, rows))
+
+    assert [row for row, _ in rejected] == [rows[5]]
+    assert writes.rows == rows[:5] + rows[6:]
+    # 8 -> 4 + 4 -> 2 + 2 -> 1 + 1
+    assert writes.calls == 7
+    print("✅ Rejected rows isolated")
+
+
+def test_outages_are_not_isolated():
+    """A batch failing for another reason is not split"""
+    writes = Writes(fail_on={1})
+
+    try:
+        asyncio.run(write_isolating(writes, [page_view(i) for i in range(8)]))
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("The connection error should be raised")
+    assert writes.calls == 1
+    print("✅ Outages not isolated")
+
+
+def test_rejected_rows_do_not_block_replay():
+    """A row the database rejects is set aside and later segments replayed"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = SpillLog(spill_dir, PageView, 1024 * 1024)
+        bad = page_view(1)
+        bad["path"] = "/\x00"
+        spill.append([page_view(0), bad, page_view(2)])
+        spill.close_segment()
+        spill.append([page_view(3), page_view(4)])
+        writes = Writes()
+
+        with patch("spill.print", create=True):
+            replayed = asyncio.run(spill.replay(writes, batch_size=10))
+        left = os.listdir(spill_dir)
+        with open(os.path.join(spill_dir, "rejected", "page_views.jsonl")) as f:
+            rejected = [json.loads(line) for line in f]
+
+    assert replayed == 4
+    assert writes.rows == [page_view(0), page_view(2), page_view(3), page_view(4)]
+    assert left == ["rejected"]
+    assert [entry["row"]["path"] for entry in rejected] == ["/\x00"]
+    assert "0x00" in rejected[0]["error"]
+    print("✅ Rejected rows do not block the replay")
+
+
+def test_truncated_lines_are_skipped():
+    """A line cut short by a crash does not stop the replay"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = SpillLog(spill_dir, PageView, 1024 * 1024)
+        spill.append([page_view(0)])
+        spill.close_segment()
+        with open(glob.glob(os.path.join(spill_dir, "*.jsonl"))[0], "ab") as f:
+            f.write(b'{"timestamp": "2024-01-01T12:01:00", "si')
+        writes = Writes()
+
+        replayed = asyncio.run(spill.replay(writes, batch_size=10))
+
+    assert replayed == 1
+    assert writes.rows == [page_view(0)]
+    print("✅ Truncated lines skipped")
+
+
+def test_locked_segments_are_left_alone():
+    """Segments still open in another process are not replayed"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        writer = SpillLog(spill_dir, Event, 1024 * 1024)
+        writer.append([{"timestamp": datetime(2024, 1, 1), "event_type": "scroll"}])
+        replayer = SpillLog(spill_dir, Event, 1024 * 1024)
+        writes = Writes()
+
+        while_open = asyncio.run(replayer.replay(writes, batch_size=10))
+        writer.close_segment()
+        after_close = asyncio.run(replayer.replay(writes, batch_size=10))
+
+    assert (while_open, after_close) == (0, 1)
+    print("✅ Locked segments left alone")
+
+
+def test_segments_rotate_at_max_size():
+    """Segments are closed, and so replayable, once past the max size"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = SpillLog(spill_dir, PageView, 200)
+        for i in range(4):
+            spill.append([page_view(i), page_view(i + 10)])
+        closed = glob.glob(os.path.join(spill_dir, "page_views-*.jsonl"))
+        with open(closed[0], "rb") as segment:
+            # Closed segments are unlocked
+            fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        writes = Writes()
+
+        asyncio.run(spill.replay(writes, batch_size=100))
+
+    assert len(closed) == 2
+    assert len(writes.rows) == 8
+    assert writes.rows[:2] == [page_view(0), page_view(10)]
+    print("✅ Segments rotated at max size")
+
+
+def test_full_buffer_spills_instead_of_rejecting():
+    """A full buffer with a spill log takes rows and spills them"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = SpillLog(spill_dir, PageView, 1024 * 1024)
+        buffer = WriteBehindBuffer(
+            PageView, max_size=2, batch_size=2, flush_interval_ms=60000, spill=spill
+        )
+        writes = Writes()
+
+        async def main():
+            await buffer.start()
+            accepted = buffer.enqueue_many([page_view(i) for i in range(3)])
+            replayed = await spill.replay(writes, batch_size=10)
+            buffer._rows.clear()
+            await buffer.stop()
+            return accepted, replayed
+
+        accepted, replayed = asyncio.run(main())
+
+    assert (accepted, replayed, len(buffer)) == (True, 3, 0)
+    print("✅ Full buffer spilled instead of rejecting")
+
+
+def test_slow_session_lookup_tracks_anonymously():
+    """A session lookup past TRACK_SESSION_TIMEOUT_MS is given up on"""
+    request = Request({"type": "http", "headers": []})
+    db = AsyncMock()
+
+    async def slow_lookup(request, db):
+        await asyncio.sleep(10)
+
+    start = time.monotonic()
+    with patch("app.get_current_session", slow_lookup), patch.object(
+        settings, "track_session_timeout_ms", 20
+    ), patch("app.print", create=True):
+        session = asyncio.run(_tracking_session(request, db))
+
+    assert session is None
+    assert time.monotonic() - start < 1
+    assert request.state.session is None
+    # The cancelled query's connection is not reused
+    db.invalidate.assert_awaited_once()
+    print("✅ Slow session lookups tracked anonymously")
+
+
+def test_failed_session_lookup_tracks_anonymously():
+    request = Request({"type": "http", "headers": []})
+    db = AsyncMock()
+
+    async def failing_lookup(request, db):
+        raise ConnectionRefusedError("database unavailable")
+
+    with patch("app.get_current_session", failing_lookup), patch(
+        "app.print", create=True
+    ) as log:
+        session = asyncio.run(_tracking_session(request, db))
+
+    assert session is None
+    assert "tracking anonymously" in log.call_args.args[0]
+    db.invalidate.assert_awaited_once()
+    print("✅ Failed session lookups tracked anonymously")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Spill Tests...\n")
+
+    test_spilled_rows_are_replayed_in_order()
+    test_failed_replay_resumes_at_its_batch()
+    test_row_errors_are_told_from_outages()
+    test_rejected_rows_are_isolated()
+    test_outages_are_not_isolated()
+    test_rejected_rows_do_not_block_replay()
+    test_truncated_lines_are_skipped()
+    test_locked_segments_are_left_alone()
+    test_segments_rotate_at_max_size()
+    test_full_buffer_spills_instead_of_rejecting()
+    test_slow_session_lookup_tracks_anonymously()
+    test_failed_session_lookup_tracks_anonymously()
+
+    print("\n✅ All spill tests passed!")
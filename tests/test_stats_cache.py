@@ -0,0 +1,180 @@
+"""
+Unit tests for the admin stats result cache
+"""
+
+import asyncio
+import os
+import sys
+from unittest.mock import patch
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from cache import StatsCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Computation:
+    """Counts calls and returns the call number, optionally after a delay"""
+
+    def __init__(self, delay=0.0, error=None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.calls
+
+
+def run(coro, clock=None):
+    with patch("cache.monotonic", clock or Clock()):
+        return asyncio.run(coro)
+
+
+def test_concurrent_misses_share_one_computation():
+    """N identical concurrent requests run the computation once"""
+    cache = StatsCache(ttl_seconds=10, stale_seconds=60, max_entries=10)
+    compute = Computation(delay=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("key", compute) for _ in range(20)))
+
+    assert run(scenario()) == [1] * 20
+    assert compute.calls == 1
+    print("✅ Concurrent misses coalesced")
+
+
+def test_fresh_values_are_served_from_cache():
+    """Values younger than the TTL are not recomputed"""
+    cache = StatsCache(ttl_seconds=10, stale_seconds=60, max_entries=10)
+    compute = Computation()
+    clock = Clock()
+
+    async def scenario():
+        first = await cache.get("key", compute)
+        clock.now += 9
+        return first, await cache.get("key", compute)
+
+    assert run(scenario(), clock) == (1, 1)
+    assert compute.calls == 1
+    print("✅ Fresh values served from cache")
+
+
+def test_stale_values_are_served_while_refreshing():
+    """A stale value is returned at once and refreshed in the background"""
+    cache = StatsCache(ttl_seconds=10, stale_seconds=60, max_entries=10)
+    compute = Computation()
+    clock = Clock()
+
+    async def scenario():
+        await cache.get("key", compute)
+        clock.now += 30
+        stale = [await cache.get("key", compute) for _ in range(3)]
+        await asyncio.sleep(0.01)  # let the refresh finish
+        return stale, await cache.get("key", compute)
+
+    assert run(scenario(), clock) == ([1, 1, 1], 2)
+    assert compute.calls == 2
+    print("✅ Stale values served while refreshing")
+
+
+def test_expired_values_are_recomputed():
+    """Past the stale window the caller waits for a new value"""
+    cache = StatsCache(ttl_seconds=10, stale_seconds=60, max_entries=10)
+    compute = Computation()
+    clock = Clock()
+
+    async def scenario():
+        await cache.get("key", compute)
+        clock.now += 71
+        return await cache.get("key", compute)
+
+    assert run(scenario(), clock) == 2
+    print("✅ Expired values recomputed")
+
+
+def test_errors_reach_waiters_and_are_not_cached():
+    """A failed computation raises for every waiter and is retried next time"""
+    cache = StatsCache(ttl_seconds=10, stale_seconds=60, max_entries=10)
+    failing = Computation(delay=0.01, error=RuntimeError("db down"))
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(cache.get("key", failing) for _ in range(3)), return_exceptions=True
+        )
+        return results, await cache.get("key", Computation())
+
+    results, retried = run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert failing.calls == 1
+    assert retried == 1
+    print("✅ Errors propagated, not cached")
+
+
+def test_failed_refresh_keeps_stale_value():
+    """A background refresh failure leaves the stale value in place"""
+    cache = StatsCache(ttl_seconds=10, stale_seconds=60, max_entries=10)
+    clock = Clock()
+
+    async def scenario():
+        await cache.get("key", Computation())
+        clock.now += 30
+        stale = await cache.get("key", Computation(error=RuntimeError("db down")))
+        await asyncio.sleep(0.01)
+        return stale, await cache.get("key", Computation())
+
+    assert run(scenario(), clock) == (1, 1)
+    print("✅ Failed refresh keeps the stale value")
+
+
+def test_least_recently_used_keys_are_evicted():
+    """The cache holds at most max_entries keys"""
+    cache = StatsCache(ttl_seconds=10, stale_seconds=60, max_entries=2)
+    computations = {key: Computation() for key in "abc"}
+
+    async def scenario():
+        for key in "abac":
+            await cache.get(key, computations[key])
+        await cache.get("b", computations["b"])
+
+    run(scenario())
+    assert computations["a"].calls == 1
+    assert computations["b"].calls == 2
+    print("✅ Least recently used keys evicted")
+
+
+def test_zero_ttl_disables_caching():
+    cache = StatsCache(ttl_seconds=0, stale_seconds=60, max_entries=10)
+    compute = Computation()
+
+    async def scenario():
+        return [await cache.get("key", compute) for _ in range(2)]
+
+    assert run(scenario()) == [1, 2]
+    print("✅ Zero TTL disables caching")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Stats Cache Tests...\n")
+
+    test_concurrent_misses_share_one_computation()
+    test_fresh_values_are_served_from_cache()
+    test_stale_values_are_served_while_refreshing()
+    test_expired_values_are_recomputed()
+    test_errors_reach_waiters_and_are_not_cached()
+    test_failed_refresh_keeps_stale_value()
+    test_least_recently_used_keys_are_evicted()
+    test_zero_ttl_disables_caching()
+
+    print("\n✅ All stats cache tests passed!")
@@ -0,0 +1,134 @@
+"""
+Unit tests for the bucketed time series stats
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from rollups import bucket_of
+from sketches import HyperLogLog
+from tracking import AnalyticsTracker
+
+
+def compile_sql(metric, bucket, site=None):
+    query = AnalyticsTracker.timeseries_query(
+        metric, bucket, datetime(2024, 1, 1), site
+    )
+    return str(
+        query.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def sketch(*values):
+    hll = HyperLogLog()
+    hll.update(values)
+    return hll.to_bytes()
+
+
+def series(metric, bucket, hours, rows):
+    """Time series for db rows given as (offset in buckets, value) pairs"""
+    start = bucket_of(datetime.utcnow() - timedelta(hours=hours), bucket)
+    step = {"minute": 60, "hour": 3600, "day": 86400}[bucket]
+    db = AsyncMock()
+    db.execute.return_value = [
+        (start + timedelta(seconds=step * offset), value) for offset, value in rows
+    ]
+    return asyncio.run(AnalyticsTracker.get_timeseries(db, metric, bucket, hours))
+
+
+def test_buckets_align_like_date_trunc():
+    timestamp = datetime(2024, 1, 31, 13, 45, 30, 500)
+
+    assert bucket_of(timestamp, "minute") == datetime(2024, 1, 31, 13, 45)
+    assert bucket_of(timestamp, "hour") == datetime(2024, 1, 31, 13)
+    assert bucket_of(timestamp, "day") == datetime(2024, 1, 31)
+    with pytest.raises(ValueError):
+        bucket_of(timestamp, "week")
+    print("✅ Buckets aligned like date_trunc")
+
+
+def test_hour_and_day_buckets_read_rollups():
+    """Hours and days are summed from the hourly rollups"""
+    page_views = compile_sql("page_views", "day", "portfolio")
+    cad_events = compile_sql("cad_events", "hour")
+
+    assert "date_trunc('day', page_views_hourly.hour)" in page_views
+    assert "sum(page_views_hourly.views)" in page_views
+    assert "page_views_hourly.site = 'portfolio'" in page_views
+    assert "page_views_hourly.hour >= '2024-01-01 00:00:00'" in page_views
+    assert "sum(cad_events_hourly.events)" in cad_events
+    assert "FROM cad_events " not in cad_events
+    print("✅ Hour and day buckets read the rollups")
+
+
+def test_minute_buckets_read_raw_rows():
+    """Minutes are aggregated from the raw tables, weighting sampled views"""
+    page_views = compile_sql("page_views", "minute")
+    visitors = compile_sql("unique_visitors", "minute")
+    error_rate = compile_sql("error_rate", "minute", "portfolio")
+
+    assert "date_trunc('minute', page_views.timestamp)" in page_views
+    assert "sum(page_views.sample_weight)" in page_views
+    assert "count(DISTINCT page_views.ip_address)" in visitors
+    assert "FILTER (WHERE cad_events.success = true)" in error_rate
+    # CAD events have no site
+    assert "site" not in error_rate
+    print("✅ Minute buckets read the raw rows")
+
+
+def test_gaps_are_filled():
+    """Every bucket of the window is present, empty ones as 0"""
+    result = series("page_views", "hour", 4, [(0, 5), (2, 7)])
+
+    assert result["bucket"] == "hour"
+    assert result["step_seconds"] == 3600
+    assert result["values"] == [5, 0, 7, 0, 0]
+    print("✅ Gaps filled")
+
+
+def test_empty_error_rate_buckets_are_null():
+    """Buckets without CAD events have no error rate"""
+    result = series("error_rate", "minute", 1, [(1, Decimal("12.50")), (2, None)])
+
+    assert len(result["values"]) == 61
+    assert result["values"][:4] == [None, 12.5, None, None]
+    print("✅ Empty error rate buckets are null")
+
+
+def test_visitor_sketches_merge_per_bucket():
+    """Hourly visitor sketches are merged within each day"""
+    result = series(
+        "unique_visitors",
+        "day",
+        24,
+        [(0, sketch("1.1.1.1", "2.2.2.2")), (0, sketch("2.2.2.2")), (1, sketch("3"))],
+    )
+
+    assert result["values"] == [2, 1]
+    print("✅ Visitor sketches merged per bucket")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Time Series Tests...\n")
+
+    test_buckets_align_like_date_trunc()
+    test_hour_and_day_buckets_read_rollups()
+    test_minute_buckets_read_raw_rows()
+    test_gaps_are_filled()
+    test_empty_error_rate_buckets_are_null()
+    test_visitor_sketches_merge_per_bucket()
+
+    print("\n✅ All time series tests passed!")
@@ -0,0 +1,151 @@
+"""
+Unit tests for Space-Saving top-k summaries
+"""
+
+import os
+import random
+import sys
+from collections import Counter
+
+import pytest
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from topk import SpaceSaving
+
+
+def zipf_stream(n, items=2000, seed=7):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, items + 1)]
+    return rng.choices([f"/page/{i}" for i in range(items)], weights, k=n)
+
+
+def test_counts_are_exact_below_capacity():
+    """Nothing is evicted while there are fewer items than counters"""
+    summary = SpaceSaving(capacity=10)
+    for item in ["/a", "/b", "/a", "/c", "/a", "/b"]:
+        summary.add(item)
+
+    assert summary.top() == [("/a", 3), ("/b", 2), ("/c", 1)]
+    assert summary.floor == 0
+    assert set(summary.errors.values()) == {0}
+    print("✅ Exact counts below capacity")
+
+
+def test_eviction_inherits_smallest_count():
+    """A new item replaces the smallest counter and records it as error"""
+    summary = SpaceSaving(capacity=2)
+    summary.add("/a", 5)
+    summary.add("/b", 2)
+    summary.add("/c")
+
+    assert summary.counts == {"/a": 5, "/c": 3}
+    assert summary.errors == {"/a": 0, "/c": 2}
+    print("✅ Evictions inherit the smallest count")
+
+
+def test_eviction_picks_the_minimum():
+    """Every eviction removes a smallest counter, however counts moved since"""
+    rng = random.Random(3)
+    summary = SpaceSaving(capacity=20)
+    stream = zipf_stream(5000, items=200)
+    summary.add("/merged", 2)
+    summary.merge(SpaceSaving.from_dict(summary.to_dict()))
+
+    for item in stream:
+        weight = rng.choice([1, 1, 1, 10])
+        if item not in summary.counts and len(summary.counts) == summary.capacity:
+            smallest = min(summary.counts.values())
+            before = dict(summary.counts)
+            summary.add(item, weight)
+            [evicted] = set(before) - set(summary.counts)
+            assert before[evicted] == smallest
+            assert summary.errors[item] == smallest
+        else:
+            summary.add(item, weight)
+    print("✅ Evictions pick the smallest counter")
+
+
+def test_heavy_hitters_found_in_skewed_stream():
+    """Top items of a Zipf stream are found with bounded overestimates"""
+    stream = zipf_stream(50000)
+    exact = Counter(stream)
+    summary = SpaceSaving(capacity=100)
+    for item in stream:
+        summary.add(item)
+
+    top = summary.top(10)
+    assert [item for item, _ in top] == [item for item, _ in exact.most_common(10)]
+    for item, count in top:
+        assert exact[item] <= count <= exact[item] + summary.errors[item]
+        assert summary.errors[item] <= len(stream) / summary.capacity
+    print("✅ Heavy hitters found in a skewed stream")
+
+
+def test_union_matches_single_summary():
+    """Merging per-hour summaries agrees with summarizing the whole stream"""
+    stream = zipf_stream(30000)
+    exact = Counter(stream)
+    hours = [SpaceSaving(capacity=200) for _ in range(3)]
+    for i, item in enumerate(stream):
+        hours[i % 3].add(item)
+
+    merged = SpaceSaving.union(hours)
+
+    assert [item for item, _ in merged.top(10)] == [
+        item for item, _ in exact.most_common(10)
+    ]
+    for item, count in merged.top(10):
+        assert count - merged.errors[item] <= exact[item] <= count
+    print("✅ Unions keep the top items")
+
+
+def test_union_of_unfilled_summaries_is_exact():
+    """Summaries below capacity merge into exact counts"""
+    first = SpaceSaving(capacity=5)
+    second = SpaceSaving(capacity=5)
+    first.add("/a", 2)
+    second.add("/a", 1)
+    second.add("/b", 4)
+
+    first.merge(second)
+
+    assert first.top() == [("/b", 4), ("/a", 3)]
+    assert SpaceSaving.union([]).top() == []
+    print("✅ Unfilled summaries merge exactly")
+
+
+def test_serialization_round_trip():
+    """Summaries survive the JSON form stored in the database"""
+    summary = SpaceSaving(capacity=2)
+    for item in ["/a", "/a", "/b", "/c"]:
+        summary.add(item)
+
+    restored = SpaceSaving.from_dict(summary.to_dict())
+
+    assert restored.capacity == 2
+    assert restored.counts == summary.counts
+    assert restored.errors == summary.errors
+    print("✅ Summaries round-trip through JSON")
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        SpaceSaving(capacity=0)
+    print("✅ Capacity validated")
+
+
+if __name__ == "__main__":
+    print("🧪 Running Top-K Tests...\n")
+
+    test_counts_are_exact_below_capacity()
+    test_eviction_inherits_smallest_count()
+    test_eviction_picks_the_minimum()
+    test_heavy_hitters_found_in_skewed_stream()
+    test_union_matches_single_summary()
+    test_union_of_unfilled_summaries_is_exact()
+    test_serialization_round_trip()
+    test_capacity_must_be_positive()
+
+    print("\n✅ All top-k tests passed!")
@@ -0,0 +1,212 @@
+"""
+Endpoint tests for /track/batch and /track/beacon
+"""
+
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# Add analytics module to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "analytics"))
+
+from app import app
+from auth import RateLimiter
+from config import settings
+from database import Base, Event, PageView, get_db
+
+
+@pytest.fixture
+def test_db():
+    """In-memory database, with rate limit checks that always pass"""
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    TestingSession = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_db():
+        async with TestingSession() as db:
+            yield db
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    app.dependency_overrides[get_db] = override_get_db
+    asyncio.run(setup())
+
+    with patch.object(
+        RateLimiter.backend, "check", AsyncMock(return_value=True)
+    ) as check:
+        yield TestingSession, check
+
+    app.dependency_overrides.clear()
+    asyncio.run(engine.dispose())
+
+
+def stored_rows(TestingSession):
+    """(page_views, events) row counts"""
+
+    async def count():
+        async with TestingSession() as db:
+            return (
+                await db.scalar(select(func.count()).select_from(PageView)),
+                await db.scalar(select(func.count()).select_from(Event)),
+            )
+
+    return asyncio.run(count())
+
+
+def batch(count):
+    return {
+        "events": [{"type": "pageview", "path": f"/page/{i}"} for i in range(count - 1)]
+        + [{"type": "link_click", "link_type": "github"}]
+    }
+
+
+def test_valid_batch_is_tracked(test_db):
+    """Page views and events of a batch are stored"""
+    TestingSession, _ = test_db
+    client = TestClient(app)
+
+    response = client.post("/track/batch", json=batch(3))
+
+    assert response.status_code == 200
+    assert response.json() == {"success": True, "tracked": 3}
+    assert stored_rows(TestingSession) == (2, 1)
+    print("✅ Valid batch tracked")
+
+
+def test_oversized_batch_is_rejected(test_db):
+    """Batches over TRACK_BATCH_MAX_EVENTS are rejected before any write"""
+    TestingSession, _ = test_db
+    client = TestClient(app)
+
+    response = client.post(
+        "/track/batch", json=batch(settings.track_batch_max_events + 1)
+    )
+
+    assert response.status_code == 422
+    assert stored_rows(TestingSession) == (0, 0)
+    print("✅ Oversized batch rejected")
+
+
+def test_beacon_accepts_text_plain_json(test_db):
+    """sendBeacon bodies arrive as text/plain and are parsed as JSON"""
+    TestingSession, _ = test_db
+    client = TestClient(app)
+
+    response = client.post(
+        "/track/beacon",
+        content=json.dumps(batch(2)),
+        headers={"content-type": "text/plain;charset=UTF-8"},
+    )
+
+    assert response.status_code == 200
+    assert stored_rows(TestingSession) == (1, 1)
+    print("✅ Beacon batch tracked")
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "not json",
+        '{"events": [{"type": "bogus"}]}',
+        '{"events": []}',
+        json.dumps(batch(settings.track_batch_max_events + 1)),
+        b"\xff\xfe",
+    ],
+)
+def test_malformed_beacon_is_a_client_error(test_db, body):
+    """Invalid beacon bodies get a 422, not a 500"""
+    TestingSession, _ = test_db
+    client = TestClient(app)
+
+    response = client.post(
+        "/track/beacon", content=body, headers={"content-type": "text/plain"}
+    )
+
+    assert response.status_code == 422
+    assert stored_rows(TestingSession) == (0, 0)
+    print("✅ Malformed beacon rejected")
+
+
+def test_batch_events_are_charged_like_single_requests(test_db):
+    """Events past the route's up-front cost are charged once counted"""
+    TestingSession, check = test_db
+    client = TestClient(app)
+
+    # "/track/" costs 1 and "/track/batch" 5 by default
+    client.post("/track/batch", json=batch(12))
+    client.post("/track/batch", json=batch(3))
+
+    costs = [call.args[2] for call in check.await_args_list]
+    assert costs == [5, 7, 5]
+    assert stored_rows(TestingSession) == (13, 2)
+    print("✅ Batch events charged per event")
+
+
+def test_batch_over_the_limit_is_rejected(test_db):
+    """A batch whose events exceed the limit is not stored"""
+    TestingSession, check = test_db
+    check.side_effect = [True, False]
+    client = TestClient(app)
+
+    response = client.post("/track/batch", json=batch(20))
+
+    assert response.status_code == 429
+    assert stored_rows(TestingSession) == (0, 0)
+    print("✅ Batch over the limit rejected")
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/track/pageview", {"site": "portfolio", "path": "/\u0000"}),
+        ("/track/batch", {"events": [{"type": "pageview", "path": "/\u0000"}]}),
+        ("/track/link-click", {"link_type": "github", "metadata": {"a\u0000": 1}}),
+        ("/track/scroll", {"path": "/\u0000", "scroll_percentage": 50}),
+    ],
+)
+def test_nul_characters_are_rejected(test_db, path, body):
+    """Rows Postgres cannot store are turned away at the request"""
+    TestingSession, _ = test_db
+    client = TestClient(app)
+
+    response = client.post(path, json=body)
+
+    assert response.status_code == 422
+    assert stored_rows(TestingSession) == (0, 0)
+    print("✅ NUL characters rejected")
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/track/link-click", {"site": None, "path": 5, "link_type": "github"}),
+        ("/track/scroll", {"site": None, "path": 5, "scroll_percentage": 50}),
+    ],
+)
+def test_loosely_typed_events_are_tracked(test_db, path, body):
+    """The untyped event endpoints coerce site and path instead of failing"""
+    TestingSession, _ = test_db
+    client = TestClient(app)
+
+    response = client.post(path, json=body)
+
+    async def stored_event():
+        async with TestingSession() as db:
+            return (await db.execute(select(Event.site, Event.path))).one()
+
+    assert response.status_code == 200
+    assert tuple(asyncio.run(stored_event())) == ("portfolio", "5")
+    print("✅ Loosely typed events tracked")